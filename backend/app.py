@@ -1,49 +1,78 @@
 import logging
-from logging.handlers import RotatingFileHandler
 import os
+import threading
+import time
 from flask import Flask, jsonify
 from flask_cors import CORS  # Add this import
 from flask_jwt_extended import JWTManager
-from backend.routes import auth, conversation, llm, prompts
-from backend.models import db, User  # Adjust the import path based on your project structure
+from backend.routes import auth, conversation, evals, llm, prompts, search
+from backend.models import db, configure_engine  # Adjust the import path based on your project structure
+from backend.migrations import register_commands
+from backend import metrics, responses
 from backend.config import config
-
-# Configure logging
-log_directory = 'logs'
-if not os.path.exists(log_directory):
-    os.makedirs(log_directory)
-log_file = os.path.join(log_directory, 'backend.log')
+from backend.services.title_service import title_workers
+from backend.services.evals import eval_runner
+from backend.services.blobs import blob_store
+from backend.services import providers
+from backend.services.response_cache import response_cache
+from backend.services.single_flight import flights, async_flights
+from backend.services.scheduler import scheduler
+from backend.services.auth_cache import conversation_owners, token_claims
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
-
-file_handler = RotatingFileHandler(log_file, maxBytes=10240, backupCount=10)
-file_handler.setFormatter(logging.Formatter(
-    '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'
-))
-file_handler.setLevel(logging.DEBUG)
-
-logger.addHandler(file_handler)
 
 def create_app(config_name='default'):
     app = Flask(__name__)
     app.config.from_object(config[config_name])
     config[config_name].init_app(app)  # Make sure this line is present
     
+    # Request, database and upstream metrics on /metrics
+    metrics.init_app(app)
+
+    # Faster JSON encoding, compression and conditional GET helpers
+    responses.init_app(app)
+
     # Enable CORS for all routes
     CORS(app)  # Add this line
     
     # Initialize database
     db.init_app(app)
+    configure_engine(app)
+    # Long message and prompt text is stored compressed and deduplicated
+    blob_store.init_app(app)
+    register_commands(app)
+
+    # Conversation titles are generated in the background
+    title_workers.init_app(app)
+
+    # Batch eval jobs run on a background thread pool
+    eval_runner.init_app(app)
+
+    # Deterministic completions are served from cache
+    response_cache.init_app(app)
 
-    # Initialize JWT
+    # Identical in-flight generate calls can share one upstream call
+    flights.init_app(app)
+    async_flights.init_app(app)
+
+    # Providers are imported on first use unless preloaded here
+    providers.init_app(app)
+
+    # Upstream calls are rate limited, retried and can fall back to other models
+    scheduler.init_app(app)
+
+    # Initialize JWT; verified tokens and conversation owners are cached
     jwt = JWTManager(app)
+    token_claims.init_app(app)
+    conversation_owners.init_app(app)
 
     # Register blueprints
     app.register_blueprint(auth.bp, url_prefix='/auth')
     app.register_blueprint(conversation.bp, url_prefix='/api')
     app.register_blueprint(llm.bp, url_prefix='/api')
     app.register_blueprint(prompts.bp, url_prefix='/api')
+    app.register_blueprint(search.bp, url_prefix='/api')
+    app.register_blueprint(evals.bp, url_prefix='/api')
 
     @app.route('/')
     def index():
@@ -62,22 +91,25 @@ def create_app(config_name='default'):
 
     return app
 
-if __name__ == '__main__':
-    app = create_app()
-    with app.app_context():
-        db.create_all()
-        if not User.query.filter_by(username='admin').first():
-            admin_user = User(username='admin')
-            admin_user.set_password('pw')
-            db.session.add(admin_user)
-            db.session.commit()
-            logger.info(f"Admin user created with username: admin")
-        else:
-            logger.info("Admin user already exists")
-        
-        users = User.query.all()
-        for user in users:
-            logger.info(f"User in database: {user.username}")
+def drain_background_work(timeout):
+    """Finish work handed off by requests; called once a worker stops serving."""
+    deadline = time.monotonic() + timeout
 
+    def remaining():
+        return max(0, deadline - time.monotonic())
+
+    # ThreadPoolExecutor.shutdown cannot time out, so wait for it on a
+    # daemon thread that is abandoned at the deadline
+    batches = threading.Thread(target=llm._batch_executor.shutdown, name='drain-batches', daemon=True)
+    batches.start()
+    batches.join(remaining())
+    # Running eval jobs checkpoint and stop; they can be resumed later
+    eval_runner.shutdown(remaining())
+    title_workers.shutdown(remaining())
+
+if __name__ == '__main__':
+    # Development server only; use `python -m backend.serve` in production and
+    # `flask --app backend.app init-db` to create the schema
+    app = create_app(os.environ.get('FLASK_CONFIG', 'default'))
     port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port, debug=True)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=port, debug=app.debug)
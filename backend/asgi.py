@@ -0,0 +1,359 @@
+"""ASGI entry point.
+
+The generate endpoints are served natively on the event loop through
+``backend.services.async_providers``, so an in-flight upstream call costs a
+coroutine rather than a worker thread. Every other route falls through to the
+regular Flask app, run on a bounded thread pool by ``_WsgiBridge``.
+
+Run with ``python -m backend.serve`` (or ``uvicorn backend.asgi:app``).
+"""
+import asyncio
+import io
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from backend.app import create_app, drain_background_work
+from backend.config import Config
+from backend.logging_config import shutdown_logging
+from backend import metrics
+from backend.generate_requests import coalesce_key, parse_generate_request, response_cache_key
+from backend.responses import sse
+from backend.services import async_providers, providers
+from backend.services.auth_cache import client_key
+from backend.services.compaction import compact_request
+from backend.services.response_cache import response_cache
+from backend.services.scheduler import scheduler, error_status, INTERACTIVE_PRIORITY
+from backend.services.single_flight import async_flights
+
+logger = logging.getLogger(__name__)
+
+class _WsgiBridge:
+    """Serve a WSGI app from ASGI on a bounded thread pool.
+
+    Used instead of asgiref's ``WsgiToAsgi``, which intermittently fails
+    requests on keep-alive connections under uvicorn ("CurrentThreadExecutor
+    already quit or is broken"). Response chunks are sent as the WSGI
+    iterable yields them, so streamed Flask responses stay streamed.
+    """
+
+    def __init__(self, wsgi_app, threads):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='wsgi')
+
+    async def __call__(self, scope, receive, send):
+        body = bytearray()
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            body += message.get('body', b'')
+            more_body = message.get('more_body', False)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self._run, scope, bytes(body), send, loop)
+
+    def _run(self, scope, body, send, loop):
+        def push(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and response.get('started'):
+                raise exc_info[1].with_traceback(exc_info[2])
+            response['start'] = {
+                'type': 'http.response.start',
+                'status': int(status.split(' ', 1)[0]),
+                'headers': [(name.lower().encode('latin1'), value.encode('latin1')) for name, value in headers],
+            }
+
+        result = self.wsgi_app(self._environ(scope, body), start_response)
+        try:
+            for chunk in result:
+                if not response.get('started'):
+                    push(response['start'])
+                    response['started'] = True
+                if chunk:
+                    push({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            if not response.get('started'):
+                push(response['start'])
+            push({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+    @staticmethod
+    def _environ(scope, body):
+        server = scope.get('server') or ('localhost', 80)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf8').decode('latin1'),
+            'PATH_INFO': scope['path'].encode('utf8').decode('latin1'),
+            'QUERY_STRING': scope['query_string'].decode('latin1'),
+            'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        if scope.get('client'):
+            environ['REMOTE_ADDR'] = scope['client'][0]
+        for name, value in scope.get('headers', []):
+            name = name.decode('latin1')
+            key = name.upper().replace('-', '_')
+            if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                key = f'HTTP_{key}'
+            value = value.decode('latin1')
+            environ[key] = f"{environ[key]},{value}" if key in environ and key.startswith('HTTP_') else value
+        return environ
+
+flask_app = create_app(os.environ.get('FLASK_CONFIG', 'default'))
+_wsgi = _WsgiBridge(flask_app, Config.WSGI_THREADS)
+
+# Flask-CORS only covers the routes that fall through to Flask, so the native
+# handlers add the same permissive header themselves.
+_CORS_HEADER = (b'access-control-allow-origin', b'*')
+
+async def _read_body(receive):
+    body = b''
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get('body', b'')
+        more_body = message.get('more_body', False)
+    return body
+
+def _replay(body):
+    """A ``receive`` callable that hands an already-read body to another app."""
+    async def receive():
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+    return receive
+
+async def _send_json(send, payload, status=200):
+    body = json.dumps(payload).encode()
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(body)).encode()),
+            _CORS_HEADER,
+        ],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+async def _to_flask(scope, body, send):
+    """Hand a native route's request to the Flask app, which records its own request metrics."""
+    scope['metrics.timed_by_flask'] = True
+    return await _wsgi(scope, _replay(body), send)
+
+def _client_key(scope):
+    """Who the scheduler queues this request for: the signed-in user, else their address."""
+    authorization = None
+    for name, value in scope.get('headers', []):
+        if name == b'authorization':
+            authorization = value.decode('latin1')
+    address = scope['client'][0] if scope.get('client') else None
+    with flask_app.app_context():
+        return client_key(authorization, address)
+
+async def _generate(scope, receive, send):
+    try:
+        body = await _read_body(receive)
+        data = json.loads(body or b'{}')
+        request_args = parse_generate_request(data)
+    except Exception as e:
+        logger.error("Error in async generate: %s", e)
+        return await _send_json(send, {"error": "An error occurred while processing the request"}, 500)
+    if data.get('conversationId') is not None:
+        # History and saving the turn need the database and auth, so
+        # conversation-based requests are served by the Flask route
+        return await _to_flask(scope, body, send)
+
+    model = request_args[0]
+    if providers.provider_for(model) is None:
+        return await _send_json(send, {"error": "Invalid model selected"}, 400)
+
+    key = response_cache_key(data, request_args)
+    cached = response_cache.get(key) if key is not None else None
+    if cached is not None:
+        return await _send_json(send, {"response": cached, "cached": True})
+
+    start = time.perf_counter()
+    upstream_args = compact_request(request_args)
+    flight_key = coalesce_key(data, request_args, key)
+    client, priority = _client_key(scope), INTERACTIVE_PRIORITY
+
+    async def call_upstream():
+        try:
+            content, served_by = await scheduler.agenerate(async_providers.generate, upstream_args, client, priority)
+        except Exception:
+            metrics.observe_upstream(model, time.perf_counter() - start, error=True)
+            raise
+        metrics.observe_upstream(served_by, time.perf_counter() - start,
+                                 metrics.prompt_chars(*upstream_args[1:4]), content)
+        # The key names the requested model, so fallback answers are not cached
+        if key is not None and served_by == model:
+            response_cache.set(key, content)
+        return content, served_by
+
+    try:
+        if flight_key is None:
+            (response_content, served_by), coalesced = await call_upstream(), False
+        else:
+            (response_content, served_by), coalesced = await async_flights.do(flight_key, call_upstream)
+    except Exception as e:
+        return await _send_json(send, {"error": str(e)}, error_status(e))
+
+    body = {"response": response_content}
+    if served_by != model:
+        body["servedBy"] = served_by
+    if coalesced:
+        body["coalesced"] = True
+        metrics.observe_coalesced(model, 'generate')
+    await _send_json(send, body)
+
+async def _generate_stream(scope, receive, send):
+    try:
+        body = await _read_body(receive)
+        data = json.loads(body or b'{}')
+        request_args = parse_generate_request(data)
+    except Exception as e:
+        logger.error("Error in async generate_stream: %s", e)
+        return await _send_json(send, {"error": "An error occurred while processing the request"}, 500)
+    if data.get('conversationId') is not None:
+        return await _to_flask(scope, body, send)
+
+    model = request_args[0]
+    if providers.provider_for(model) is None:
+        return await _send_json(send, {"error": "Invalid model selected"}, 400)
+    key = response_cache_key(data, request_args)
+    cached = response_cache.get(key) if key is not None else None
+    if cached is None:
+        try:
+            upstream_args = compact_request(request_args)
+        except Exception as e:
+            logger.error("Error in async generate_stream: %s", e)
+            return await _send_json(send, {"error": "An error occurred while processing the request"}, 500)
+
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),
+            _CORS_HEADER,
+        ],
+    })
+
+    async def emit(chunk):
+        await send({'type': 'http.response.body', 'body': chunk.encode(), 'more_body': True})
+
+    start = time.perf_counter()
+    if cached is not None:
+        await emit(sse({"delta": cached}))
+        stats = {"model": model, "cached": True, "timeToFirstToken": 0.0, "totalTime": time.perf_counter() - start}
+        await emit(sse(stats, event="done"))
+        return await send({'type': 'http.response.body', 'body': b''})
+
+    client, priority = _client_key(scope), INTERACTIVE_PRIORITY
+
+    def open_stream():
+        return scheduler.astream(async_providers.stream, upstream_args, client, priority)
+
+    deltas, coalesced = open_stream(), False
+    flight_key = coalesce_key(data, request_args, key)
+    if flight_key is not None:
+        deltas, coalesced = async_flights.stream(flight_key, open_stream)
+
+    first_token_at = None
+    chunks = 0
+    # The leader of a coalesced stream caches the text for everyone
+    parts = [] if key is not None and not coalesced else None
+    try:
+        async for delta in deltas:
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+            chunks += 1
+            if parts is not None:
+                parts.append(delta)
+            await emit(sse({"delta": delta}))
+    except Exception as e:
+        logger.error("Error streaming from %s: %s", model, e)
+        if not coalesced:
+            metrics.observe_stream(model, time.perf_counter() - start, None, chunks, error=True)
+        await emit(sse({"error": str(e)}, event="error"))
+    else:
+        if parts is not None:
+            response_cache.set(key, "".join(parts))
+        end = time.perf_counter()
+        ttft = (first_token_at - start) if first_token_at is not None else None
+        generation_time = (end - first_token_at) if first_token_at is not None else 0.0
+        stats = {
+            "model": model,
+            "timeToFirstToken": ttft,
+            "totalTime": end - start,
+            "completionTokens": chunks,
+            "tokensPerSecond": (chunks / generation_time) if generation_time > 0 else None,
+        }
+        if coalesced:
+            stats["coalesced"] = True
+            metrics.observe_coalesced(model, 'stream')
+        else:
+            metrics.observe_stream(model, end - start, ttft, chunks, metrics.prompt_chars(*upstream_args[1:4]))
+        await emit(sse(stats, event="done"))
+    finally:
+        # Releases the upstream stream, and any followers waiting on it,
+        # straight away if the client went away mid-stream
+        await deltas.aclose()
+    await send({'type': 'http.response.body', 'body': b''})
+
+# Named after the Flask endpoints, so request metrics share their labels
+_routes = {
+    '/api/generate': ('llm.generate', _generate),
+    '/api/generate/stream': ('llm.generate_stream', _generate_stream),
+}
+
+async def _timed(endpoint, handler, scope, receive, send):
+    """Run a native handler, recording its request duration as Flask's hooks do for other routes."""
+    start = time.perf_counter()
+
+    async def timed_send(message):
+        if message['type'] == 'http.response.start' and not scope.get('metrics.timed_by_flask'):
+            metrics.observe_request(endpoint, scope['method'], message['status'], time.perf_counter() - start)
+        await send(message)
+    return await handler(scope, receive, timed_send)
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                # In-flight requests have finished by now. uvicorn exits by
+                # re-raising the signal, so atexit hooks do not run; flush
+                # logs here.
+                await asyncio.to_thread(drain_background_work, Config.SERVER_GRACEFUL_TIMEOUT)
+                await async_providers.aclose()
+                shutdown_logging()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    route = _routes.get(scope.get('path'))
+    if scope['type'] == 'http' and scope['method'] == 'POST' and route is not None:
+        if not flask_app.config.get('METRICS_ENABLED', True):
+            return await route[1](scope, receive, send)
+        return await _timed(*route, scope, receive, send)
+    return await _wsgi(scope, receive, send)
@@ -1,34 +1,204 @@
 import os
 import logging
 
+from backend.logging_config import configure_logging
+
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'your-secret-key'
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///your_database.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # Connection pool settings; only used for server databases such as
+    # Postgres; SQLite keeps SQLAlchemy's defaults.
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 20))
+    DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 30))
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+    SQLALCHEMY_ENGINE_OPTIONS = {} if SQLALCHEMY_DATABASE_URI.startswith('sqlite') else {
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': True,
+    }
+
+    # Applied to every new SQLite connection
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000)),
+        'cache_size': -int(os.environ.get('SQLITE_CACHE_KB', 20000)),
+    }
     JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY') or 'your-jwt-secret-key'
+
+    # Per-process auth caches: verified token claims (until expiry) and
+    # conversation owners
+    AUTH_TOKEN_CACHE_SIZE = int(os.environ.get('AUTH_TOKEN_CACHE_SIZE', 10000))
+    AUTH_OWNER_CACHE_SIZE = int(os.environ.get('AUTH_OWNER_CACHE_SIZE', 100000))
+    AUTH_OWNER_CACHE_TTL = float(os.environ.get('AUTH_OWNER_CACHE_TTL', 60))
+    # Werkzeug hash method for new passwords, e.g. 'pbkdf2:sha256:100000' or
+    # 'scrypt:16384:8:1'; unset uses Werkzeug's default. Existing hashes are
+    # upgraded to it on the next successful login. Concurrent checks are
+    # capped so a burst of logins cannot occupy every worker thread.
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD') or None
+    PASSWORD_HASH_CONCURRENCY = int(os.environ.get('PASSWORD_HASH_CONCURRENCY', 4))
+    PASSWORD_HASH_TIMEOUT = float(os.environ.get('PASSWORD_HASH_TIMEOUT', 10))
+
+    # Async provider layer: shared HTTP connection pool and concurrency limits
+    PROVIDER_MAX_CONNECTIONS = int(os.environ.get('PROVIDER_MAX_CONNECTIONS', 200))
+    PROVIDER_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get('PROVIDER_MAX_KEEPALIVE_CONNECTIONS', 50))
+    PROVIDER_TIMEOUT = float(os.environ.get('PROVIDER_TIMEOUT', 120))
+    PROVIDER_CONCURRENCY = int(os.environ.get('PROVIDER_CONCURRENCY', 256))
+    MODEL_CONCURRENCY = int(os.environ.get('MODEL_CONCURRENCY', 64))
+    # Threads running the Flask routes behind the ASGI entry point
+    WSGI_THREADS = int(os.environ.get('WSGI_THREADS', 32))
+
+    # Models are routed to providers by name prefix, and each provider's SDK
+    # is imported on first use; see backend/services/providers.py.
+    # MODEL_PROVIDERS adds providers as "name=module:prefix,prefix;...".
+    # PRELOAD_PROVIDERS (comma-separated names) are imported at startup
+    # instead, before workers fork when SERVER_PRELOAD is on.
+    MODEL_PROVIDERS = os.environ.get('MODEL_PROVIDERS', '')
+    PRELOAD_PROVIDERS = os.environ.get('PRELOAD_PROVIDERS', '')
+    # In-process llama.cpp models: "llama-<name>" is loaded from
+    # LLAMA_MODEL_DIR/llama-<name>.gguf, keeping at most LLAMA_MAX_MODELS
+    # loaded. LLAMA_THREADS 0 lets llama.cpp choose.
+    LLAMA_MODEL_DIR = os.environ.get('LLAMA_MODEL_DIR', 'models')
+    LLAMA_CONTEXT = int(os.environ.get('LLAMA_CONTEXT', 4096))
+    LLAMA_THREADS = int(os.environ.get('LLAMA_THREADS', 0))
+    LLAMA_GPU_LAYERS = int(os.environ.get('LLAMA_GPU_LAYERS', 0))
+    LLAMA_MAX_MODELS = int(os.environ.get('LLAMA_MAX_MODELS', 1))
+
+    # Upstream scheduling; see backend/services/scheduler.py. Requests and
+    # tokens per minute for each provider (<PROVIDER>_RPM / <PROVIDER>_TPM,
+    # 0 for no limit) apply per worker process. Calls queued longer than
+    # SCHEDULER_QUEUE_TIMEOUT seconds fail with a 429.
+    RATE_LIMITS = {
+        provider: (int(os.environ.get(f'{provider.upper()}_RPM', 0)), int(os.environ.get(f'{provider.upper()}_TPM', 0)))
+        for provider in ('openai', 'anthropic', 'llama', 'stub')
+    }
+    SCHEDULER_QUEUE_TIMEOUT = float(os.environ.get('SCHEDULER_QUEUE_TIMEOUT', 30))
+    UPSTREAM_RETRIES = int(os.environ.get('UPSTREAM_RETRIES', 3))
+    UPSTREAM_BACKOFF_BASE = float(os.environ.get('UPSTREAM_BACKOFF_BASE', 0.5))
+    UPSTREAM_BACKOFF_MAX = float(os.environ.get('UPSTREAM_BACKOFF_MAX', 20))
+    # Send a duplicate of a non-streamed call still running after this
+    # percentile of the model's recent latencies (e.g. 0.95); 0 disables
+    HEDGE_PERCENTILE = float(os.environ.get('HEDGE_PERCENTILE', 0))
+    HEDGE_MIN_SAMPLES = int(os.environ.get('HEDGE_MIN_SAMPLES', 50))
+    # Hedged calls, and hedges, running at once per worker; past either limit
+    # a call is not hedged
+    HEDGE_THREADS = int(os.environ.get('HEDGE_THREADS', 32))
+    # Models to try, in order, once a model keeps failing, e.g.
+    # "gpt-4o=gpt-4o-mini,claude-3-5-sonnet-20240620;claude-3-opus-20240229=claude-3-5-sonnet-20240620"
+    MODEL_FALLBACKS = os.environ.get('MODEL_FALLBACKS', '')
+
+    # /api/generate/batch fan-out: worker threads shared by all batch
+    # requests, targets per request and the default/maximum deadline (seconds)
+    BATCH_MAX_WORKERS = int(os.environ.get('BATCH_MAX_WORKERS', 32))
+    BATCH_MAX_TARGETS = int(os.environ.get('BATCH_MAX_TARGETS', 16))
+    BATCH_DEFAULT_DEADLINE = float(os.environ.get('BATCH_DEFAULT_DEADLINE', 60))
+    BATCH_MAX_DEADLINE = float(os.environ.get('BATCH_MAX_DEADLINE', 300))
+
+    # Batch eval jobs (/api/evals). Datasets and results are kept under
+    # EVAL_DIR (default <instance>/evals), and EVAL_WORKERS threads per
+    # process are shared by all running jobs. Results are checkpointed every
+    # EVAL_CHECKPOINT_ROWS results or EVAL_CHECKPOINT_INTERVAL seconds.
+    EVAL_DIR = os.environ.get('EVAL_DIR')
+    EVAL_WORKERS = int(os.environ.get('EVAL_WORKERS', 16))
+    EVAL_MAX_ROWS = int(os.environ.get('EVAL_MAX_ROWS', 100000))
+    EVAL_CHECKPOINT_ROWS = int(os.environ.get('EVAL_CHECKPOINT_ROWS', 500))
+    EVAL_CHECKPOINT_INTERVAL = float(os.environ.get('EVAL_CHECKPOINT_INTERVAL', 5))
+
+    # Bulk conversation export/import: rows fetched per database round trip,
+    # and records inserted per transaction
+    EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 1000))
+    IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', 1000))
+
+    # Search ranks only the newest SEARCH_RANK_WINDOW message matches of a
+    # query, bounding its cost for very common terms; responses say when
+    # older matches were left out. 0 ranks every match.
+    SEARCH_RANK_WINDOW = int(os.environ.get('SEARCH_RANK_WINDOW', 5000))
+
+    # Message and prompt text of at least BLOB_MIN_SIZE characters is stored
+    # compressed, once per distinct text (0 keeps all text inline), and up
+    # to BLOB_CACHE_CHARS characters of it are cached decompressed per
+    # process.
+    BLOB_MIN_SIZE = int(os.environ.get('BLOB_MIN_SIZE', 1024))
+    BLOB_CACHE_CHARS = int(os.environ.get('BLOB_CACHE_CHARS', 64 * 1024 * 1024))
+
+    # History that would overflow the model's context window has its older
+    # turns summarised locally. COMPACTION_MAX_HISTORY_TOKENS (estimated
+    # tokens) caps it further for every model; 0 leaves only the window.
+    COMPACTION_ENABLED = os.environ.get('COMPACTION_ENABLED', 'true').lower() == 'true'
+    COMPACTION_MAX_HISTORY_TOKENS = int(os.environ.get('COMPACTION_MAX_HISTORY_TOKENS', 0))
+    COMPACTION_SUMMARY_FRACTION = float(os.environ.get('COMPACTION_SUMMARY_FRACTION', 0.25))
+
+    # Background conversation title generation. Set TITLE_QUEUE_PATH to a
+    # SQLite file to keep queued jobs across restarts; worker processes share
+    # it, and a job whose worker has not finished it within TITLE_JOB_LEASE
+    # seconds is handed to another.
+    TITLE_WORKERS = int(os.environ.get('TITLE_WORKERS', 2))
+    TITLE_QUEUE_SIZE = int(os.environ.get('TITLE_QUEUE_SIZE', 100))
+    TITLE_QUEUE_PATH = os.environ.get('TITLE_QUEUE_PATH')
+    TITLE_JOB_LEASE = float(os.environ.get('TITLE_JOB_LEASE', 600))
+
+    # Completion cache for deterministic (temperature 0) generate calls. Set
+    # RESPONSE_CACHE_PATH to a SQLite file to keep entries across restarts;
+    # it holds at most RESPONSE_CACHE_DISK_MAX_ROWS entries (0 for no limit),
+    # the oldest evicted first.
+    RESPONSE_CACHE_ENABLED = os.environ.get('RESPONSE_CACHE_ENABLED', 'true').lower() == 'true'
+    RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 1024))
+    RESPONSE_CACHE_MAX_CHARS = int(os.environ.get('RESPONSE_CACHE_MAX_CHARS', 32 * 1024 * 1024))
+    RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 3600))
+    RESPONSE_CACHE_PATH = os.environ.get('RESPONSE_CACHE_PATH')
+    RESPONSE_CACHE_DISK_MAX_ROWS = int(os.environ.get('RESPONSE_CACHE_DISK_MAX_ROWS', 100000))
+
+    # Identical concurrent generate calls that opt in with "coalesce": true
+    # share one upstream call
+    SINGLE_FLIGHT_ENABLED = os.environ.get('SINGLE_FLIGHT_ENABLED', 'true').lower() == 'true'
     
-    # Logging configuration
+    # Production server (python -m backend.serve). SERVER_WORKER_CLASS is
+    # 'async' (uvicorn workers serving backend.asgi) or 'threads' (gthread
+    # workers serving backend.wsgi). Workers default to one per core.
+    SERVER_BIND = os.environ.get('SERVER_BIND') or f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+    SERVER_WORKERS = int(os.environ.get('WEB_CONCURRENCY', os.cpu_count() or 1))
+    SERVER_WORKER_CLASS = os.environ.get('SERVER_WORKER_CLASS', 'async')
+    SERVER_THREADS = int(os.environ.get('SERVER_THREADS', 16))
+    SERVER_PRELOAD = os.environ.get('SERVER_PRELOAD', 'true').lower() == 'true'
+    SERVER_TIMEOUT = int(os.environ.get('SERVER_TIMEOUT', 60))
+    # How long in-flight requests, including streamed LLM responses, get to
+    # finish after SIGTERM before workers are killed
+    SERVER_GRACEFUL_TIMEOUT = int(os.environ.get('SERVER_GRACEFUL_TIMEOUT', 90))
+    SERVER_KEEPALIVE = int(os.environ.get('SERVER_KEEPALIVE', 5))
+    SERVER_MAX_REQUESTS = int(os.environ.get('SERVER_MAX_REQUESTS', 0))
+
+    # JSON and text responses of at least COMPRESS_MIN_SIZE bytes are
+    # compressed (brotli if installed, else gzip) for clients that accept it
+    COMPRESS_ENABLED = os.environ.get('COMPRESS_ENABLED', 'true').lower() == 'true'
+    COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+    COMPRESS_LEVEL = int(os.environ.get('COMPRESS_LEVEL', 6))
+    COMPRESS_BROTLI_QUALITY = int(os.environ.get('COMPRESS_BROTLI_QUALITY', 4))
+
+    # Prometheus-format metrics on /metrics
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+
+    # Logging configuration. Records go through a queue to a background
+    # listener; see backend/logging_config.py.
     LOG_FILE = 'logs/backend.log'
-    LOG_LEVEL = logging.INFO
+    LOG_LEVEL = getattr(logging, os.environ.get('LOG_LEVEL', 'INFO').upper(), logging.INFO)
     LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-    
+    LOG_JSON = os.environ.get('LOG_JSON', 'true').lower() == 'true'
+    LOG_MAX_BYTES = int(os.environ.get('LOG_MAX_BYTES', 10 * 1024 * 1024))
+    LOG_BACKUP_COUNT = int(os.environ.get('LOG_BACKUP_COUNT', 10))
+    LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+    # Fraction of high-volume DEBUG records (those logged with
+    # extra=HIGH_VOLUME, e.g. once per request) kept; the rest are dropped
+    # before queueing. Other records are never sampled.
+    LOG_DEBUG_SAMPLE_RATE = float(os.environ.get('LOG_DEBUG_SAMPLE_RATE', 0.01))
+
     @staticmethod
     def init_app(app):
-        # Ensure the logs directory exists
-        os.makedirs('logs', exist_ok=True)
-        
-        # Set up file handler
-        file_handler = logging.FileHandler(Config.LOG_FILE)
-        file_handler.setLevel(Config.LOG_LEVEL)
-        file_handler.setFormatter(logging.Formatter(Config.LOG_FORMAT))
-        
-        # Set up console handler
-        console_handler = logging.StreamHandler()
-        console_handler.setLevel(Config.LOG_LEVEL)
-        console_handler.setFormatter(logging.Formatter(Config.LOG_FORMAT))
-        
-        # Configure root logger
-        logging.basicConfig(level=Config.LOG_LEVEL, handlers=[file_handler, console_handler])
+        configure_logging(app.config)
 
 class DevelopmentConfig(Config):
     DEBUG = True
@@ -0,0 +1,49 @@
+"""Parsing of generate request bodies, shared by the WSGI routes, the ASGI
+entry point and eval jobs."""
+from backend.services.response_cache import response_cache, cache_key, is_deterministic
+from backend.services.single_flight import flights
+
+def parse_generate_request(data):
+    """Return ``(model, system_prompt, user_prompt, conversation, settings)`` from a request body."""
+    model = data.get('model', 'gpt-4')
+    system_prompt = data.get('systemPrompt', '')
+    user_prompt = data.get('userPrompt', '')
+    # Extract settings from data
+    settings = {
+        'temperature': data.get('temperature', 1.0),
+        'maxTokens': data.get('maxTokens', 2048),
+        'topP': data.get('topP', 1.0),
+        'frequencyPenalty': data.get('frequencyPenalty', 0.0),
+        'presencePenalty': data.get('presencePenalty', 0.0),
+    }
+    # Ensure conversation messages are in the correct format
+    conversation = [
+        {
+            "role": m.get("role", "unknown"),
+            "content": m.get("content", "")
+        } for m in data.get('conversation', [])
+    ]
+    return model, system_prompt, user_prompt, conversation, settings
+
+def response_cache_key(data, request_args):
+    """Cache key for this request, or None when caching does not apply.
+
+    Clients can opt out with ``"cache": false``; non-deterministic settings
+    always bypass the cache.
+    """
+    if not response_cache.enabled or not data.get('cache', True):
+        return None
+    if not is_deterministic(request_args[4]):
+        response_cache.bypass()
+        return None
+    return cache_key(*request_args)
+
+def coalesce_key(data, request_args, key=None):
+    """Single-flight key for this request, or None unless the client opted in.
+
+    With ``"coalesce": true`` identical concurrent requests share one
+    upstream call and receive the same completion, whatever the temperature.
+    """
+    if not flights.enabled or not data.get('coalesce'):
+        return None
+    return key or cache_key(*request_args)
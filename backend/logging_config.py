@@ -0,0 +1,129 @@
+"""Queue-based logging pipeline.
+
+Request threads only put the raw ``LogRecord`` on a bounded queue. Message
+interpolation, JSON encoding and all handler I/O happen on a background
+``QueueListener`` thread, so log calls cost little more than a queue put
+even at DEBUG level. DEBUG records tagged as high volume
+(``extra=HIGH_VOLUME``, e.g. one per request) are sampled before they are
+queued, and records are dropped (and counted) rather than blocking a
+request when the queue is full.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+_listener = None
+dropped_records = 0
+
+# Pass as ``extra`` to DEBUG calls made on every request, so they are sampled
+HIGH_VOLUME = {'_high_volume': True}
+
+# Attributes every LogRecord has; anything else was passed through ``extra``
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, including any ``extra`` fields."""
+
+    def format(self, record):
+        entry = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'thread': record.threadName,
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+class DebugSampler(logging.Filter):
+    """Let through only a fraction of high-volume DEBUG records; all others pass."""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or self.rate >= 1 or not getattr(record, '_high_volume', False):
+            return True
+        return random.random() < self.rate
+
+class DeferredQueueHandler(QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread.
+
+    The stdlib ``prepare`` formats the message on the calling thread; here the
+    record is queued untouched. Only exception info is rendered eagerly, so a
+    queued record does not keep the failing frames alive; exceptions are rare
+    enough that this stays off the hot path.
+    """
+
+    def prepare(self, record):
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        global dropped_records
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            dropped_records += 1
+
+def configure_logging(config):
+    """Route every logger through one queue to the configured handlers.
+
+    ``config`` is the Flask app config (or any mapping with the LOG_* keys).
+    """
+    global _listener
+    shutdown_logging()
+
+    level = config['LOG_LEVEL']
+    formatter = JsonFormatter() if config['LOG_JSON'] else logging.Formatter(config['LOG_FORMAT'])
+
+    os.makedirs(os.path.dirname(config['LOG_FILE']) or '.', exist_ok=True)
+    file_handler = RotatingFileHandler(
+        config['LOG_FILE'], maxBytes=config['LOG_MAX_BYTES'], backupCount=config['LOG_BACKUP_COUNT']
+    )
+    console_handler = logging.StreamHandler(sys.stderr)
+    for handler in (file_handler, console_handler):
+        handler.setLevel(level)
+        handler.setFormatter(formatter)
+
+    log_queue = queue.Queue(maxsize=config['LOG_QUEUE_SIZE'])
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.setLevel(level)
+    queue_handler.addFilter(DebugSampler(config['LOG_DEBUG_SAMPLE_RATE']))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    _listener = QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+def shutdown_logging():
+    """Flush queued records; safe to call more than once."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+atexit.register(shutdown_logging)
@@ -0,0 +1,277 @@
+"""In-process metrics exposed in Prometheus text format on ``/metrics``.
+
+Counters and histograms keep one shard per thread, so recording a value
+never takes a lock: a thread only ever writes its own shard, and a scrape
+sums copies of every shard. When a thread exits its shard is folded into the
+metric's totals, so short-lived threads do not grow the scrape. Per request the only allocation is the small
+``_RequestStats`` object kept on ``flask.g``.
+
+Request durations are measured to the point the response is returned, so
+for streamed responses they cover time to headers; upstream streaming time
+is recorded separately by ``observe_stream``.
+"""
+import bisect
+import threading
+import time
+import weakref
+
+from flask import Response, g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from backend.services.tokens import chars_to_tokens, estimate_tokens
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+registry = []
+# Extra sample sources, e.g. counters owned by other modules
+_collectors = []
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class _ShardOwner:
+    """Held in a metric's thread-local; collected when its thread exits."""
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._local = threading.local()
+        self._shards = []
+        self._retired = {}  # totals of shards whose threads have exited
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = {}
+            # Taken once per thread, never on the recording path afterwards
+            with self._lock:
+                self._shards.append(shard)
+            self._local.shard = shard
+            # The thread-local drops the owner when the thread exits
+            self._local.owner = _ShardOwner()
+            weakref.finalize(self._local.owner, self._retire, shard)
+        return shard
+
+    def _retire(self, shard):
+        with self._lock:
+            self._shards.remove(shard)
+            self._merge(self._retired, shard)
+
+    def _labels(self, labels):
+        if not labels:
+            return ''
+        pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, labels))
+        return '{' + pairs + '}'
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            shards = [shard.copy() for shard in self._shards]
+            shards.append(self._retired.copy())
+        lines.extend(self._render_samples(shards))
+        return lines
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, *labels):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    @staticmethod
+    def _merge(totals, shard):
+        for labels, value in shard.items():
+            totals[labels] = totals.get(labels, 0) + value
+
+    def _render_samples(self, shards):
+        totals = {}
+        for shard in shards:
+            self._merge(totals, shard)
+        return [f'{self.name}{self._labels(labels)} {value}' for labels, value in sorted(totals.items())]
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = buckets
+
+    def observe(self, value, *labels):
+        shard = self._shard()
+        # [count per bucket..., +Inf bucket, sum]
+        slots = shard.get(labels)
+        if slots is None:
+            slots = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        slots[bisect.bisect_left(self.buckets, value)] += 1
+        slots[-1] += value
+
+    @staticmethod
+    def _merge(totals, shard):
+        for labels, slots in shard.items():
+            slots = list(slots)
+            if labels in totals:
+                totals[labels] = [a + b for a, b in zip(totals[labels], slots)]
+            else:
+                totals[labels] = slots
+
+    def _render_samples(self, shards):
+        totals = {}
+        for shard in shards:
+            self._merge(totals, shard)
+        lines = []
+        for labels, slots in sorted(totals.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), slots[:-1]):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{self._bucket_labels(labels, bound)} {cumulative}')
+            lines.append(f'{self.name}_sum{self._labels(labels)} {slots[-1]}')
+            lines.append(f'{self.name}_count{self._labels(labels)} {cumulative}')
+        return lines
+
+    def _bucket_labels(self, labels, bound):
+        inner = self._labels(labels)[1:-1]
+        le = f'le="{bound}"'
+        return '{' + (f'{inner},{le}' if inner else le) + '}'
+
+REQUEST_DURATION = Histogram(
+    'http_request_duration_seconds', 'Time to produce a response, by route.',
+    ('endpoint', 'method', 'status'))
+DB_QUERIES = Histogram(
+    'db_queries_per_request', 'SQL statements executed per request.',
+    ('endpoint',), buckets=COUNT_BUCKETS)
+DB_QUERY_DURATION = Histogram(
+    'db_query_seconds_per_request', 'Total SQL execution time per request.',
+    ('endpoint',))
+UPSTREAM_LATENCY = Histogram(
+    'llm_upstream_latency_seconds', 'Duration of upstream generation calls.',
+    ('model', 'outcome'))
+UPSTREAM_TTFT = Histogram(
+    'llm_time_to_first_token_seconds', 'Time to the first streamed chunk.',
+    ('model',))
+TOKENS = Counter(
+    'llm_tokens_total', 'Estimated prompt and completion tokens.',
+    ('model', 'kind'))
+COALESCED = Counter(
+    'llm_coalesced_requests_total', 'Generate calls served by an identical in-flight upstream call.',
+    ('model', 'mode'))
+UPSTREAM_RETRIES = Counter(
+    'llm_upstream_retries_total', 'Upstream calls retried after a transient error.',
+    ('model', 'reason'))
+HEDGES = Counter(
+    'llm_hedged_requests_total', 'Hedged upstream calls, by which call answered first.',
+    ('model', 'winner'))
+FALLBACKS = Counter(
+    'llm_fallbacks_total', 'Calls handed to the next model in a fallback chain.',
+    ('model', 'fallback'))
+SCHEDULER_WAIT = Histogram(
+    'llm_scheduler_wait_seconds', 'Time queued for provider rate-limit capacity.',
+    ('provider',))
+
+def observe_request(endpoint, method, status, seconds):
+    """Record a request served outside Flask, e.g. by the native ASGI handlers."""
+    REQUEST_DURATION.observe(seconds, endpoint, method, status)
+
+def observe_upstream(model, seconds, prompt_chars=0, completion=None, error=False):
+    UPSTREAM_LATENCY.observe(seconds, model, 'error' if error else 'ok')
+    if prompt_chars:
+        TOKENS.inc(chars_to_tokens(prompt_chars), model, 'prompt')
+    if completion:
+        TOKENS.inc(estimate_tokens(completion), model, 'completion')
+
+def observe_stream(model, seconds, ttft, chunks, prompt_chars=0, error=False):
+    UPSTREAM_LATENCY.observe(seconds, model, 'error' if error else 'ok')
+    if ttft is not None:
+        UPSTREAM_TTFT.observe(ttft, model)
+    if prompt_chars:
+        TOKENS.inc(chars_to_tokens(prompt_chars), model, 'prompt')
+    if chunks:
+        TOKENS.inc(chunks, model, 'completion')
+
+def observe_coalesced(model, mode):
+    COALESCED.inc(1, model, mode)
+
+def observe_retry(model, reason):
+    UPSTREAM_RETRIES.inc(1, model, reason)
+
+def observe_hedge(model, winner):
+    HEDGES.inc(1, model, winner)
+
+def observe_fallback(model, fallback):
+    FALLBACKS.inc(1, model, fallback)
+
+def observe_scheduler_wait(provider, seconds):
+    SCHEDULER_WAIT.observe(seconds, provider)
+
+def prompt_chars(system_prompt, user_prompt, conversation):
+    return len(system_prompt) + len(user_prompt) + sum(len(m['content']) for m in conversation)
+
+def register_collector(collector):
+    """Add a callable returning ``[(name, type, help, value), ...]`` to scrapes."""
+    _collectors.append(collector)
+
+def render():
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    for collector in _collectors:
+        for name, kind, documentation, value in collector():
+            lines.extend([f'# HELP {name} {documentation}', f'# TYPE {name} {kind}', f'{name} {value}'])
+    return '\n'.join(lines) + '\n'
+
+class _RequestStats:
+    __slots__ = ('start', 'queries', 'query_time')
+
+    def __init__(self, start):
+        self.start = start
+        self.queries = 0
+        self.query_time = 0.0
+
+def _before_request():
+    g._metrics = _RequestStats(time.perf_counter())
+
+def _after_request(response):
+    stats = g.pop('_metrics', None)
+    if stats is not None:
+        endpoint = request.endpoint or 'unmatched'
+        observe_request(endpoint, request.method, response.status_code, time.perf_counter() - stats.start)
+        DB_QUERIES.observe(stats.queries, endpoint)
+        DB_QUERY_DURATION.observe(stats.query_time, endpoint)
+    return response
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('_query_start', []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info['_query_start'].pop()
+    stats = g.get('_metrics') if has_app_context() else None
+    if stats is not None:
+        stats.queries += 1
+        stats.query_time += time.perf_counter() - start
+
+def _handle_error(exception_context):
+    # after_cursor_execute does not run for failed statements
+    connection = exception_context.connection
+    if connection is not None and connection.info.get('_query_start'):
+        connection.info['_query_start'].pop()
+
+def init_app(app):
+    if not app.config.get('METRICS_ENABLED', True):
+        return
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
+
+    @app.route('/metrics')
+    def metrics():
+        return Response(render(), mimetype='text/plain; version=0.0.4')
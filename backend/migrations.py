@@ -0,0 +1,193 @@
+"""Schema migrations and query-plan checks.
+
+``db.create_all()`` only creates missing tables, so columns and indexes added
+to existing tables are applied here. Every migration is idempotent and is
+recorded in ``schema_migrations`` once applied.
+
+    flask --app backend.app init-db
+    flask --app backend.app upgrade-db
+    flask --app backend.app check-query-plans
+    flask --app backend.app pack-blobs
+"""
+import logging
+
+import click
+from sqlalchemy import inspect, text
+
+from backend.config import Config
+from backend.models import db, User, Conversation, EvalJob, Message, Prompt
+from backend.services import lineage, search
+from backend.services.blobs import blob_store
+
+logger = logging.getLogger(__name__)
+
+def _add_column(table, column_ddl):
+    name = column_ddl.split()[0]
+    columns = {c['name'] for c in inspect(db.engine).get_columns(table)}
+    if name not in columns:
+        # "user" is a reserved word on PostgreSQL
+        quoted = db.engine.dialect.identifier_preparer.quote(table)
+        db.session.execute(text(f"ALTER TABLE {quoted} ADD COLUMN {column_ddl}"))
+
+def _create_indexes(*models):
+    for model in models:
+        for index in model.__table__.indexes:
+            index.create(db.engine, checkfirst=True)
+
+def _conversation_forks():
+    _add_column('conversation', 'parent_id INTEGER REFERENCES conversation (id)')
+    _add_column('conversation', 'fork_message_id INTEGER')
+    _add_column('conversation', 'inherited_count INTEGER NOT NULL DEFAULT 0')
+
+def _indexes():
+    _create_indexes(Conversation, Message, Prompt)
+
+def _search_index():
+    search.create_index()
+
+def _list_versions():
+    _add_column('user', 'conversations_version INTEGER NOT NULL DEFAULT 0')
+    _add_column('user', 'prompts_version INTEGER NOT NULL DEFAULT 0')
+
+def _content_blobs():
+    # content_blob itself is created by db.create_all()
+    _add_column('message', 'content_hash VARCHAR(64) REFERENCES content_blob (hash)')
+    _add_column('prompt', 'system_prompt_hash VARCHAR(64) REFERENCES content_blob (hash)')
+    _add_column('prompt', 'user_prompt_hash VARCHAR(64) REFERENCES content_blob (hash)')
+    # Read by the triggers below; see _blob_search_text
+    _add_column('content_blob', 'search_text TEXT')
+    # The triggers now read blob text; the prompt index also moves to a view
+    search.recreate_index('message')
+    search.recreate_index('prompt', drop_table=True)
+
+def _search_owner():
+    # Messages adopted by forks kept their old owner in the index
+    search.recreate_index('message', rebuild=True)
+
+def _blob_search_text():
+    # Until now the SQLite triggers decompressed blobs through blob_text(),
+    # which only the app's own connections registered, and PostgreSQL did
+    # not search blob text at all
+    _add_column('content_blob', 'search_text TEXT')
+    filled = blob_store.fill_search_text()
+    logger.info("Filled search text for %d blobs", filled)
+    search.recreate_index('message', rebuild=True)
+    search.recreate_index('prompt', rebuild=True)
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(text("DROP INDEX IF EXISTS ix_prompt_search"))
+        search.create_index()
+
+MIGRATIONS = [
+    ('0001_conversation_forks', _conversation_forks),
+    ('0002_indexes', _indexes),
+    ('0003_search_index', _search_index),
+    ('0004_list_versions', _list_versions),
+    ('0005_content_blobs', _content_blobs),
+    ('0006_search_owner', _search_owner),
+    ('0007_blob_search_text', _blob_search_text),
+]
+
+def upgrade():
+    """Create missing tables, then apply pending migrations in order."""
+    db.create_all()
+    db.session.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations (id VARCHAR(64) PRIMARY KEY)"
+    ))
+    applied = {row[0] for row in db.session.execute(text("SELECT id FROM schema_migrations"))}
+    for migration_id, migrate in MIGRATIONS:
+        if migration_id in applied:
+            continue
+        logger.info("Applying migration %s", migration_id)
+        migrate()
+        db.session.execute(text("INSERT INTO schema_migrations (id) VALUES (:id)"), {'id': migration_id})
+        db.session.commit()
+    return [m for m, _ in MIGRATIONS if m not in applied]
+
+def hot_queries():
+    """The queries behind the conversation, message, search and prompt endpoints.
+
+    Returns ``{name: (sql, params)}``, built by the same code the routes use
+    rather than written out here, so the check follows the routes as they
+    change. Each must be answered from an index rather than a full table scan.
+    """
+    fork = Conversation(id=2, parent_id=1, fork_message_id=10, inherited_count=5)
+    statements = {
+        'list conversations': lineage.summaries_query(1, 200).filter(Conversation.id < 1000).limit(51),
+        'page messages': lineage.chain_query(Conversation(id=1)).filter(Message.id > 10).limit(101),
+        'fork chain': lineage.chain_query(fork),
+        'fork point': lineage.chain_query(fork).offset(3).limit(1),
+        'newest message': lineage.latest_id_query(1),
+        'find forks': Conversation.query.filter_by(parent_id=1),
+        'list prompts': Prompt.query.filter_by(user_id=1),
+        'list eval jobs': EvalJob.query.filter_by(user_id=1).order_by(EvalJob.id.desc()),
+    }
+    queries = {}
+    for name, statement in statements.items():
+        statement = getattr(statement, 'statement', statement)
+        queries[name] = (str(statement.compile(db.engine, compile_kwargs={'literal_binds': True})), {})
+    queries['search'] = search.sqlite_statement(1, 'common words')
+    return queries
+
+def query_plan(sql, params=None):
+    """SQLite's plan for ``sql``, one step per item."""
+    return [row[-1] for row in db.session.execute(text(f"EXPLAIN QUERY PLAN {sql}"), params or {})]
+
+def scans_table(plan):
+    # "SCAN <table>" without "USING ... INDEX" is a full table scan; FTS
+    # lookups show as "SCAN <table> VIRTUAL TABLE INDEX ..."
+    return any(step.startswith('SCAN') and 'INDEX' not in step for step in plan)
+
+def check_query_plans():
+    """Return ``{query name: plan}`` for every hot query that scans a table.
+
+    Only SQLite plans are inspected; other backends return no problems.
+    """
+    if db.engine.dialect.name != 'sqlite':
+        return {}
+    problems = {}
+    for name, (sql, params) in hot_queries().items():
+        plan = query_plan(sql, params)
+        if scans_table(plan):
+            problems[name] = plan
+    return problems
+
+def register_commands(app):
+    @app.cli.command('init-db')
+    @click.option('--admin-username', envvar='ADMIN_USERNAME', default='admin', show_default=True)
+    @click.option('--admin-password', envvar='ADMIN_PASSWORD', default=None,
+                  help='Create the admin user with this password if it does not exist.')
+    def init_db_command(admin_username, admin_password):
+        """Bootstrap the database once per deploy, before starting the server."""
+        applied = upgrade()
+        click.echo(f"Applied migrations: {', '.join(applied) or 'none'}")
+        if admin_password and not User.query.filter_by(username=admin_username).first():
+            admin_user = User(username=admin_username)
+            admin_user.set_password(admin_password, Config.PASSWORD_HASH_METHOD)
+            db.session.add(admin_user)
+            db.session.commit()
+            click.echo(f"Created admin user '{admin_username}'")
+
+    @app.cli.command('upgrade-db')
+    def upgrade_db_command():
+        """Create tables and apply pending schema migrations."""
+        applied = upgrade()
+        click.echo(f"Applied migrations: {', '.join(applied) or 'none'}")
+
+    @app.cli.command('pack-blobs')
+    @click.option('--batch-size', default=1000, show_default=True)
+    def pack_blobs_command(batch_size):
+        """Move long message and prompt text saved before the blob store into it."""
+        moved = blob_store.pack(batch_size)
+        click.echo(f"Moved {moved} values into blobs")
+        if moved and db.engine.dialect.name == 'sqlite':
+            click.echo("Run VACUUM to return the freed pages to the filesystem")
+
+    @app.cli.command('check-query-plans')
+    def check_query_plans_command():
+        """Fail if a hot query would scan a whole table."""
+        problems = check_query_plans()
+        for name, plan in problems.items():
+            click.echo(f"{name}: {' / '.join(plan)}", err=True)
+        if problems:
+            raise SystemExit(1)
+        click.echo("All hot queries use indexes")
@@ -1,5 +1,7 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
 from werkzeug.security import generate_password_hash, check_password_hash
+import json
 import logging
 from datetime import datetime, timezone
 
@@ -7,32 +9,91 @@ logger = logging.getLogger(__name__)
 
 db = SQLAlchemy()
 
+def _set_sqlite_pragmas(dbapi_connection, connection_record, pragmas):
+    cursor = dbapi_connection.cursor()
+    for name, value in pragmas.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+def configure_engine(app):
+    """Apply ``SQLITE_PRAGMAS`` to every new SQLite connection.
+
+    WAL lets readers proceed while a write is in progress, and
+    ``synchronous=NORMAL`` is durable enough under WAL while avoiding an
+    fsync per commit. Other backends are configured through
+    ``SQLALCHEMY_ENGINE_OPTIONS`` instead.
+    """
+    with app.app_context():
+        if db.engine.dialect.name != 'sqlite':
+            return
+        pragmas = app.config.get('SQLITE_PRAGMAS', {})
+        event.listen(
+            db.engine, 'connect',
+            lambda dbapi_connection, connection_record: _set_sqlite_pragmas(dbapi_connection, connection_record, pragmas)
+        )
+
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(64), unique=True, nullable=False)
     password_hash = db.Column(db.String(256), nullable=False)  # Increased from 128 to 256
+    # Bumped whenever the user's conversation or prompt list changes; they
+    # back the list endpoints' ETags (see backend/services/list_versions.py)
+    conversations_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    prompts_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     conversations = db.relationship('Conversation', backref='user', lazy='dynamic')
     prompts = db.relationship('Prompt', backref='user', lazy='dynamic')
 
-    def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
-        logger.debug(f"Password set for user: {self.username}")
+    def set_password(self, password, method=None):
+        if method:
+            self.password_hash = generate_password_hash(password, method=method)
+        else:
+            self.password_hash = generate_password_hash(password)
+        logger.debug("Password set for user: %s", self.username)
+
+    def needs_rehash(self, method):
+        """True if the stored hash was made with a different method than ``method``."""
+        return bool(method) and self.password_hash.split('$', 1)[0] != method
 
     def check_password(self, password):
         result = check_password_hash(self.password_hash, password)
-        logger.debug(f"Password check for user {self.username}: {'Success' if result else 'Failure'}")
+        logger.debug("Password check for user %s: %s", self.username, 'Success' if result else 'Failure')
         return result
 
 class Conversation(db.Model):
+    # (user_id, id) serves the per-user listing, which pages by id
+    __table_args__ = (db.Index('ix_conversation_user_id_id', 'user_id', 'id'),)
+
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(100), nullable=True)  # Add this line
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.now(timezone.utc))
+    # Forks share their parent's messages instead of copying them; see
+    # backend/services/lineage.py for how the chain is resolved.
+    parent_id = db.Column(db.Integer, db.ForeignKey('conversation.id'), nullable=True, index=True)
+    fork_message_id = db.Column(db.Integer, nullable=True)  # Last inherited message in the parent's chain
+    inherited_count = db.Column(db.Integer, nullable=False, default=0)
     messages = db.relationship('Message', backref='conversation', lazy='dynamic')
 
+class ContentBlob(db.Model):
+    """Long message or prompt text, stored once per distinct text; see backend/services/blobs.py."""
+    __tablename__ = 'content_blob'
+
+    hash = db.Column(db.String(64), primary_key=True)  # SHA-256 of the UTF-8 text
+    codec = db.Column(db.String(8), nullable=False)  # 'zstd', 'zlib' or 'raw'
+    data = db.Column(db.LargeBinary, nullable=False)
+    size = db.Column(db.Integer, nullable=False)  # Uncompressed bytes
+    refcount = db.Column(db.Integer, nullable=False, default=0)
+    # The text uncompressed, for the search index, which cannot decompress
+    search_text = db.Column(db.Text, nullable=True)
+
 class Message(db.Model):
+    # Messages are always read in id order within a conversation
+    __table_args__ = (db.Index('ix_message_conversation_id_id', 'conversation_id', 'id'),)
+
     id = db.Column(db.Integer, primary_key=True)
     content = db.Column(db.Text, nullable=False)
+    # Set when the text is kept in content_blob; content is then empty
+    content_hash = db.Column(db.String(64), db.ForeignKey('content_blob.hash'), nullable=True)
     role = db.Column(db.String(20), nullable=False)
     model = db.Column(db.String(50))
     conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id'), nullable=False)
@@ -42,12 +103,55 @@ class Prompt(db.Model):
     name = db.Column(db.String(100), nullable=False)
     system_prompt = db.Column(db.Text, nullable=False)
     user_prompt = db.Column(db.Text, nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    # As for Message.content_hash
+    system_prompt_hash = db.Column(db.String(64), db.ForeignKey('content_blob.hash'), nullable=True)
+    user_prompt_hash = db.Column(db.String(64), db.ForeignKey('content_blob.hash'), nullable=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
 
-    def to_dict(self):
+    def to_dict(self, texts=None):
+        """``texts`` is ``(system prompt, user prompt)`` as loaded by ``blob_store.prompt_texts``."""
+        system_prompt, user_prompt = texts or (self.system_prompt, self.user_prompt)
         return {
             'id': self.id,
             'name': self.name,
-            'systemPrompt': self.system_prompt,
-            'userPrompt': self.user_prompt
-        }
\ No newline at end of file
+            'systemPrompt': system_prompt,
+            'userPrompt': user_prompt
+        }
+class EvalJob(db.Model):
+    """A batch evaluation of a saved prompt over a dataset; see backend/services/evals.py."""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    # The prompt is copied so later edits or deletes do not change a running job
+    prompt_id = db.Column(db.Integer, nullable=True)
+    system_prompt = db.Column(db.Text, nullable=False)
+    user_prompt = db.Column(db.Text, nullable=False)
+    models = db.Column(db.Text, nullable=False)  # JSON list
+    settings = db.Column(db.Text, nullable=False)  # JSON object
+    status = db.Column(db.String(20), nullable=False, default='pending')
+    total_rows = db.Column(db.Integer, nullable=False, default=0)
+    completed = db.Column(db.Integer, nullable=False, default=0)
+    failed = db.Column(db.Integer, nullable=False, default=0)
+    stats = db.Column(db.Text, nullable=True)  # JSON, per model
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+
+    def to_dict(self, status=None):
+        models = json.loads(self.models)
+        total = self.total_rows * len(models)
+        return {
+            'id': self.id,
+            'promptId': self.prompt_id,
+            'models': models,
+            'settings': json.loads(self.settings),
+            'status': status or self.status,
+            'totalRows': self.total_rows,
+            'total': total,
+            'completed': self.completed,
+            'failed': self.failed,
+            'progress': self.completed / total if total else 0.0,
+            'stats': json.loads(self.stats) if self.stats else {},
+            'error': self.error,
+            'createdAt': self.created_at.isoformat() if self.created_at else None,
+            'updatedAt': self.updated_at.isoformat() if self.updated_at else None,
+        }
@@ -0,0 +1,133 @@
+"""Response encoding: a faster JSON provider, compression and conditional GETs.
+
+``jsonify`` uses orjson when it is installed. The output matches Flask's
+default encoder, except that non-ASCII text is sent as UTF-8 rather than
+escaped. JSON and text responses of at least ``COMPRESS_MIN_SIZE``
+bytes are compressed with brotli (when installed) or gzip for clients that
+accept it. Streamed responses are left alone.
+
+List endpoints call ``not_modified`` with an ETag built from cheap state (see
+``backend.services.list_versions``) before doing any work, and tag the full
+response with ``tag``. Streaming endpoints encode their events with ``sse``.
+"""
+import gzip
+import json
+
+from flask import current_app, request
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # optional; the standard library encoder is used instead
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # optional; gzip is used instead
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {'application/json', 'text/plain', 'text/html', 'text/csv'}
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask's JSON provider, encoding with orjson.
+
+    Dates are still passed to Flask's ``default`` so they serialize exactly
+    as before. Calls with encoder keyword arguments use the standard library.
+    """
+
+    def _orjson_options(self, indent=False):
+        options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        if indent:
+            options |= orjson.OPT_INDENT_2
+        return options
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=self._orjson_options()).decode()
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        body = orjson.dumps(obj, default=self.default, option=self._orjson_options(indent)) + b'\n'
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+def _encoding():
+    """The content coding to use for this request's response, or None."""
+    if brotli is not None and 'br' in request.accept_encodings:
+        return 'br'
+    if 'gzip' in request.accept_encodings:
+        return 'gzip'
+    return None
+
+def tag(response, etag):
+    """Set a strong ETag on a full response.
+
+    If the body is then compressed, ``_compress`` adds the content coding to
+    the tag, since a compressed body is a different representation. Lists
+    depend on who is asking, so caches must revalidate and key on the
+    Authorization header.
+    """
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.update(('Authorization', 'Accept-Encoding'))
+    return response
+
+def not_modified(etag):
+    """A 304 response if the client already has ``etag``, else None.
+
+    Whether a body is compressed depends on its size, which is not known
+    without building it, so the client may hold the tag with or without the
+    coding it accepts. Either names the current version, and the 304 repeats
+    the one the client sent.
+    """
+    encoding = _encoding()
+    candidates = [f"{etag}-{encoding}", etag] if encoding else [etag]
+    for candidate in candidates:
+        if request.if_none_match.contains_weak(candidate):
+            return tag(current_app.response_class(status=304), candidate)
+    return None
+
+def sse(data, event=None):
+    """Encode ``data`` as one Server-Sent Event, optionally named ``event``."""
+    message = f"data: {json.dumps(data)}\n\n"
+    if event:
+        message = f"event: {event}\n{message}"
+    return message
+
+def _compress(response):
+    if (
+        response.status_code != 200
+        or response.direct_passthrough
+        or response.is_streamed
+        or 'Content-Encoding' in response.headers
+        or response.mimetype not in COMPRESSIBLE_MIMETYPES
+    ):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = _encoding()
+    if encoding is None:
+        return response
+    config = current_app.config
+    data = response.get_data()
+    if len(data) < config.get('COMPRESS_MIN_SIZE', 1024):
+        return response
+    if encoding == 'br':
+        data = brotli.compress(data, quality=config.get('COMPRESS_BROTLI_QUALITY', 4))
+    else:
+        # mtime=0 keeps the output identical for identical input
+        data = gzip.compress(data, compresslevel=config.get('COMPRESS_LEVEL', 6), mtime=0)
+    response.set_data(data)
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f"{etag}-{encoding}", weak)
+    return response
+
+def init_app(app):
+    if orjson is not None:
+        app.json = FastJSONProvider(app)
+    if app.config.get('COMPRESS_ENABLED', True):
+        app.after_request(_compress)
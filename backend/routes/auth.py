@@ -1,51 +1,74 @@
 import logging
+import threading
 from flask import Blueprint, request, jsonify
-from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
+from flask_jwt_extended import create_access_token
 from backend.models import db, User
+from backend.config import Config
+from backend.services.auth_cache import jwt_required, get_jwt_identity
 
 logger = logging.getLogger(__name__)
 
 bp = Blueprint('auth', __name__)
 
+# Password hashing is deliberately CPU-heavy; cap how many run at once
+_hash_slots = threading.BoundedSemaphore(Config.PASSWORD_HASH_CONCURRENCY)
+
 @bp.route('/register', methods=['POST'])
 def register():
     data = request.json
-    logger.info(f"Register attempt for user: {data.get('username')}")
+    logger.info("Register attempt for user: %s", data.get('username'))
     if User.query.filter_by(username=data['username']).first():
-        logger.warning(f"Registration failed: Username {data['username']} already exists")
+        logger.warning("Registration failed: Username %s already exists", data['username'])
         return jsonify({"message": "Username already exists"}), 400
     new_user = User(username=data['username'])
-    new_user.set_password(data['password'])
+    if not _hash_slots.acquire(timeout=Config.PASSWORD_HASH_TIMEOUT):
+        return jsonify({"message": "Server busy, please retry"}), 503
+    try:
+        new_user.set_password(data['password'], Config.PASSWORD_HASH_METHOD)
+    finally:
+        _hash_slots.release()
     db.session.add(new_user)
     db.session.commit()
-    logger.info(f"New user registered: {data['username']}")
+    logger.info("New user registered: %s", data['username'])
     return jsonify({"message": "User registered successfully"}), 201
 
 @bp.route('/login', methods=['POST'])
 def login():
     data = request.json
-    logger.info(f"Login attempt for user: {data.get('username')}")
+    logger.info("Login attempt for user: %s", data.get('username'))
     try:
         user = User.query.filter_by(username=data.get('username')).first()
         if user:
-            logger.debug(f"User found: {user.username}")
-            if user.check_password(data.get('password')):
-                logger.info(f"Login successful for user: {user.username}")
-                access_token = create_access_token(identity=user.id)
+            logger.debug("User found: %s", user.username)
+            if not _hash_slots.acquire(timeout=Config.PASSWORD_HASH_TIMEOUT):
+                logger.warning("Login for user %s rejected: password hashing saturated", user.username)
+                return jsonify({"message": "Server busy, please retry"}), 503
+            try:
+                password_ok = user.check_password(data.get('password'))
+                if password_ok and user.needs_rehash(Config.PASSWORD_HASH_METHOD):
+                    user.set_password(data.get('password'), Config.PASSWORD_HASH_METHOD)
+                    db.session.commit()
+                    logger.info("Password hash upgraded for user: %s", user.username)
+            finally:
+                _hash_slots.release()
+            if password_ok:
+                logger.info("Login successful for user: %s", user.username)
+                # The JWT subject must be a string
+                access_token = create_access_token(identity=str(user.id))
                 return jsonify(token=access_token), 200
             else:
-                logger.warning(f"Login failed: Incorrect password for user {user.username}")
+                logger.warning("Login failed: Incorrect password for user %s", user.username)
                 return jsonify({"message": "Invalid username or password"}), 401
         else:
-            logger.warning(f"Login failed: User {data.get('username')} not found")
+            logger.warning("Login failed: User %s not found", data.get('username'))
             return jsonify({"message": "Invalid username or password"}), 401
     except Exception as e:
-        logger.exception(f"Error during login: {str(e)}")
+        logger.exception("Error during login: %s", e)
         return jsonify({"message": "An error occurred during login"}), 500
 
 @bp.route('/protected', methods=['GET'])
 @jwt_required()
 def protected():
     current_user_id = get_jwt_identity()
-    logger.info(f"Protected route accessed by user ID: {current_user_id}")
+    logger.info("Protected route accessed by user ID: %s", current_user_id)
     return jsonify(logged_in_as=current_user_id), 200
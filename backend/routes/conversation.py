@@ -1,43 +1,124 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, Response, stream_with_context
+from backend.config import Config
 from backend.models import db, Conversation, Message, Prompt
-from flask_jwt_extended import jwt_required, get_jwt_identity
+import io
 import logging
-from backend.services import gpt_service  # Import the GPT service
+from backend.services.title_service import title_workers, heuristic_title, TITLE_MAX_LENGTH
+from backend.responses import not_modified, tag
+from backend.services import archive, lineage, list_versions
+from backend.services.auth_cache import conversation_owners, jwt_required, get_jwt_identity
+from backend.services.blobs import blob_store
 from sqlalchemy.exc import IntegrityError  # Add this import
-from sqlalchemy import desc
+from sqlalchemy import insert, select
 
 logger = logging.getLogger(__name__)
 
 bp = Blueprint('conversation', __name__)
 
-def generate_conversation_title(messages):
-    system_prompt = "You are a helpful assistant that generates short, concise titles for conversations. Please provide a title of 5 words or less based on the following conversation:"
-    conversation_text = "\n".join([f"{m['role']}: {m['content']}" for m in messages])
-    user_prompt = f"Generate a title for this conversation:\n{conversation_text}"
-    
-    title = gpt_service.generate(
-        model="gpt-3.5-turbo",
-        system_prompt=system_prompt,
-        user_prompt=user_prompt,
-        conversation=[],
-        settings={"temperature": 0.7, "maxTokens": 20, "topP": 1, "frequencyPenalty": 0, "presencePenalty": 0}
-    )
-    
-    return title.strip()
+CONVERSATION_PAGE_SIZE = 50
+MAX_CONVERSATION_PAGE_SIZE = 200
+MESSAGE_PAGE_SIZE = 100
+MAX_MESSAGE_PAGE_SIZE = 500
+PREVIEW_CHARS = 200
+IMPORT_READ_BUFFER = 64 * 1024
+
+def _page_args(default_limit, max_limit):
+    """Read ``limit`` and ``cursor`` query parameters, clamping the limit."""
+    limit = request.args.get('limit', default_limit, type=int)
+    cursor = request.args.get('cursor', None, type=int)
+    return max(1, min(limit, max_limit)), cursor
+
+def _queue_title(conversation_id, messages):
+    """Queue title generation for a saved conversation; returns whether it was queued.
+
+    Titles are best-effort: the conversation is already committed, so a
+    failure here is logged and the placeholder title stays.
+    """
+    try:
+        return title_workers.enqueue(conversation_id, messages)
+    except Exception as e:
+        logger.error("Failed to queue title generation for conversation %s: %s", conversation_id, e)
+        return False
+
+def _insert_messages(conversation_id, messages):
+    """Insert a conversation's messages with a single executemany statement."""
+    if not messages:
+        return
+    refs = blob_store.store(message['content'] for message in messages)
+    db.session.execute(insert(Message), [{
+        'role': message['role'],
+        'content': content,
+        'content_hash': content_hash,
+        'model': message.get('model'),
+        'conversation_id': conversation_id
+    } for message, (content, content_hash) in zip(messages, refs)])
 
 @bp.route('/conversations', methods=['GET'])
 @jwt_required()
 def get_conversations():
+    """List conversation summaries, newest first, with keyset pagination.
+
+    Pass the returned ``nextCursor`` as ``cursor`` to fetch the next page.
+    Message counts and last-message previews come from the same query, so a
+    page costs one round trip regardless of how many messages it covers.
+    Unchanged pages are answered with a 304 when the client sends the ETag
+    it was given.
+    """
     user_id = get_jwt_identity()
-    conversations = Conversation.query.filter_by(user_id=user_id).all()
-    return jsonify([{
-        'id': c.id,
+    limit, cursor = _page_args(CONVERSATION_PAGE_SIZE, MAX_CONVERSATION_PAGE_SIZE)
+    etag = list_versions.etag(user_id, 'conversations', limit, cursor)
+    cached = not_modified(etag)
+    if cached is not None:
+        return cached
+
+    query = lineage.summaries_query(user_id, PREVIEW_CHARS)
+    if cursor is not None:
+        query = query.filter(Conversation.id < cursor)
+    rows = query.limit(limit + 1).all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    previews = blob_store.load((row.preview, row.content_hash) for row in rows)
+    return tag(jsonify({
+        'conversations': [{
+            'id': row.id,
+            'title': row.title,
+            'timestamp': row.timestamp.isoformat() if row.timestamp else None,
+            'messageCount': row.message_count,
+            'lastMessage': {'role': row.role, 'preview': preview[:PREVIEW_CHARS]} if row.role else None,
+        } for row, preview in zip(rows, previews)],
+        'nextCursor': rows[-1].id if has_more else None
+    }), etag)
+
+@bp.route('/conversations/<int:conversation_id>/messages', methods=['GET'])
+@jwt_required()
+def get_messages(conversation_id):
+    """Page through a conversation's messages in order, ``limit`` at a time."""
+    user_id = get_jwt_identity()
+    conversation = Conversation.query.filter_by(id=conversation_id, user_id=user_id).first()
+    if not conversation:
+        return jsonify({"message": "Conversation not found"}), 404
+
+    limit, cursor = _page_args(MESSAGE_PAGE_SIZE, MAX_MESSAGE_PAGE_SIZE)
+    query = lineage.chain_query(conversation)
+    if cursor is not None:
+        query = query.filter(Message.id > cursor)
+    messages = query.limit(limit + 1).all()
+
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    contents = blob_store.load((m.content, m.content_hash) for m in messages)
+    return jsonify({
+        'id': conversation.id,
+        'title': conversation.title,
         'messages': [{
+            'id': m.id,
             'role': m.role,
-            'content': m.content,
+            'content': content,
             'model': m.model
-        } for m in c.messages]
-    } for c in conversations])
+        } for m, content in zip(messages, contents)],
+        'nextCursor': messages[-1].id if has_more else None
+    })
 
 @bp.route('/conversations', methods=['POST'])
 @jwt_required()
@@ -46,45 +127,45 @@ def create_conversation():
     data = request.json
     logger = logging.getLogger(__name__)
     try:
-        # Generate a title for the conversation
-        title = generate_conversation_title(data.get('messages', []))
+        # Use a local placeholder title; the real one is generated in the background
+        title = heuristic_title(data.get('messages', []))
 
         new_conversation = Conversation(user_id=user_id, title=title)
         db.session.add(new_conversation)
         db.session.flush()  # This will assign an ID to the new conversation
 
-        for message in data.get('messages', []):
-            new_message = Message(
-                role=message['role'],
-                content=message['content'],
-                conversation_id=new_conversation.id
-            )
-            db.session.add(new_message)
+        _insert_messages(new_conversation.id, data.get('messages', []))
 
+        list_versions.bump(user_id, 'conversations')
         db.session.commit()
-        logger.info(f"Conversation '{title}' saved successfully for user {user_id}")
-        return jsonify({'id': new_conversation.id, 'title': title, 'message': 'Conversation saved successfully'}), 201
+        conversation_owners.remember(new_conversation.id, new_conversation.user_id)
+        title_pending = _queue_title(new_conversation.id, data.get('messages', []))
+        logger.info("Conversation '%s' saved successfully for user %s", title, user_id)
+        return jsonify({'id': new_conversation.id, 'title': title, 'titlePending': title_pending, 'message': 'Conversation saved successfully'}), 201
     except Exception as e:
         db.session.rollback()
-        logger.error(f"Error saving conversation for user {user_id}: {str(e)}")
+        logger.error("Error saving conversation for user %s: %s", user_id, e)
         return jsonify({'error': 'Failed to save conversation'}), 500
 
 @bp.route('/conversations/<int:conversation_id>/messages', methods=['POST'])
 @jwt_required()
 def add_message(conversation_id):
     user_id = get_jwt_identity()
-    conversation = Conversation.query.filter_by(id=conversation_id, user_id=user_id).first()
-    if not conversation:
+    if not conversation_owners.owns(conversation_id, user_id, fresh=True):
         return jsonify({"message": "Conversation not found"}), 404
-    
+
     data = request.json
+    content, content_hash = blob_store.store([data['content']])[0]
     new_message = Message(
         role=data['role'],
-        content=data['content'],
+        content=content,
+        content_hash=content_hash,
         conversation_id=conversation_id
     )
     db.session.add(new_message)
+    list_versions.bump(user_id, 'conversations')
     db.session.commit()
+    lineage.materialized.invalidate(conversation_id)
     return jsonify({'id': new_message.id}), 201
 
 @bp.route('/conversations', methods=['POST'])
@@ -98,37 +179,36 @@ def save_conversation():
     if not messages:
         return jsonify({"error": "No messages provided"}), 400
 
-    logger.info(f"Received title: {title}")
-    # Use the provided title if it exists, otherwise generate one
-    if not title or title.strip() == "":
-        title = generate_conversation_title(messages)
+    logger.info("Received title: %s", title)
+    # Use the provided title if it exists, otherwise use a local placeholder
+    # and generate the real one in the background
+    generate_title = not title or title.strip() == ""
+    if generate_title:
+        title = heuristic_title(messages)
     else:
-        title = title.strip()
+        title = title.strip()[:TITLE_MAX_LENGTH]
 
     try:
         new_conversation = Conversation(user_id=user_id, title=title)
         db.session.add(new_conversation)
         db.session.flush()  # This will assign an ID to the new conversation
 
-        for message in messages:
-            new_message = Message(
-                role=message['role'],
-                content=message['content'],
-                model=message.get('model'),
-                conversation_id=new_conversation.id
-            )
-            db.session.add(new_message)
+        _insert_messages(new_conversation.id, messages)
 
+        list_versions.bump(user_id, 'conversations')
         db.session.commit()
-        logger.info(f"Conversation '{title}' saved successfully for user {user_id}")
+        conversation_owners.remember(new_conversation.id, new_conversation.user_id)
+        title_pending = generate_title and _queue_title(new_conversation.id, messages)
+        logger.info("Conversation '%s' saved successfully for user %s", title, user_id)
         return jsonify({
             "message": "Conversation saved successfully",
             "id": new_conversation.id,
-            "title": title
+            "title": title,
+            "titlePending": title_pending
         }), 201
     except Exception as e:
         db.session.rollback()
-        logger.error(f"Error saving conversation for user {user_id}: {str(e)}")
+        logger.error("Error saving conversation for user %s: %s", user_id, e)
         return jsonify({'error': 'Failed to save conversation'}), 500
 
 from sqlalchemy.exc import IntegrityError
@@ -140,29 +220,39 @@ def delete_conversation(conversation_id):
     try:
         conversation = Conversation.query.filter_by(id=conversation_id, user_id=user_id).first()
         if not conversation:
-            logger.warning(f"Attempt to delete non-existent conversation {conversation_id} by user {user_id}")
+            logger.warning("Attempt to delete non-existent conversation %s by user %s", conversation_id, user_id)
             return jsonify({"error": "Conversation not found or you don't have permission to delete it"}), 404
 
         # Log the conversation details before deletion
-        logger.info(f"Deleting conversation {conversation_id} for user {user_id}. Title: {conversation.title}")
+        logger.info("Deleting conversation %s for user %s. Title: %s", conversation_id, user_id, conversation.title)
+
+        # Hand any messages that forks still share over to one of the forks
+        lineage.detach_forks(conversation)
 
-        # Delete all messages associated with this conversation
+        # Delete all messages associated with this conversation, then any
+        # blobs only they used
+        blob_hashes = db.session.scalars(select(Message.content_hash).where(
+            Message.conversation_id == conversation_id, Message.content_hash.isnot(None)
+        )).all()
         message_count = Message.query.filter_by(conversation_id=conversation_id).delete()
-        logger.info(f"Deleted {message_count} messages for conversation {conversation_id}")
+        blob_store.release(blob_hashes)
+        logger.info("Deleted %s messages for conversation %s", message_count, conversation_id)
         
         # Delete the conversation itself
         db.session.delete(conversation)
+        list_versions.bump(user_id, 'conversations')
         db.session.commit()
+        conversation_owners.pop(conversation_id)
         
-        logger.info(f"Conversation {conversation_id} deleted successfully for user {user_id}")
+        logger.info("Conversation %s deleted successfully for user %s", conversation_id, user_id)
         return jsonify({"message": "Conversation deleted successfully"}), 200
     except IntegrityError as e:
         db.session.rollback()
-        logger.error(f"Database integrity error while deleting conversation {conversation_id}: {str(e)}")
+        logger.error("Database integrity error while deleting conversation %s: %s", conversation_id, e)
         return jsonify({"error": "Database integrity error. Could not delete conversation."}), 500
     except Exception as e:
         db.session.rollback()
-        logger.error(f"Error deleting conversation {conversation_id}: {str(e)}")
+        logger.error("Error deleting conversation %s: %s", conversation_id, e)
         return jsonify({"error": "An error occurred while deleting the conversation"}), 500
 
 @bp.route('/conversations/<int:conversation_id>/fork', methods=['POST'])
@@ -174,36 +264,35 @@ def fork_conversation(conversation_id):
 
     if fork_index is None:
         return jsonify({"error": "Fork index not provided"}), 400
+    if not isinstance(fork_index, int) or isinstance(fork_index, bool) or fork_index < 0:
+        return jsonify({"error": "Fork index must be a non-negative integer"}), 400
 
     try:
         # Get the original conversation
         original_conversation = Conversation.query.filter_by(id=conversation_id).first()
         if not original_conversation:
             return jsonify({"error": "Original conversation not found"}), 404
-
-        # Get messages up to the fork point
-        messages = Message.query.filter_by(conversation_id=conversation_id).order_by(Message.id).limit(fork_index + 1).all()
+        if fork_index >= lineage.chain_length(original_conversation):
+            return jsonify({"error": "Fork index is past the end of the conversation"}), 400
 
         # Generate a new title for the forked conversation
         forked_title = f"Fork of: {original_conversation.title}"
 
-        # Create a new conversation
-        new_conversation = Conversation(user_id=user_id, title=forked_title)
+        # The fork points at the original's chain instead of copying it, so
+        # forking costs the same regardless of history length
+        fork_message_id, inherited_count = lineage.fork_point(original_conversation, fork_index)
+        new_conversation = Conversation(
+            user_id=user_id,
+            title=forked_title,
+            parent_id=original_conversation.id,
+            fork_message_id=fork_message_id,
+            inherited_count=inherited_count
+        )
         db.session.add(new_conversation)
-        db.session.flush()  # This will assign an ID to the new conversation
-
-        # Copy messages to the new conversation
-        for message in messages:
-            new_message = Message(
-                role=message.role,
-                content=message.content,
-                model=message.model,
-                conversation_id=new_conversation.id
-            )
-            db.session.add(new_message)
-
+        list_versions.bump(user_id, 'conversations')
         db.session.commit()
-        logger.info(f"Conversation '{forked_title}' forked successfully for user {user_id}")
+        conversation_owners.remember(new_conversation.id, new_conversation.user_id)
+        logger.info("Conversation '%s' forked successfully for user %s", forked_title, user_id)
         return jsonify({
             "message": "Conversation forked successfully",
             "id": new_conversation.id,
@@ -211,5 +300,59 @@ def fork_conversation(conversation_id):
         }), 201
     except Exception as e:
         db.session.rollback()
-        logger.error(f"Error forking conversation for user {user_id}: {str(e)}")
-        return jsonify({'error': 'Failed to fork conversation'}), 500
\ No newline at end of file
+        logger.error("Error forking conversation for user %s: %s", user_id, e)
+        return jsonify({'error': 'Failed to fork conversation'}), 500
+@bp.route('/conversations/export', methods=['GET'])
+@jwt_required()
+def export_conversations():
+    """Stream every conversation and message the user owns as NDJSON.
+
+    Rows are read with server-side cursors and sent as they are read, so an
+    export of any size runs in constant memory. The format is described in
+    backend/services/archive.py and is what ``/conversations/import`` takes.
+    """
+    user_id = get_jwt_identity()
+    return Response(
+        stream_with_context(archive.export_user(user_id, Config.EXPORT_BATCH_SIZE)),
+        mimetype='application/x-ndjson',
+        headers={'Content-Disposition': 'attachment; filename=conversations.jsonl'}
+    )
+
+@bp.route('/conversations/<int:conversation_id>/export', methods=['GET'])
+@jwt_required()
+def export_conversation(conversation_id):
+    """Stream one conversation, including the history it inherits, as NDJSON."""
+    user_id = get_jwt_identity()
+    conversation = Conversation.query.filter_by(id=conversation_id, user_id=user_id).first()
+    if not conversation:
+        return jsonify({"message": "Conversation not found"}), 404
+    return Response(
+        stream_with_context(archive.export_conversation(conversation, Config.EXPORT_BATCH_SIZE)),
+        mimetype='application/x-ndjson',
+        headers={'Content-Disposition': f'attachment; filename=conversation-{conversation_id}.jsonl'}
+    )
+
+@bp.route('/conversations/import', methods=['POST'])
+@jwt_required()
+def import_conversations():
+    """Import an NDJSON export, sent as the request body or as a ``file`` upload.
+
+    Everything is created as new conversations owned by the caller. Records
+    are read as they arrive and inserted in batches of ``IMPORT_BATCH_SIZE``,
+    each in its own transaction.
+    """
+    user_id = get_jwt_identity()
+    upload = request.files.get('file')
+    # Werkzeug's request stream reads lines a few bytes at a time
+    lines = upload.stream if upload else io.BufferedReader(request.stream, IMPORT_READ_BUFFER)
+    try:
+        imported = archive.import_user(user_id, lines, Config.IMPORT_BATCH_SIZE)
+    except ValueError as e:
+        logger.warning("Import for user %s stopped: %s", user_id, e)
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        logger.error("Error importing conversations for user %s: %s", user_id, e)
+        return jsonify({"error": "Failed to import conversations"}), 500
+    logger.info("Imported %s conversations and %s messages for user %s", imported['conversations'], imported['messages'], user_id)
+    return jsonify({"message": "Conversations imported successfully", **imported}), 201
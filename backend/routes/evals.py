@@ -0,0 +1,154 @@
+import json
+import logging
+from flask import Blueprint, request, jsonify, send_file
+from backend.config import Config
+from backend.models import db, EvalJob, Prompt
+from backend.generate_requests import parse_generate_request
+from backend.services import providers
+from backend.services.auth_cache import jwt_required, get_jwt_identity
+from backend.services.blobs import blob_store
+from backend.services.evals import eval_runner
+
+bp = Blueprint('evals', __name__)
+logger = logging.getLogger(__name__)
+
+def _get_job(job_id):
+    return EvalJob.query.filter_by(id=job_id, user_id=get_jwt_identity()).first()
+
+def _job_dict(job):
+    return job.to_dict(eval_runner.status(job))
+
+def _eval_request():
+    """Return ``(params, dataset rows)`` from a JSON body or a multipart upload.
+
+    Uploads carry the dataset as a ``dataset`` file, with ``models`` and
+    ``settings`` as JSON-encoded form fields.
+    """
+    if request.files.get('dataset'):
+        params = {key: request.form[key] for key in request.form}
+        for key in ('models', 'settings'):
+            if key in params:
+                params[key] = json.loads(params[key])
+        return params, request.files['dataset'].stream
+    params = request.json or {}
+    dataset = params.get('dataset') or []
+    return params, dataset.splitlines() if isinstance(dataset, str) else dataset
+
+@bp.route('/evals', methods=['POST'])
+@jwt_required()
+def create_eval():
+    """Start an eval job running a saved prompt over a dataset.
+
+    Takes ``promptId``, a ``models`` list, optional ``settings`` (the usual
+    generate fields) and ``dataset``: a list of objects or JSONL text, or a
+    JSONL file in a multipart upload. Each row's fields fill the prompt's
+    ``{{name}}`` placeholders. Poll ``GET /evals/<id>`` for progress and
+    download ``/evals/<id>/results`` as JSONL.
+    """
+    user_id = get_jwt_identity()
+    try:
+        params, rows = _eval_request()
+    except ValueError:
+        return jsonify({"message": "models and settings must be JSON"}), 400
+
+    prompt = Prompt.query.filter_by(id=params.get('promptId'), user_id=user_id).first()
+    if not prompt:
+        return jsonify({"message": "Prompt not found"}), 404
+    models = params.get('models') or []
+    if not models or not isinstance(models, list):
+        return jsonify({"message": "No models provided"}), 400
+    if len(models) > Config.BATCH_MAX_TARGETS:
+        return jsonify({"message": f"At most {Config.BATCH_MAX_TARGETS} models can be evaluated at once"}), 400
+    unsupported = [model for model in models if providers.get(model) is None]
+    if unsupported:
+        return jsonify({"message": f"Invalid model selected: {', '.join(unsupported)}"}), 400
+
+    system_prompt, user_prompt = blob_store.prompt_texts([prompt])[0]
+    job = EvalJob(
+        user_id=user_id,
+        prompt_id=prompt.id,
+        system_prompt=system_prompt,
+        user_prompt=user_prompt,
+        models=json.dumps(models),
+        settings=json.dumps(parse_generate_request(params.get('settings') or {})[4]),
+    )
+    db.session.add(job)
+    db.session.commit()
+    try:
+        job.total_rows = eval_runner.save_dataset(job.id, rows)
+        if not job.total_rows:
+            raise ValueError("The dataset is empty")
+    except ValueError as e:
+        db.session.delete(job)
+        db.session.commit()
+        eval_runner.delete_files(job.id)
+        return jsonify({"message": str(e)}), 400
+    eval_runner.start(job)
+    logger.info("Eval job %s started: %d rows x %d models", job.id, job.total_rows, len(models))
+    return jsonify(job=_job_dict(job)), 202
+
+@bp.route('/evals', methods=['GET'])
+@jwt_required()
+def get_evals():
+    jobs = EvalJob.query.filter_by(user_id=get_jwt_identity()).order_by(EvalJob.id.desc()).all()
+    return jsonify(jobs=[_job_dict(job) for job in jobs])
+
+@bp.route('/evals/<int:job_id>', methods=['GET'])
+@jwt_required()
+def get_eval(job_id):
+    """Progress and per-model latency and token stats, as of the last checkpoint."""
+    job = _get_job(job_id)
+    if not job:
+        return jsonify({"message": "Eval job not found"}), 404
+    return jsonify(job=_job_dict(job))
+
+@bp.route('/evals/<int:job_id>/results', methods=['GET'])
+@jwt_required()
+def get_eval_results(job_id):
+    """The results written so far, one JSON object per line."""
+    job = _get_job(job_id)
+    if not job:
+        return jsonify({"message": "Eval job not found"}), 404
+    try:
+        return send_file(eval_runner.path(job.id, 'results.jsonl'), mimetype='application/x-ndjson',
+                         download_name=f'eval-{job.id}.jsonl')
+    except FileNotFoundError:
+        return jsonify({"message": "No results yet"}), 404
+
+@bp.route('/evals/<int:job_id>/cancel', methods=['POST'])
+@jwt_required()
+def cancel_eval(job_id):
+    """Stop a job at its next checkpoint; it can be resumed later."""
+    job = _get_job(job_id)
+    if not job:
+        return jsonify({"message": "Eval job not found"}), 404
+    if job.status not in ('pending', 'running'):
+        return jsonify({"message": f"Eval job is {job.status}"}), 409
+    job.status = 'cancelled'
+    db.session.commit()
+    return jsonify(job=_job_dict(job))
+
+@bp.route('/evals/<int:job_id>/resume', methods=['POST'])
+@jwt_required()
+def resume_eval(job_id):
+    """Continue a cancelled, failed or interrupted job from its last checkpoint."""
+    job = _get_job(job_id)
+    if not job:
+        return jsonify({"message": "Eval job not found"}), 404
+    status = eval_runner.status(job)
+    if status not in ('cancelled', 'failed', 'interrupted') or not eval_runner.start(job):
+        return jsonify({"message": f"Eval job is {status}"}), 409
+    return jsonify(job=_job_dict(job))
+
+@bp.route('/evals/<int:job_id>', methods=['DELETE'])
+@jwt_required()
+def delete_eval(job_id):
+    job = _get_job(job_id)
+    if not job:
+        return jsonify({"message": "Eval job not found"}), 404
+    if eval_runner.is_running(job.id):
+        return jsonify({"message": "Cancel the eval job before deleting it"}), 409
+    db.session.delete(job)
+    db.session.commit()
+    eval_runner.delete_files(job.id)
+    return jsonify({"message": "Eval job deleted successfully"}), 200
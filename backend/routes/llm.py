@@ -1,54 +1,418 @@
-from flask import Blueprint, request, jsonify
-from backend.services import claude_service, gpt_service
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
+from flask import Blueprint, request, jsonify, Response, stream_with_context
+from flask_jwt_extended.exceptions import JWTExtendedException
+from jwt import PyJWTError
+from sqlalchemy import insert
+from backend.config import Config
+from backend import metrics
+from backend.generate_requests import coalesce_key, parse_generate_request, response_cache_key
+from backend.logging_config import HIGH_VOLUME
+from backend.models import db, Conversation, Message
+from backend.responses import sse
+from backend.services import lineage, list_versions
+from backend.services.auth_cache import client_key, conversation_owners, verify_jwt_in_request, get_jwt_identity
+from backend.services.blobs import blob_store
+from backend.services import providers
+from backend.services.response_cache import response_cache
+from backend.services.single_flight import flights
+from backend.services.scheduler import scheduler, error_status, BATCH_PRIORITY, INTERACTIVE_PRIORITY
+from backend.services.compaction import compact_request
 import logging
+import time
+
+logger = logging.getLogger(__name__)
 
 bp = Blueprint('llm', __name__)
 
+# Shared by every /generate/batch request so concurrent batches cannot spawn
+# an unbounded number of threads
+_batch_executor = ThreadPoolExecutor(max_workers=Config.BATCH_MAX_WORKERS, thread_name_prefix='batch-generate')
+
+def _get_service(model):
+    """Return the service module that handles ``model``, or None if unsupported.
+
+    Every service exposes the same ``generate`` and ``stream`` functions, so
+    callers can stay provider-neutral once they have the module. Modules are
+    imported on first use; see backend/services/providers.py.
+    """
+    return providers.get(model)
+
+def _service_generate(model, *args):
+    service = _get_service(model)
+    if service is None:
+        raise ValueError(f"Unsupported model: {model}")
+    return service.generate(model, *args)
+
+def _service_stream(model, *args):
+    service = _get_service(model)
+    if service is None:
+        raise ValueError(f"Unsupported model: {model}")
+    return service.stream(model, *args)
+
+def _client_key():
+    """Who the scheduler queues this request for: the signed-in user, else their address."""
+    return client_key(request.headers.get('Authorization'), request.remote_addr)
+
+def _session_id(data):
+    """The saved conversation a generate request continues, or None."""
+    conversation_id = data.get('conversationId')
+    return int(conversation_id) if conversation_id is not None else None
+
+def _session_history(conversation_id):
+    """Return ``(history, None)`` for the caller's conversation, or ``(None, error response)``.
+
+    Hot conversations are answered from the ownership and chain caches; the
+    chain is only checked against the conversation's newest message.
+    """
+    try:
+        verify_jwt_in_request()
+    except (JWTExtendedException, PyJWTError) as e:
+        return None, (jsonify({"msg": str(e)}), 401)
+    if not conversation_owners.owns(conversation_id, get_jwt_identity()):
+        return None, (jsonify({"error": "Conversation not found"}), 404)
+    chain = lineage.cached_chain(conversation_id)
+    if chain is None:
+        conversation = db.session.get(Conversation, conversation_id)
+        if conversation is None:
+            # Deleted by another worker since its owner was cached
+            conversation_owners.pop(conversation_id)
+            return None, (jsonify({"error": "Conversation not found"}), 404)
+        chain = lineage.get_chain(conversation)
+    return [{"role": m['role'], "content": m['content']} for m in chain], None
+
+def _append_turn(conversation_id, user_prompt, response, model):
+    """Save the user turn and the reply in one transaction and return their ids.
+
+    Raises LookupError if the conversation was deleted since the history was read.
+    """
+    if not conversation_owners.owns(conversation_id, get_jwt_identity(), fresh=True):
+        raise LookupError(f"Conversation {conversation_id} not found")
+    rows = [
+        {'conversation_id': conversation_id, 'role': 'user', 'content': user_prompt, 'model': None},
+        {'conversation_id': conversation_id, 'role': 'assistant', 'content': response, 'model': model},
+    ]
+    try:
+        refs = blob_store.store([user_prompt, response])
+        ids = db.session.scalars(insert(Message).returning(Message.id, sort_by_parameter_order=True), [
+            dict(row, content=content, content_hash=content_hash) for row, (content, content_hash) in zip(rows, refs)
+        ]).all()
+        # The conversation list shows the last message
+        list_versions.bump(get_jwt_identity(), 'conversations')
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    # Keep the session hot: the next turn reads the history from the cache
+    lineage.append(conversation_id, [
+        {'id': id_, 'role': row['role'], 'content': row['content'], 'model': row['model']}
+        for id_, row in zip(ids, rows)
+    ])
+    return ids
+
+def _generate_upstream(upstream_args, key, start, client, priority):
+    """Call the provider through the scheduler, recording metrics and caching the completion.
+
+    Returns the completion and the model that produced it, which is not the
+    requested one if a fallback model answered.
+    """
+    model = upstream_args[0]
+    try:
+        content, served_by = scheduler.generate(_service_generate, upstream_args, client, priority)
+    except Exception:
+        metrics.observe_upstream(model, time.perf_counter() - start, error=True)
+        raise
+    metrics.observe_upstream(served_by, time.perf_counter() - start, metrics.prompt_chars(*upstream_args[1:4]), content)
+    # The key names the requested model, so fallback answers are not cached
+    if key is not None and served_by == model:
+        response_cache.set(key, content)
+    return content, served_by
+
 @bp.route('/generate', methods=['POST'])
 def generate():
+    """Generate a completion.
+
+    Instead of sending the whole ``conversation``, an authenticated client
+    can send ``conversationId`` and only the new turn: the history is read
+    from that saved conversation, and the user turn and reply are appended
+    to it together (their ids are returned as ``messageIds``).
+    """
     try:
         data = request.json
-        model = data.get('model', 'gpt-4')
-        system_prompt = data.get('systemPrompt', '')
-        user_prompt = data.get('userPrompt', '')
-        conversation = data.get('conversation', [])
-        # Extract settings from data
-        settings = {
-            'temperature': data.get('temperature', 1.0),
-            'maxTokens': data.get('maxTokens', 2048),
-            'topP': data.get('topP', 1.0),
-            'frequencyPenalty': data.get('frequencyPenalty', 0.0),
-            'presencePenalty': data.get('presencePenalty', 0.0),
-        }
-        # Ensure conversation messages are in the correct format
-        conversation = [
-            {
-                "role": m.get("role", "unknown"),
-                "content": m.get("content", "")
-            } for m in conversation
-        ]
-        # Log the conversation for debugging
-        logging.debug(f"Processed conversation: {conversation}")
-        # Ensure conversation messages are in the correct format
-        conversation = [
-            {"role": m["role"], "content": m["content"]} for m in conversation
-        ]
+        request_args = parse_generate_request(data)
+        model, system_prompt, user_prompt, conversation, settings = request_args
+        # Log the size only; formatting whole conversations is too costly
+        logger.debug("Processed conversation: %d messages for %s", len(conversation), model, extra=HIGH_VOLUME)
+
+        service = _get_service(model)
+        if service is None:
+            return jsonify({"error": "Invalid model selected"}), 400
 
         try:
-            if model.startswith('gpt-'):
-                response_content = gpt_service.generate(
-                    model, system_prompt, user_prompt, conversation, settings
-                )
-            elif model.startswith('claude-'):
-                response_content = claude_service.generate(
-                    model, system_prompt, user_prompt, conversation, settings
-                )
-            else:
-                return jsonify({"error": "Invalid model selected"}), 400
-
-            return jsonify({"response": response_content})
-        except Exception as e:
-            return jsonify({"error": str(e)}), 500
+            session_id = _session_id(data)
+        except (TypeError, ValueError):
+            return jsonify({"error": "Invalid conversationId"}), 400
+        if session_id is not None:
+            conversation, error = _session_history(session_id)
+            if error is not None:
+                return error
+            request_args = (model, system_prompt, user_prompt, conversation, settings)
+
+        key = response_cache_key(data, request_args)
+        cached = response_cache.get(key) if key is not None else None
+        if cached is not None:
+            body, response_content, served_by = {"response": cached, "cached": True}, cached, model
+        else:
+            start = time.perf_counter()
+            upstream_args = compact_request(request_args)
+            flight_key = coalesce_key(data, request_args, key)
+            client, priority = _client_key(), INTERACTIVE_PRIORITY
+            try:
+                if flight_key is None:
+                    (response_content, served_by), coalesced = _generate_upstream(
+                        upstream_args, key, start, client, priority), False
+                else:
+                    (response_content, served_by), coalesced = flights.do(
+                        flight_key, lambda: _generate_upstream(upstream_args, key, start, client, priority))
+            except Exception as e:
+                return jsonify({"error": str(e)}), error_status(e)
+
+            body = {"response": response_content}
+            if served_by != model:
+                body["servedBy"] = served_by
+            if coalesced:
+                body["coalesced"] = True
+                metrics.observe_coalesced(model, 'generate')
+        if session_id is not None:
+            try:
+                body["messageIds"] = _append_turn(session_id, user_prompt, response_content, served_by)
+            except LookupError:
+                return jsonify({"error": "Conversation not found"}), 404
+        return jsonify(body)
+    except Exception as e:
+        logger.error("Error in generate function: %s", e)
+        return jsonify({"error": "An error occurred while processing the request"}), 500
+
+@bp.route('/generate/stream', methods=['POST'])
+def generate_stream():
+    """Stream a completion as Server-Sent Events.
+
+    Each text chunk is sent as a ``data: {"delta": ...}`` event. A final
+    ``done`` event reports time-to-first-token and throughput, or an
+    ``error`` event is sent if the provider fails mid-stream. With
+    ``conversationId`` the history comes from the saved conversation, as for
+    ``/generate``, and the turn is appended once the stream completes; the
+    ``done`` event carries the new ``messageIds``.
+    """
+    try:
+        data = request.json
+        request_args = parse_generate_request(data)
+        model, system_prompt, user_prompt, conversation, settings = request_args
     except Exception as e:
-        logging.error(f"Error in generate function: {str(e)}")
+        logger.error("Error in generate_stream function: %s", e)
         return jsonify({"error": "An error occurred while processing the request"}), 500
+
+    service = _get_service(model)
+    if service is None:
+        return jsonify({"error": "Invalid model selected"}), 400
+
+    try:
+        session_id = _session_id(data)
+    except (TypeError, ValueError):
+        return jsonify({"error": "Invalid conversationId"}), 400
+    if session_id is not None:
+        conversation, error = _session_history(session_id)
+        if error is not None:
+            return error
+        request_args = (model, system_prompt, user_prompt, conversation, settings)
+
+    key = response_cache_key(data, request_args)
+    cached = response_cache.get(key) if key is not None else None
+    flight_key = coalesce_key(data, request_args, key)
+    client, priority = _client_key(), INTERACTIVE_PRIORITY
+
+    def events():
+        start = time.perf_counter()
+        if cached is not None:
+            yield sse({"delta": cached})
+            stats = {"model": model, "cached": True, "timeToFirstToken": 0.0, "totalTime": time.perf_counter() - start}
+            if session_id is not None:
+                try:
+                    stats["messageIds"] = _append_turn(session_id, user_prompt, cached, model)
+                except Exception as e:
+                    logger.error("Error saving turn to conversation %s: %s", session_id, e)
+                    yield sse({"error": "Failed to save the conversation"}, event="error")
+                    return
+            yield sse(stats, event="done")
+            return
+
+        try:
+            upstream_args = compact_request(request_args)
+        except Exception as e:
+            logger.error("Error compacting the history for %s: %s", model, e)
+            yield sse({"error": "An error occurred while processing the request"}, event="error")
+            return
+
+        # Joined here rather than up front, so a response that is never
+        # iterated cannot leave a flight behind for others to wait on
+        def open_stream():
+            return scheduler.stream(_service_stream, upstream_args, client, priority)
+
+        deltas, coalesced = open_stream(), False
+        if flight_key is not None:
+            deltas, coalesced = flights.stream(flight_key, open_stream)
+
+        first_token_at = None
+        chunks = 0
+        # Only buffer the text when it is going to be cached or saved; the
+        # leader of a coalesced stream caches it for everyone
+        parts = [] if (key is not None and not coalesced) or session_id is not None else None
+        try:
+            for delta in deltas:
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                chunks += 1
+                if parts is not None:
+                    parts.append(delta)
+                yield sse({"delta": delta})
+        except Exception as e:
+            logger.error("Error streaming from %s: %s", model, e)
+            if not coalesced:
+                metrics.observe_stream(model, time.perf_counter() - start, None, chunks, error=True)
+            yield sse({"error": str(e)}, event="error")
+            return
+
+        if parts is not None and key is not None and not coalesced:
+            response_cache.set(key, "".join(parts))
+
+        end = time.perf_counter()
+        ttft = (first_token_at - start) if first_token_at is not None else None
+        generation_time = (end - first_token_at) if first_token_at is not None else 0.0
+        # Providers emit roughly one token per chunk, which is close enough
+        # for a throughput figure without running a tokenizer.
+        tokens_per_second = (chunks / generation_time) if generation_time > 0 else None
+        stats = {
+            "model": model,
+            "timeToFirstToken": ttft,
+            "totalTime": end - start,
+            "completionTokens": chunks,
+            "tokensPerSecond": tokens_per_second,
+        }
+        if coalesced:
+            stats["coalesced"] = True
+            metrics.observe_coalesced(model, 'stream')
+        else:
+            metrics.observe_stream(model, end - start, ttft, chunks, metrics.prompt_chars(*upstream_args[1:4]))
+        if session_id is not None:
+            try:
+                stats["messageIds"] = _append_turn(session_id, user_prompt, "".join(parts), model)
+            except Exception as e:
+                logger.error("Error saving turn to conversation %s: %s", session_id, e)
+                yield sse({"error": "Failed to save the conversation"}, event="error")
+                return
+        logger.info("Streamed %s: ttft=%s tokens=%s tokens/s=%s", model, ttft, chunks, tokens_per_second)
+        yield sse(stats, event="done")
+
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def _run_batch_target(index, data, request_args, client):
+    """Generate one batch target, reporting failures in the result."""
+    start = time.perf_counter()
+    model = request_args[0]
+    result = {"index": index, "model": model}
+    if _get_service(model) is None:
+        result["error"] = "Invalid model selected"
+    else:
+        key = response_cache_key(data, request_args)
+        cached = response_cache.get(key) if key is not None else None
+        if cached is not None:
+            result["response"] = cached
+            result["cached"] = True
+        else:
+            flight_key = coalesce_key(data, request_args, key)
+            priority = BATCH_PRIORITY
+            try:
+                upstream_args = compact_request(request_args)
+                if flight_key is None:
+                    result["response"], served_by = _generate_upstream(upstream_args, key, start, client, priority)
+                else:
+                    (result["response"], served_by), coalesced = flights.do(
+                        flight_key, lambda: _generate_upstream(upstream_args, key, start, client, priority))
+                    if coalesced:
+                        result["coalesced"] = True
+                        metrics.observe_coalesced(model, 'generate')
+                if served_by != model:
+                    result["servedBy"] = served_by
+            except Exception as e:
+                logger.error("Error in batch generate for %s: %s", model, e)
+                result["error"] = str(e)
+    result["latency"] = time.perf_counter() - start
+    return result
+
+@bp.route('/generate/batch', methods=['POST'])
+def generate_batch():
+    """Run one prompt against several models concurrently.
+
+    Takes the usual generate fields plus ``targets``, a list of per-model
+    overrides such as ``{"model": "gpt-4", "temperature": 0}`` (or just a
+    ``models`` list), and an optional ``deadline`` in seconds. Results are
+    streamed as Server-Sent Events in completion order: a ``result`` event
+    per finished target, a ``timeout`` event for each target still running at
+    the deadline, and a final ``done`` event.
+    """
+    data = request.json or {}
+    targets = data.get('targets') or [{'model': model} for model in data.get('models', [])]
+    if not targets:
+        return jsonify({"error": "No models provided"}), 400
+    if len(targets) > Config.BATCH_MAX_TARGETS:
+        return jsonify({"error": f"At most {Config.BATCH_MAX_TARGETS} models can be compared at once"}), 400
+
+    try:
+        deadline = min(float(data.get('deadline', Config.BATCH_DEFAULT_DEADLINE)), Config.BATCH_MAX_DEADLINE)
+        shared = {k: v for k, v in data.items() if k not in ('targets', 'models', 'deadline')}
+        jobs = []
+        for index, target in enumerate(targets):
+            target_data = {**shared, **target}
+            jobs.append((index, target_data, parse_generate_request(target_data)))
+    except Exception as e:
+        logger.error("Error in generate_batch function: %s", e)
+        return jsonify({"error": "An error occurred while processing the request"}), 400
+
+    start = time.perf_counter()
+    client = _client_key()
+    futures = {
+        _batch_executor.submit(_run_batch_target, index, target_data, request_args, client): (index, request_args[0])
+        for index, target_data, request_args in jobs
+    }
+
+    def events():
+        pending = set(futures)
+        try:
+            for future in as_completed(futures, timeout=max(0.0, deadline - (time.perf_counter() - start))):
+                pending.discard(future)
+                yield sse(future.result(), event="result")
+        except FuturesTimeoutError:
+            for future in pending:
+                # Targets that have not started yet are dropped; running
+                # ones finish in the background and are ignored
+                future.cancel()
+                index, model = futures[future]
+                yield sse({"index": index, "model": model, "error": "Deadline exceeded"}, event="timeout")
+        yield sse({
+            "wallTime": time.perf_counter() - start,
+            "completed": len(futures) - len(pending),
+            "timedOut": len(pending),
+        }, event="done")
+
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@bp.route('/generate/cache', methods=['GET'])
+def cache_stats():
+    return jsonify(response_cache.snapshot())
@@ -1,7 +1,10 @@
 import logging
 from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
 from backend.models import db, Prompt
+from backend.responses import not_modified, tag
+from backend.services import list_versions
+from backend.services.auth_cache import jwt_required, get_jwt_identity
+from backend.services.blobs import blob_store
 
 bp = Blueprint('prompts', __name__)
 logger = logging.getLogger(__name__)
@@ -10,23 +13,35 @@ logger = logging.getLogger(__name__)
 @jwt_required()
 def get_prompts():
     user_id = get_jwt_identity()
+    etag = list_versions.etag(user_id, 'prompts')
+    cached = not_modified(etag)
+    if cached is not None:
+        return cached
     prompts = Prompt.query.filter_by(user_id=user_id).all()
-    return jsonify(prompts=[prompt.to_dict() for prompt in prompts])
+    texts = blob_store.prompt_texts(prompts)
+    return tag(jsonify(prompts=[prompt.to_dict(text) for prompt, text in zip(prompts, texts)]), etag)
 
 @bp.route('/prompts', methods=['POST'])
 @jwt_required()
 def create_prompt():
     user_id = get_jwt_identity()
     data = request.json
+    (system_prompt, system_prompt_hash), (user_prompt, user_prompt_hash) = blob_store.store(
+        [data['systemPrompt'], data['userPrompt']]
+    )
     new_prompt = Prompt(
         name=data['name'],
-        system_prompt=data['systemPrompt'],
-        user_prompt=data['userPrompt'],
+        system_prompt=system_prompt,
+        system_prompt_hash=system_prompt_hash,
+        user_prompt=user_prompt,
+        user_prompt_hash=user_prompt_hash,
         user_id=user_id
     )
     db.session.add(new_prompt)
+    list_versions.bump(user_id, 'prompts')
     db.session.commit()
-    return jsonify(message="Prompt saved successfully", prompt=new_prompt.to_dict()), 201
+    prompt = new_prompt.to_dict((data['systemPrompt'], data['userPrompt']))
+    return jsonify(message="Prompt saved successfully", prompt=prompt), 201
 
 @bp.route('/prompts/<int:prompt_id>', methods=['DELETE'])
 @jwt_required()
@@ -34,14 +49,17 @@ def delete_prompt(prompt_id):
     user_id = get_jwt_identity()
     prompt = Prompt.query.filter_by(id=prompt_id, user_id=user_id).first()
     if not prompt:
-        logger.warning(f"Prompt not found: id={prompt_id}, user_id={user_id}")
+        logger.warning("Prompt not found: id=%s, user_id=%s", prompt_id, user_id)
         return jsonify({"message": "Prompt not found"}), 404
     try:
         db.session.delete(prompt)
+        db.session.flush()
+        blob_store.release([prompt.system_prompt_hash, prompt.user_prompt_hash])
+        list_versions.bump(user_id, 'prompts')
         db.session.commit()
-        logger.info(f"Prompt deleted successfully: id={prompt_id}")
+        logger.info("Prompt deleted successfully: id=%s", prompt_id)
         return jsonify({"message": "Prompt deleted successfully"}), 200
     except Exception as e:
         db.session.rollback()
-        logger.error(f"Error deleting prompt: id={prompt_id}, error={str(e)}")
+        logger.error("Error deleting prompt: id=%s, error=%s", prompt_id, e)
         return jsonify({"message": f"Error deleting prompt: {str(e)}"}), 500
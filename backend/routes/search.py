@@ -0,0 +1,41 @@
+import logging
+from flask import Blueprint, request, jsonify
+from backend.logging_config import HIGH_VOLUME
+from backend.services import search as search_service
+from backend.services.auth_cache import jwt_required, get_jwt_identity
+
+bp = Blueprint('search', __name__)
+logger = logging.getLogger(__name__)
+
+SEARCH_PAGE_SIZE = 20
+MAX_SEARCH_PAGE_SIZE = 100
+MAX_QUERY_LENGTH = 256
+
+@bp.route('/search', methods=['GET'])
+@jwt_required()
+def search():
+    """Ranked search over the user's messages, conversation titles and prompts.
+
+    ``q`` is the query; ``types`` optionally restricts results to a
+    comma-separated subset of ``message``, ``conversation`` and ``prompt``.
+    Pass the returned ``nextCursor`` as ``cursor`` to fetch the next page.
+    ``truncated`` is true when only the newest message matches were ranked.
+    """
+    user_id = get_jwt_identity()
+    query = request.args.get('q', '').strip()[:MAX_QUERY_LENGTH]
+    kinds = tuple(k for k in search_service.KINDS
+                  if k in request.args.get('types', ','.join(search_service.KINDS)).split(','))
+    if not query or not kinds:
+        return jsonify({"message": "A query and at least one valid type are required"}), 400
+
+    limit = max(1, min(request.args.get('limit', SEARCH_PAGE_SIZE, type=int), MAX_SEARCH_PAGE_SIZE))
+    offset = max(0, request.args.get('cursor', 0, type=int))
+    results = search_service.search(user_id, query, kinds, limit + 1, offset)
+
+    has_more = len(results) > limit
+    logger.debug("Search for user %s returned %d results", user_id, min(len(results), limit), extra=HIGH_VOLUME)
+    return jsonify({
+        'results': results[:limit],
+        'nextCursor': offset + limit if has_more else None,
+        'truncated': 'message' in kinds and search_service.truncated(user_id, query),
+    })
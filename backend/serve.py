@@ -0,0 +1,105 @@
+"""Production server: gunicorn managing one worker process per core.
+
+    flask --app backend.app init-db     # once per deploy
+    python -m backend.serve
+
+``SERVER_WORKER_CLASS=async`` runs uvicorn workers serving ``backend.asgi``,
+where generate calls are coroutines on the event loop; ``threads`` runs
+gthread workers serving ``backend.wsgi``. The app is imported once in the
+master before forking (``SERVER_PRELOAD``), so workers start quickly and
+share its memory copy-on-write. Anything holding threads or connections is
+re-created in each worker after the fork.
+
+On SIGTERM the master stops accepting connections and workers get
+``SERVER_GRACEFUL_TIMEOUT`` seconds to finish in-flight requests, including
+streamed LLM responses, then drain background batch and title work before
+exiting.
+"""
+import logging
+import os
+
+from gunicorn.app.base import BaseApplication
+
+# Must be set before the app modules read it
+os.environ.setdefault('FLASK_CONFIG', 'production')
+
+from backend.config import Config
+from backend.logging_config import configure_logging, shutdown_logging
+from backend.models import db
+from backend.services.title_service import title_workers
+
+logger = logging.getLogger(__name__)
+
+WORKER_CLASSES = {
+    'async': 'uvicorn.workers.UvicornWorker',
+    'threads': 'gthread',
+}
+
+def _post_fork(server, worker):
+    flask_app = server.app.flask_app
+    if flask_app is None:
+        return
+    # The logging listener thread and any pooled connections belong to the
+    # master; start fresh ones in this process
+    configure_logging(flask_app.config)
+    with flask_app.app_context():
+        db.engine.dispose(close=False)
+    title_workers.start()
+
+def _worker_exit(server, worker):
+    # gunicorn also calls this in the master when it reaps a worker. uvicorn
+    # workers never get here themselves (they exit by re-raising the signal)
+    # and drain in the ASGI lifespan shutdown instead.
+    if os.getpid() != worker.pid:
+        return
+    from backend.app import drain_background_work
+    drain_background_work(Config.SERVER_GRACEFUL_TIMEOUT)
+    logger.info("Worker %s drained", worker.pid)
+    shutdown_logging()
+
+class Server(BaseApplication):
+    def __init__(self, options):
+        self.options = options
+        self.flask_app = None
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        if self.options['preload_app']:
+            # No threads may be running in the master when it forks; each
+            # worker starts its title workers in _post_fork
+            title_workers.autostart = False
+        if Config.SERVER_WORKER_CLASS == 'async':
+            from backend.asgi import app, flask_app
+        else:
+            from backend.wsgi import app
+            flask_app = app
+        self.flask_app = flask_app
+        return app
+
+def options():
+    if Config.SERVER_WORKER_CLASS not in WORKER_CLASSES:
+        raise SystemExit(f"SERVER_WORKER_CLASS must be one of: {', '.join(WORKER_CLASSES)}")
+    return {
+        'bind': Config.SERVER_BIND,
+        'workers': Config.SERVER_WORKERS,
+        'worker_class': WORKER_CLASSES[Config.SERVER_WORKER_CLASS],
+        'threads': Config.SERVER_THREADS,
+        'preload_app': Config.SERVER_PRELOAD,
+        'timeout': Config.SERVER_TIMEOUT,
+        'graceful_timeout': Config.SERVER_GRACEFUL_TIMEOUT,
+        'keepalive': Config.SERVER_KEEPALIVE,
+        'max_requests': Config.SERVER_MAX_REQUESTS,
+        'max_requests_jitter': Config.SERVER_MAX_REQUESTS // 10,
+        'post_fork': _post_fork,
+        'worker_exit': _worker_exit,
+    }
+
+def main():
+    Server(options()).run()
+
+if __name__ == '__main__':
+    main()
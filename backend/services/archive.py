@@ -0,0 +1,268 @@
+"""Bulk export and import of a user's conversations as NDJSON.
+
+An export is a header line, then every conversation, then every message in
+id order:
+
+    {"type": "export", "version": 1}
+    {"type": "conversation", "id": 1, "title": ..., "timestamp": ..., "parentId": null, "forkMessageId": null, "inheritedCount": 0}
+    {"type": "message", "id": 1, "conversationId": 1, "role": ..., "content": ..., "model": ...}
+
+Forks are kept as forks, so shared history is exported once (see
+``backend.services.lineage``). A fork of someone else's conversation cannot
+point at its parent, so it is flattened: the messages it inherits are
+exported as its own. Both directions read and write in batches, so memory
+does not grow with the size of the history.
+
+Import creates new conversations and messages and maps the exported ids to
+the new ones. Messages are inserted in their exported id order, so each fork
+point maps to the last new message at or before it, and every fork's
+chain comes back unchanged.
+"""
+import bisect
+import json
+import logging
+from datetime import datetime
+
+from sqlalchemy import and_, insert, literal, or_, select, union_all, update
+from sqlalchemy.orm import aliased
+
+from backend.models import db, Conversation, Message
+from backend.services import lineage, list_versions
+from backend.services.blobs import blob_store
+
+logger = logging.getLogger(__name__)
+
+VERSION = 1
+# Export lines are sent in chunks of about this many bytes
+CHUNK_BYTES = 64 * 1024
+
+def _line(record):
+    return json.dumps(record, separators=(',', ':')) + '\n'
+
+def _chunked(lines):
+    buffer, size = [], 0
+    for line in lines:
+        buffer.append(line)
+        size += len(line)
+        if size >= CHUNK_BYTES:
+            yield ''.join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield ''.join(buffer)
+
+def _conversation_record(conversation, flatten=False):
+    return {
+        'type': 'conversation',
+        'id': conversation.id,
+        'title': conversation.title,
+        'timestamp': conversation.timestamp.isoformat() if conversation.timestamp else None,
+        'parentId': None if flatten else conversation.parent_id,
+        'forkMessageId': None if flatten else conversation.fork_message_id,
+        'inheritedCount': 0 if flatten else conversation.inherited_count,
+    }
+
+def _message_lines(messages):
+    """Message lines for a result read with ``yield_per``; blobs are loaded a batch at a time."""
+    for rows in messages.partitions():
+        contents = blob_store.load((row.content, row.content_hash) for row in rows)
+        for row, content in zip(rows, contents):
+            yield _line({
+                'type': 'message',
+                'id': row.id,
+                'conversationId': row.conversation_id,
+                'role': row.role,
+                'content': content,
+                'model': row.model,
+            })
+
+def _message_columns(conversation_id=Message.conversation_id):
+    return (Message.id, conversation_id.label('conversation_id'), Message.role, Message.content,
+            Message.content_hash, Message.model)
+
+def export_user(user_id, batch_size):
+    """Yield NDJSON chunks covering every conversation ``user_id`` owns."""
+    def lines():
+        yield _line({'type': 'export', 'version': VERSION})
+
+        parent = aliased(Conversation)
+        conversations = db.session.query(Conversation, parent.user_id).outerjoin(
+            parent, parent.id == Conversation.parent_id
+        ).filter(Conversation.user_id == user_id).order_by(Conversation.id).yield_per(batch_size)
+        flattened = []
+        for conversation, parent_owner in conversations:
+            flatten = conversation.parent_id is not None and parent_owner != user_id
+            if flatten:
+                flattened.append(conversation)
+            yield _line(_conversation_record(conversation, flatten))
+
+        # Own messages, plus the inherited messages of flattened forks
+        # attributed to the fork
+        own = select(*_message_columns()).join(
+            Conversation, Conversation.id == Message.conversation_id
+        ).where(Conversation.user_id == user_id)
+        inherited = [
+            select(*_message_columns(literal(conversation.id))).where(or_(*[
+                Message.conversation_id == ancestor_id if cutoff is None
+                else and_(Message.conversation_id == ancestor_id, Message.id <= cutoff)
+                for ancestor_id, cutoff in lineage.segments(conversation)[1:]
+            ]))
+            for conversation in flattened
+        ]
+        query = union_all(own, *inherited) if inherited else own
+        messages = db.session.execute(
+            query.order_by(query.selected_columns.id).execution_options(yield_per=batch_size)
+        )
+        yield from _message_lines(messages)
+
+    return _chunked(lines())
+
+def export_conversation(conversation, batch_size):
+    """Yield NDJSON chunks for one conversation, with its whole chain as its own messages."""
+    def lines():
+        yield _line({'type': 'export', 'version': VERSION})
+        yield _line(_conversation_record(conversation, flatten=True))
+        messages = db.session.execute(
+            select(*_message_columns(literal(conversation.id)))
+            .where(lineage.chain_filter(conversation))
+            .order_by(Message.id)
+            .execution_options(yield_per=batch_size)
+        )
+        yield from _message_lines(messages)
+
+    return _chunked(lines())
+
+class _Importer:
+    def __init__(self, user_id, batch_size):
+        self.user_id = user_id
+        self.batch_size = batch_size
+        self.conversation_ids = {}
+        self.conversations = []
+        self.messages = []
+        self.message_count = 0
+        # Forks waiting for their fork point: sorted exported fork message
+        # ids, and (new id, exported parent id) for each
+        self.fork_points = []
+        self.forks = []
+        self.last_exported_id = None
+        self.last_new_id = None
+        self.in_messages = False
+
+    def add(self, record):
+        kind = record.get('type')
+        if kind == 'conversation':
+            if self.in_messages:
+                raise ValueError("Conversations must come before messages")
+            is_fork = record.get('parentId') is not None and record.get('forkMessageId') is not None
+            self.conversations.append((record, {
+                'user_id': self.user_id,
+                'title': record.get('title'),
+                'timestamp': datetime.fromisoformat(record['timestamp']) if record.get('timestamp') else None,
+                'inherited_count': (record.get('inheritedCount') or 0) if is_fork else 0,
+            }))
+            if len(self.conversations) >= self.batch_size:
+                self._flush_conversations()
+        elif kind == 'message':
+            if not self.in_messages:
+                self._flush_conversations()
+                self.in_messages = True
+            conversation_id = self.conversation_ids.get(record.get('conversationId'))
+            if conversation_id is None:
+                raise ValueError(f"Message {record.get('id')} belongs to an unknown conversation")
+            if record.get('id') is not None:
+                if self.last_exported_id is not None and record['id'] < self.last_exported_id:
+                    raise ValueError("Messages must be in id order")
+                self.last_exported_id = record['id']
+            self.messages.append((record.get('id'), {
+                'role': record['role'],
+                'content': record['content'],
+                'model': record.get('model'),
+                'conversation_id': conversation_id,
+            }))
+            if len(self.messages) >= self.batch_size:
+                self._flush_messages()
+        elif kind == 'export':
+            if record.get('version', VERSION) > VERSION:
+                raise ValueError(f"Unsupported export version {record['version']}")
+        else:
+            raise ValueError(f"Unknown record type: {kind!r}")
+
+    def finish(self):
+        self._flush_conversations()
+        self._flush_messages()
+        # Fork points past the last message resolve to it
+        self._resolve_forks(None)
+        db.session.commit()
+        return {'conversations': len(self.conversation_ids), 'messages': self.message_count}
+
+    def _flush_conversations(self):
+        if not self.conversations:
+            return
+        new_ids = db.session.scalars(
+            insert(Conversation).returning(Conversation.id, sort_by_parameter_order=True),
+            [row for _, row in self.conversations]
+        ).all()
+        for (record, row), new_id in zip(self.conversations, new_ids):
+            if 'id' in record:
+                self.conversation_ids[record['id']] = new_id
+            if record.get('parentId') is not None and record.get('forkMessageId') is not None:
+                # Linked to the parent once its fork point has been imported
+                index = bisect.bisect_right(self.fork_points, record['forkMessageId'])
+                self.fork_points.insert(index, record['forkMessageId'])
+                self.forks.insert(index, (new_id, record['parentId']))
+        self.conversations = []
+        list_versions.bump(self.user_id, 'conversations')
+        db.session.commit()
+
+    def _flush_messages(self):
+        if not self.messages:
+            return
+        refs = blob_store.store(row['content'] for _, row in self.messages)
+        new_ids = db.session.scalars(
+            insert(Message).returning(Message.id, sort_by_parameter_order=True),
+            [dict(row, content=content, content_hash=content_hash)
+             for (_, row), (content, content_hash) in zip(self.messages, refs)]
+        ).all()
+        for (exported_id, _), new_id in zip(self.messages, new_ids):
+            if exported_id is not None:
+                self._resolve_forks(exported_id)
+            self.last_new_id = new_id
+        self.message_count += len(self.messages)
+        self.messages = []
+        list_versions.bump(self.user_id, 'conversations')
+        db.session.commit()
+
+    def _resolve_forks(self, next_exported_id):
+        """Link forks whose fork point comes before ``next_exported_id`` (all if None)."""
+        count = len(self.forks) if next_exported_id is None else bisect.bisect_left(self.fork_points, next_exported_id)
+        for new_id, parent_id in self.forks[:count]:
+            parent = self.conversation_ids.get(parent_id)
+            if parent is None or self.last_new_id is None:
+                logger.warning("Imported conversation %s lost its fork parent %s", new_id, parent_id)
+                values = {'inherited_count': 0}
+            else:
+                values = {'parent_id': parent, 'fork_message_id': self.last_new_id}
+            db.session.execute(update(Conversation).where(Conversation.id == new_id).values(**values))
+        del self.fork_points[:count], self.forks[:count]
+
+def import_user(user_id, lines, batch_size):
+    """Import NDJSON ``lines`` for ``user_id``, committing every ``batch_size`` records.
+
+    Returns counts of what was imported. Raises ValueError on a malformed
+    line; batches committed before it are kept.
+    """
+    importer = _Importer(user_id, batch_size)
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError("Expected a JSON object")
+            importer.add(record)
+        except (ValueError, KeyError, TypeError) as e:
+            db.session.rollback()
+            raise ValueError(
+                f"Line {number}: {e}. {len(importer.conversation_ids)} conversations and "
+                f"{importer.message_count} messages were imported before it"
+            ) from e
+    return importer.finish()
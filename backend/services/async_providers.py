@@ -0,0 +1,76 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+import httpx
+
+from backend.config import Config
+from backend.services import providers
+
+logger = logging.getLogger(__name__)
+
+# One pooled HTTP client and one async SDK client per provider, created on
+# first use inside the running event loop and shared by every request in the
+# process. Provider modules build their client through ``client``.
+_http_client = None
+_clients = {}
+_provider_semaphores = {}
+_model_semaphores = {}
+
+def _get_http_client():
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=Config.PROVIDER_MAX_CONNECTIONS,
+                max_keepalive_connections=Config.PROVIDER_MAX_KEEPALIVE_CONNECTIONS,
+            ),
+            timeout=httpx.Timeout(Config.PROVIDER_TIMEOUT, connect=10.0),
+        )
+    return _http_client
+
+def client(provider, factory):
+    """The shared async SDK client for ``provider``, built as ``factory(http_client)`` on first use."""
+    if provider not in _clients:
+        _clients[provider] = factory(_get_http_client())
+    return _clients[provider]
+
+@asynccontextmanager
+async def _limit(provider, model):
+    """Hold a slot in both the provider-wide and the per-model semaphore."""
+    if provider not in _provider_semaphores:
+        _provider_semaphores[provider] = asyncio.Semaphore(Config.PROVIDER_CONCURRENCY)
+    if model not in _model_semaphores:
+        _model_semaphores[model] = asyncio.Semaphore(Config.MODEL_CONCURRENCY)
+    async with _provider_semaphores[provider], _model_semaphores[model]:
+        yield
+
+def _service(model):
+    provider = providers.provider_for(model)
+    if provider is None:
+        raise ValueError(f"Unsupported model: {model}")
+    return provider, providers.load(provider)
+
+async def generate(model, system_prompt, user_prompt, conversation, settings):
+    provider, service = _service(model)
+    async with _limit(provider, model):
+        return await service.agenerate(model, system_prompt, user_prompt, conversation, settings)
+
+async def stream(model, system_prompt, user_prompt, conversation, settings):
+    """Async counterpart of the services' ``stream`` functions."""
+    provider, service = _service(model)
+    async with _limit(provider, model):
+        deltas = service.astream(model, system_prompt, user_prompt, conversation, settings)
+        try:
+            async for text in deltas:
+                yield text
+        finally:
+            await deltas.aclose()
+
+async def aclose():
+    """Close the shared HTTP pool; call from the ASGI lifespan shutdown."""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+    _clients.clear()
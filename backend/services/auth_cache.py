@@ -0,0 +1,175 @@
+"""Per-process caches for the authentication hot path.
+
+``jwt_required`` and ``verify_jwt_in_request`` wrap flask-jwt-extended's
+functions of the same name. They remember the claims of bearer tokens the
+library has already verified, keyed by a digest of the token, until the token
+expires; repeat requests with the same token skip decoding. Routes read the
+identity with this module's ``get_jwt_identity``, which sees the cached
+claims. A cache hit skips the library's blocklist and user-loader callbacks,
+so the cache must be turned off (``AUTH_TOKEN_CACHE_SIZE=0``) if either is
+registered.
+
+``conversation_owners`` maps conversation ids to their owner so routes that
+only need an ownership check can skip the SELECT. Conversations never change
+owner, so entries are dropped when a conversation is deleted; the TTL bounds
+how long another worker process can keep trusting an entry for a
+conversation deleted elsewhere. Writes pass ``fresh=True`` so they never
+trust a cached entry.
+"""
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+import flask_jwt_extended
+from flask import current_app, g, request
+from flask_jwt_extended.exceptions import JWTExtendedException
+from jwt import PyJWTError
+
+from backend.models import db, Conversation
+
+logger = logging.getLogger(__name__)
+
+class _LRU:
+    def __init__(self, size):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if self.size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+class _TokenClaims(_LRU):
+    def lookup(self, token):
+        claims = self.get(hashlib.sha256(token.encode()).digest())
+        if claims is not None and time.time() < claims['exp']:
+            return claims
+        return None
+
+    def remember(self, token, claims):
+        if 'exp' in claims:
+            self.set(hashlib.sha256(token.encode()).digest(), claims)
+
+    def init_app(self, app):
+        self.size = app.config.get('AUTH_TOKEN_CACHE_SIZE', self.size)
+
+token_claims = _TokenClaims(10000)
+
+def bearer_token(header):
+    """The token in an ``Authorization: Bearer`` header value, or None."""
+    scheme, _, token = (header or '').partition(' ')
+    return token if scheme == 'Bearer' and token else None
+
+def _bearer_token():
+    return bearer_token(request.headers.get('Authorization'))
+
+def token_identity(token):
+    """The identity in a valid access token, or None; needs an app context."""
+    claims = token_claims.lookup(token)
+    if claims is None:
+        try:
+            claims = flask_jwt_extended.decode_token(token)
+        except (JWTExtendedException, PyJWTError):
+            return None
+        if claims.get('type') != 'access':
+            return None
+        token_claims.remember(token, claims)
+    return claims.get(current_app.config['JWT_IDENTITY_CLAIM'])
+
+def client_key(authorization, address):
+    """Who the scheduler queues a request for: the signed-in user, else the caller's address.
+
+    Keying on the user rather than the raw token means minting new tokens
+    does not buy more fair-share slots. Needs an app context.
+    """
+    token = bearer_token(authorization)
+    identity = token_identity(token) if token is not None else None
+    return f"user:{identity}" if identity is not None else address
+
+def verify_jwt_in_request(optional=False, refresh=False):
+    """``flask_jwt_extended.verify_jwt_in_request`` that reuses the claims of
+    bearer access tokens it has already verified."""
+    g.pop('cached_jwt', None)
+    token = None if refresh else _bearer_token()
+    if token is not None:
+        claims = token_claims.lookup(token)
+        if claims is not None:
+            g.cached_jwt = claims
+            return
+    flask_jwt_extended.verify_jwt_in_request(optional=optional, refresh=refresh)
+    claims = flask_jwt_extended.get_jwt()
+    if token is not None and claims:
+        token_claims.remember(token, claims)
+
+def jwt_required(optional=False, refresh=False):
+    def wrapper(fn):
+        @wraps(fn)
+        def decorator(*args, **kwargs):
+            verify_jwt_in_request(optional=optional, refresh=refresh)
+            return current_app.ensure_sync(fn)(*args, **kwargs)
+        return decorator
+    return wrapper
+
+def get_jwt_identity():
+    claims = g.get('cached_jwt')
+    if claims is None:
+        return flask_jwt_extended.get_jwt_identity()
+    return claims.get(current_app.config['JWT_IDENTITY_CLAIM'])
+
+class _ConversationOwners(_LRU):
+    def __init__(self, size, ttl):
+        super().__init__(size)
+        self.ttl = ttl
+
+    def owner_of(self, conversation_id, fresh=False):
+        """Return the owning user id of a conversation, or None if it does not exist.
+
+        ``fresh`` skips the cache, for callers about to write to the conversation.
+        """
+        if not fresh:
+            entry = self.get(conversation_id)
+            if entry is not None and time.monotonic() < entry[1]:
+                return entry[0]
+        owner = db.session.query(Conversation.user_id).filter_by(id=conversation_id).scalar()
+        if owner is not None:
+            self.remember(conversation_id, owner)
+        else:
+            self.pop(conversation_id)
+        return owner
+
+    def remember(self, conversation_id, owner):
+        self.set(conversation_id, (owner, time.monotonic() + self.ttl))
+
+    def owns(self, conversation_id, user_id, fresh=False):
+        owner = self.owner_of(conversation_id, fresh)
+        # JWT identities may be strings while the column is an integer
+        return owner is not None and str(owner) == str(user_id)
+
+    def init_app(self, app):
+        self.size = app.config.get('AUTH_OWNER_CACHE_SIZE', self.size)
+        self.ttl = app.config.get('AUTH_OWNER_CACHE_TTL', self.ttl)
+
+conversation_owners = _ConversationOwners(100000, 60)
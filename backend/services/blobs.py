@@ -0,0 +1,293 @@
+"""Content-addressed, compressed storage for long message and prompt text.
+
+Text of at least ``BLOB_MIN_SIZE`` characters is written once per distinct
+text to ``content_blob``, keyed by its SHA-256. The referencing column keeps
+an empty string next to the hash (``Message.content_hash``,
+``Prompt.system_prompt_hash``, ``Prompt.user_prompt_hash``). A system prompt
+or pasted document saved in many conversations is therefore stored once.
+Shorter text stays inline, where a blob would cost more than it saves.
+
+Blobs are compressed with zstd when the zstandard package is installed and
+with zlib otherwise, and kept raw when compression does not help. A blob
+written with zstd needs zstandard to be read back. Each blob counts its
+references, and the writes that add or drop references delete it in the same
+transaction once nothing uses it.
+
+Decompressed text is served from a per-process LRU bounded by total size.
+Blobs never change once written, so the cache needs no invalidation across
+workers.
+
+Each blob also keeps its text uncompressed in ``search_text``, written here
+with the blob, for the search index (see ``backend.services.search``). The
+index then needs no code of ours to read blob text, so any connection can
+write the message and prompt tables and every backend searches long text.
+"""
+import hashlib
+import logging
+import threading
+import zlib
+from collections import Counter, OrderedDict
+
+from sqlalchemy import bindparam, delete, func, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from backend.models import db, ContentBlob, Message, Prompt
+
+try:
+    import zstandard
+except ImportError:  # optional; zlib is used instead
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# Misses are fetched in chunks of this many hashes per query
+LOAD_CHUNK = 500
+
+_UPSERT_DIALECTS = ('sqlite', 'postgresql')
+
+# (model, text column, hash column) for every column that can use the store
+_COLUMNS = (
+    (Message, 'content', 'content_hash'),
+    (Prompt, 'system_prompt', 'system_prompt_hash'),
+    (Prompt, 'user_prompt', 'user_prompt_hash'),
+)
+
+def compress(data, codec):
+    """Return ``(codec, data)``, falling back to 'raw' when compression does not help."""
+    if codec == 'zstd':
+        packed = zstandard.ZstdCompressor(level=3).compress(data)
+    else:
+        packed = zlib.compress(data, 6)
+    if len(packed) >= len(data):
+        return 'raw', data
+    return codec, packed
+
+def decompress(codec, data):
+    data = bytes(data)
+    if codec == 'zlib':
+        data = zlib.decompress(data)
+    elif codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("This blob is zstd-compressed but the zstandard package is not installed")
+        data = zstandard.ZstdDecompressor().decompress(data)
+    elif codec != 'raw':
+        raise ValueError(f"Unknown blob codec: {codec!r}")
+    return data.decode('utf-8')
+
+class _TextCache:
+    """LRU of decompressed blob text, bounded by total characters."""
+
+    def __init__(self, max_chars):
+        self.max_chars = max_chars
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            text = self._entries.get(key)
+            if text is not None:
+                self._entries.move_to_end(key)
+            return text
+
+    def set(self, key, text):
+        # Anything over a quarter of the cache would evict too much else
+        if len(text) > self.max_chars // 4:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return
+            self._entries[key] = text
+            self._size += len(text)
+            while self._size > self.max_chars:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+class BlobStore:
+    def __init__(self):
+        self.min_size = 1024
+        self.codec = 'zstd' if zstandard is not None else 'zlib'
+        self.cache = _TextCache(64 * 1024 * 1024)
+
+    def init_app(self, app):
+        self.min_size = app.config.get('BLOB_MIN_SIZE', self.min_size)
+        self.cache = _TextCache(app.config.get('BLOB_CACHE_CHARS', self.cache.max_chars))
+
+    def store(self, texts):
+        """Return ``(inline text, hash)`` column values for each of ``texts``.
+
+        Long texts are written as blobs, or gain a reference if they already
+        exist. Runs in the caller's transaction, so a rollback undoes it.
+        """
+        refs, counts, data = [], Counter(), {}
+        for text in texts:
+            if not self.min_size or text is None or len(text) < self.min_size:
+                refs.append((text, None))
+                continue
+            key = hashlib.sha256(text.encode('utf-8')).hexdigest()
+            if key not in data:
+                data[key] = text
+                self.cache.set(key, text)
+            counts[key] += 1
+            refs.append(('', key))
+        if counts:
+            self._add_references(counts, data)
+        return refs
+
+    def _add_references(self, counts, data):
+        table = ContentBlob.__table__
+        existing = set()
+        if db.engine.dialect.name not in _UPSERT_DIALECTS:
+            # Without an upsert, add to the blobs that exist and insert the rest
+            existing = set(db.session.scalars(select(table.c.hash).where(table.c.hash.in_(list(counts)))))
+            if existing:
+                db.session.execute(
+                    update(table).where(table.c.hash == bindparam('b_hash'))
+                    .values(refcount=table.c.refcount + bindparam('b_count')),
+                    [{'b_hash': key, 'b_count': counts[key]} for key in existing]
+                )
+        # Every other reference goes through the upsert, even for blobs that
+        # exist: one a concurrent release() deletes in the meantime is then
+        # written again instead of being left dangling
+        rows = []
+        for key, count in counts.items():
+            if key in existing:
+                continue
+            encoded = data[key].encode('utf-8')
+            codec, packed = compress(encoded, self.codec)
+            rows.append({'hash': key, 'codec': codec, 'data': packed, 'size': len(encoded), 'refcount': count,
+                         'search_text': data[key]})
+        if rows:
+            db.session.execute(self._insert(table), rows)
+
+    def _insert(self, table):
+        """An insert that adds to the refcount of a blob that already exists."""
+        dialect = db.engine.dialect.name
+        if dialect not in _UPSERT_DIALECTS:
+            return insert(table)
+        statement = (sqlite if dialect == 'sqlite' else postgresql).insert(table)
+        return statement.on_conflict_do_update(
+            index_elements=[table.c.hash],
+            set_={'refcount': table.c.refcount + statement.excluded.refcount}
+        )
+
+    def load(self, refs):
+        """Return the text for each ``(inline text, hash)`` pair, fetching uncached blobs in bulk."""
+        refs = list(refs)
+        texts, missing = {}, set()
+        for _, key in refs:
+            if key is None or key in texts:
+                continue
+            text = self.cache.get(key)
+            if text is None:
+                missing.add(key)
+            else:
+                texts[key] = text
+        missing = list(missing)
+        table = ContentBlob.__table__
+        for start in range(0, len(missing), LOAD_CHUNK):
+            rows = db.session.execute(
+                select(table.c.hash, table.c.codec, table.c.data)
+                .where(table.c.hash.in_(missing[start:start + LOAD_CHUNK]))
+            )
+            for key, codec, data in rows:
+                texts[key] = decompress(codec, data)
+                self.cache.set(key, texts[key])
+        result = []
+        for inline, key in refs:
+            if key is not None and key not in texts:
+                # Only possible if the row was deleted while it was being read
+                logger.warning("Blob %s is missing", key)
+            result.append(inline if key is None else texts.get(key, ''))
+        return result
+
+    def text(self, inline, key):
+        return self.load([(inline, key)])[0]
+
+    def prompt_texts(self, prompts):
+        """``(system prompt, user prompt)`` for each of ``prompts``."""
+        texts = self.load(
+            ref for prompt in prompts
+            for ref in ((prompt.system_prompt, prompt.system_prompt_hash), (prompt.user_prompt, prompt.user_prompt_hash))
+        )
+        return list(zip(texts[::2], texts[1::2]))
+
+    def release(self, keys):
+        """Drop one reference per hash in ``keys`` (None is skipped) and delete unused blobs.
+
+        Call after the referencing rows are deleted, in the same transaction;
+        the search index reads a deleted message's text from its blob.
+        """
+        counts = Counter(key for key in keys if key is not None)
+        if not counts:
+            return
+        table = ContentBlob.__table__
+        db.session.execute(
+            update(table).where(table.c.hash == bindparam('b_hash'))
+            .values(refcount=table.c.refcount - bindparam('b_count')),
+            [{'b_hash': key, 'b_count': count} for key, count in counts.items()]
+        )
+        db.session.execute(delete(table).where(table.c.hash.in_(list(counts)), table.c.refcount <= 0))
+
+    def pack(self, batch_size=1000):
+        """Move long text still stored inline into blobs; returns how many values moved.
+
+        Rows are converted in id order, ``batch_size`` per transaction.
+        """
+        if not self.min_size:
+            return 0
+        moved = 0
+        for model, text_name, hash_name in _COLUMNS:
+            table = model.__table__
+            text_column, hash_column = table.c[text_name], table.c[hash_name]
+            last_id, column_moved = 0, 0
+            while True:
+                rows = db.session.execute(
+                    select(table.c.id, text_column)
+                    .where(table.c.id > last_id, hash_column.is_(None), func.length(text_column) >= self.min_size)
+                    .order_by(table.c.id).limit(batch_size)
+                ).all()
+                if not rows:
+                    break
+                refs = self.store(row[1] for row in rows)
+                db.session.execute(
+                    update(table).where(table.c.id == bindparam('b_id'))
+                    .values({text_name: bindparam('b_text'), hash_name: bindparam('b_hash')}),
+                    [{'b_id': row[0], 'b_text': inline, 'b_hash': key} for row, (inline, key) in zip(rows, refs)]
+                )
+                db.session.commit()
+                column_moved += len(rows)
+                last_id = rows[-1][0]
+                logger.info("Moved %d %s.%s values into blobs", column_moved, table.name, text_name)
+            moved += column_moved
+        return moved
+
+    def fill_search_text(self):
+        """Set ``search_text`` on blobs written before it existed; returns how many were filled.
+
+        Runs in the caller's transaction.
+        """
+        table = ContentBlob.__table__
+        last_hash, filled = '', 0
+        while True:
+            rows = db.session.execute(
+                select(table.c.hash, table.c.codec, table.c.data)
+                .where(table.c.hash > last_hash, table.c.search_text.is_(None))
+                .order_by(table.c.hash).limit(LOAD_CHUNK)
+            ).all()
+            if not rows:
+                return filled
+            db.session.execute(
+                update(table).where(table.c.hash == bindparam('b_hash')).values(search_text=bindparam('b_text')),
+                [{'b_hash': key, 'b_text': decompress(codec, data)} for key, codec, data in rows]
+            )
+            filled += len(rows)
+            last_hash = rows[-1][0]
+
+blob_store = BlobStore()
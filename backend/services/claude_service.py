@@ -1,21 +1,64 @@
+import functools
 import os
-from anthropic import Anthropic, HUMAN_PROMPT, AI_PROMPT
+from anthropic import Anthropic, AsyncAnthropic
 
-client = Anthropic(api_key=os.environ.get("ANTHROPIC_API_KEY"))
+from backend.services import async_providers
 
-def generate(model, system_prompt, user_prompt, conversation, settings):
+# ANTHROPIC_BASE_URL points the client at a proxy or a local mock server.
+# Retries are left to backend.services.scheduler. Clients are built on first
+# use; see backend/services/providers.py.
+def _client_options():
+    return {"api_key": os.environ.get("ANTHROPIC_API_KEY"), "base_url": os.environ.get("ANTHROPIC_BASE_URL") or None, "max_retries": 0}
+
+@functools.cache
+def _client():
+    return Anthropic(**_client_options())
+
+def _async_client():
+    return async_providers.client('anthropic', lambda http_client: AsyncAnthropic(http_client=http_client, **_client_options()))
+
+def _build_params(model, system_prompt, user_prompt, conversation, settings):
+    # The Messages API takes the system prompt as a top-level parameter
+    # rather than as a message with a "system" role.
     messages = [
-        {"role": "system", "content": system_prompt},
         *[{"role": msg['role'], "content": msg['content']} for msg in conversation],
         {"role": "user", "content": user_prompt}
     ]
 
-    response = client.messages.create(
-        model=model,
-        messages=messages,
-        max_tokens=int(settings['maxTokens']),
-        temperature=float(settings['temperature']),
-        top_p=float(settings['topP']),
+    params = {
+        "model": model,
+        "messages": messages,
+        "max_tokens": int(settings['maxTokens']),
+        "temperature": float(settings['temperature']),
+        "top_p": float(settings['topP']),
+    }
+    if system_prompt:
+        params["system"] = system_prompt
+    return params
+
+def generate(model, system_prompt, user_prompt, conversation, settings):
+    response = _client().messages.create(
+        **_build_params(model, system_prompt, user_prompt, conversation, settings)
     )
 
     return response.content[0].text
+
+def stream(model, system_prompt, user_prompt, conversation, settings):
+    """Yield the completion text chunk by chunk as it arrives from Anthropic."""
+    params = _build_params(model, system_prompt, user_prompt, conversation, settings)
+    with _client().messages.stream(**params) as response:
+        for text in response.text_stream:
+            if text:
+                yield text
+
+async def agenerate(model, system_prompt, user_prompt, conversation, settings):
+    params = _build_params(model, system_prompt, user_prompt, conversation, settings)
+    response = await _async_client().messages.create(**params)
+    return response.content[0].text
+
+async def astream(model, system_prompt, user_prompt, conversation, settings):
+    params = _build_params(model, system_prompt, user_prompt, conversation, settings)
+    async with _async_client().messages.stream(**params) as response:
+        async for text in response.text_stream:
+            if text:
+                yield text
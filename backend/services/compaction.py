@@ -0,0 +1,170 @@
+"""Keep the conversation sent upstream within a bounded token budget.
+
+When a conversation's history outgrows its budget, the most recent turns are
+sent as-is and everything older is replaced by a short extractive summary
+built locally (no extra LLM call). Summaries are cached by a rolling hash of
+the summarised prefix, so each turn of a long chat only summarises the few
+messages that newly fell out of the recent window.
+"""
+import hashlib
+import logging
+import re
+import threading
+from collections import OrderedDict
+
+from backend.config import Config
+from backend.logging_config import HIGH_VOLUME
+from backend.services.tokens import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Context window per model prefix; the longest matching prefix wins
+MODEL_CONTEXT_TOKENS = {
+    'gpt-4o': 128000,
+    'gpt-4-turbo': 128000,
+    'gpt-4-1106': 128000,
+    'gpt-4-0125': 128000,
+    'gpt-4-32k': 32768,
+    'gpt-4': 8192,
+    'gpt-3.5-turbo': 16385,
+    'claude-3': 200000,
+    'claude-2': 100000,
+    'claude-': 100000,
+    'llama-': Config.LLAMA_CONTEXT,
+}
+DEFAULT_CONTEXT_TOKENS = 8192
+
+# Per-message framing overhead (role markers and separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+SUMMARY_LINE_CHARS = 160
+SUMMARY_CACHE_SIZE = 1024
+
+SUMMARY_HEADER = "Summary of the earlier conversation:"
+
+def context_tokens(model):
+    matches = [prefix for prefix in MODEL_CONTEXT_TOKENS if model.startswith(prefix)]
+    return MODEL_CONTEXT_TOKENS[max(matches, key=len)] if matches else DEFAULT_CONTEXT_TOKENS
+
+def _message_tokens(message):
+    return estimate_tokens(message['content']) + MESSAGE_OVERHEAD_TOKENS
+
+def history_budget(model, system_prompt, user_prompt, settings):
+    """Tokens available for conversation history on this request."""
+    available = (
+        context_tokens(model)
+        - estimate_tokens(system_prompt)
+        - estimate_tokens(user_prompt)
+        - int(settings['maxTokens'])
+    )
+    if Config.COMPACTION_MAX_HISTORY_TOKENS > 0:
+        available = min(available, Config.COMPACTION_MAX_HISTORY_TOKENS)
+    return max(0, available)
+
+class _SummaryCache:
+    def __init__(self, size):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            summary = self._entries.get(key)
+            if summary is not None:
+                self._entries.move_to_end(key)
+            return summary
+
+    def set(self, key, summary):
+        with self._lock:
+            self._entries[key] = summary
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+summaries = _SummaryCache(SUMMARY_CACHE_SIZE)
+
+def _summary_line(message):
+    text = re.sub(r'\s+', ' ', message['content']).strip()
+    # First sentence, or the start of the message if it has none
+    sentence = re.split(r'(?<=[.!?])\s', text, maxsplit=1)[0]
+    if len(sentence) > SUMMARY_LINE_CHARS:
+        sentence = sentence[:SUMMARY_LINE_CHARS - 3].rstrip() + '...'
+    return f"- {message['role']}: {sentence}"
+
+def _trim(lines, budget):
+    """Keep the newest lines that fit in ``budget`` tokens."""
+    kept, used = [], estimate_tokens(SUMMARY_HEADER)
+    for line in reversed(lines):
+        used += estimate_tokens(line) + 1
+        if used > budget:
+            break
+        kept.append(line)
+    return kept[::-1]
+
+def summarize(messages, budget):
+    """Summary lines for ``messages`` that fit in ``budget`` tokens.
+
+    The cached summary of the longest already-seen prefix is extended with
+    the remaining messages. Cached summaries are trimmed to the largest
+    budget any request can have, so the cache key does not depend on the
+    per-request budget.
+    """
+    hashes = []
+    digest = hashlib.sha1()
+    for message in messages:
+        digest.update(message['role'].encode())
+        digest.update(b'\0')
+        digest.update(message['content'].encode('utf-8'))
+        digest.update(b'\0')
+        hashes.append(digest.hexdigest())
+
+    lines, start = [], 0
+    for index in range(len(hashes) - 1, -1, -1):
+        cached = summaries.get(hashes[index])
+        if cached is not None:
+            lines, start = list(cached), index + 1
+            break
+
+    if start < len(messages):
+        max_history = Config.COMPACTION_MAX_HISTORY_TOKENS or max(DEFAULT_CONTEXT_TOKENS, *MODEL_CONTEXT_TOKENS.values())
+        max_budget = int(max_history * Config.COMPACTION_SUMMARY_FRACTION)
+        lines = _trim(lines + [_summary_line(m) for m in messages[start:]], max_budget)
+        summaries.set(hashes[-1], tuple(lines))
+    return _trim(lines, budget)
+
+def compact(model, system_prompt, user_prompt, conversation, settings):
+    """Return a conversation that fits this request's history budget."""
+    budget = history_budget(model, system_prompt, user_prompt, settings)
+    sizes = [_message_tokens(m) for m in conversation]
+    if sum(sizes) <= budget:
+        return conversation
+
+    # Keep as many recent turns as fit in the part of the budget not
+    # reserved for the summary
+    recent_budget = budget - int(budget * Config.COMPACTION_SUMMARY_FRACTION)
+    split, used = len(conversation), 0
+    while split > 0 and used + sizes[split - 1] <= recent_budget:
+        split -= 1
+        used += sizes[split]
+    if split == len(conversation):
+        # Always send the latest turn, however long
+        split -= 1
+        used = sizes[split]
+
+    lines = summarize(conversation[:split], int(budget * Config.COMPACTION_SUMMARY_FRACTION))
+    recent = [dict(m) for m in conversation[split:]]
+    summary = "\n".join([SUMMARY_HEADER, *lines])
+    # Anthropic requires turns to alternate starting with the user, so the
+    # summary rides on the first user turn rather than adding its own
+    if recent and recent[0]['role'] == 'user':
+        recent[0]['content'] = f"{summary}\n\n{recent[0]['content']}"
+    else:
+        recent.insert(0, {'role': 'user', 'content': summary})
+    logger.debug("Compacted %d of %d messages for %s", split, len(conversation), model, extra=HIGH_VOLUME)
+    return recent
+
+def compact_request(request_args):
+    """Apply ``compact`` to a ``(model, system, user, conversation, settings)`` tuple."""
+    if not Config.COMPACTION_ENABLED:
+        return request_args
+    model, system_prompt, user_prompt, conversation, settings = request_args
+    return model, system_prompt, user_prompt, compact(*request_args), settings
@@ -0,0 +1,349 @@
+"""Batch evaluation of saved prompts over datasets.
+
+A job fills a prompt's ``{{name}}`` placeholders from each row of a JSONL
+dataset and sends the result to every model in the job. Calls go through the
+scheduler at low priority, so evals use spare provider capacity and queue
+behind interactive traffic.
+
+Each job has a directory under ``EVAL_DIR`` holding ``dataset.jsonl`` and
+``results.jsonl``, with one compact line per (row, model). The results file
+is the checkpoint. It is flushed to disk periodically, and progress and
+stats are written to the job's row at the same time. A resumed job skips
+every pair already in the file.
+
+Whichever worker process holds the lock on a job's directory runs it. If the
+runner dies, the job can be resumed from any worker.
+"""
+import fcntl
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+
+from sqlalchemy import update
+
+from backend import metrics
+from backend.models import db, EvalJob
+from backend.services import providers
+from backend.services.scheduler import scheduler, Throttled
+from backend.services.tokens import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+_PLACEHOLDER = re.compile(r'\{\{\s*([\w.-]+)\s*\}\}')
+
+def render(template, variables):
+    """Fill ``{{name}}`` placeholders from ``variables``; unknown names are left as they are."""
+    def substitute(match):
+        value = variables.get(match.group(1))
+        if value is None:
+            return match.group(0)
+        return value if isinstance(value, str) else json.dumps(value)
+    return _PLACEHOLDER.sub(substitute, template)
+
+def _generate(model, *args):
+    service = providers.get(model)
+    if service is None:
+        raise ValueError(f"Unsupported model: {model}")
+    return service.generate(model, *args)
+
+def _percentile(values, q):
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+class _ModelStats:
+    """Running totals for one model's results."""
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.latencies = []
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def add(self, result):
+        self.count += 1
+        if 'error' in result:
+            self.errors += 1
+            return
+        self.latencies.append(result['latency'])
+        self.prompt_tokens += result['promptTokens']
+        self.completion_tokens += result['completionTokens']
+
+    def summary(self):
+        summary = {
+            'count': self.count,
+            'errors': self.errors,
+            'promptTokens': self.prompt_tokens,
+            'completionTokens': self.completion_tokens,
+        }
+        if self.latencies:
+            latencies = sorted(self.latencies)
+            summary['latency'] = {
+                'mean': sum(latencies) / len(latencies),
+                'p50': _percentile(latencies, 0.5),
+                'p95': _percentile(latencies, 0.95),
+                'p99': _percentile(latencies, 0.99),
+            }
+        return summary
+
+class EvalRunner:
+    """Runs eval jobs on a pool of threads shared by every job in the process."""
+
+    def __init__(self):
+        self.app = None
+        self.directory = 'evals'
+        self.workers = 16
+        self.max_rows = 100000
+        self.checkpoint_rows = 500
+        self.checkpoint_interval = 5.0
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._threads = {}
+        self._stopping = threading.Event()
+
+    def init_app(self, app):
+        self.app = app
+        self.directory = os.path.abspath(app.config.get('EVAL_DIR') or os.path.join(app.instance_path, 'evals'))
+        self.workers = app.config.get('EVAL_WORKERS', self.workers)
+        self.max_rows = app.config.get('EVAL_MAX_ROWS', self.max_rows)
+        self.checkpoint_rows = app.config.get('EVAL_CHECKPOINT_ROWS', self.checkpoint_rows)
+        self.checkpoint_interval = app.config.get('EVAL_CHECKPOINT_INTERVAL', self.checkpoint_interval)
+
+    def path(self, job_id, name=''):
+        return os.path.join(self.directory, str(job_id), name)
+
+    def save_dataset(self, job_id, rows):
+        """Write ``rows`` (JSONL lines or dicts) as the job's dataset and return the row count.
+
+        Raises ValueError for a row that is not a JSON object, or if there are
+        more than ``EVAL_MAX_ROWS`` rows. Blank lines are skipped.
+        """
+        os.makedirs(self.path(job_id), exist_ok=True)
+        count = 0
+        with open(self.path(job_id, 'dataset.jsonl'), 'w', encoding='utf-8') as out:
+            for number, row in enumerate(rows, 1):
+                if isinstance(row, (bytes, str)):
+                    if not row.strip():
+                        continue
+                    try:
+                        row = json.loads(row)
+                    except ValueError:
+                        raise ValueError(f"Line {number} is not valid JSON")
+                if not isinstance(row, dict):
+                    raise ValueError(f"Row {number} is not a JSON object")
+                count += 1
+                if count > self.max_rows:
+                    raise ValueError(f"Datasets are limited to {self.max_rows} rows")
+                out.write(json.dumps(row, separators=(',', ':')) + '\n')
+        return count
+
+    def delete_files(self, job_id):
+        shutil.rmtree(self.path(job_id), ignore_errors=True)
+
+    def _try_lock(self, job_id):
+        """Return the job's open lock file if this process got the lock, else None."""
+        os.makedirs(self.path(job_id), exist_ok=True)
+        lock = open(self.path(job_id, 'lock'), 'a')
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            return None
+        return lock
+
+    def is_running(self, job_id):
+        """True if some worker process is running the job."""
+        lock = self._try_lock(job_id)
+        if lock is None:
+            return True
+        lock.close()
+        return False
+
+    def status(self, job):
+        """The job's status, reporting a running job whose runner died as 'interrupted'."""
+        if job.status == 'running' and not self.is_running(job.id):
+            return 'interrupted'
+        return job.status
+
+    def start(self, job):
+        """Start or resume ``job`` in this process; False if it is already running.
+
+        Must be called with an app context; the job is marked running before
+        this returns.
+        """
+        lock = self._try_lock(job.id)
+        if lock is None:
+            return False
+        self._ensure_executor()
+        job.status = 'running'
+        job.error = None
+        job.updated_at = datetime.now(timezone.utc)
+        db.session.commit()
+        thread = threading.Thread(target=self._run, args=(job.id, lock), name=f'eval-job-{job.id}', daemon=True)
+        self._threads[job.id] = thread
+        thread.start()
+        return True
+
+    def shutdown(self, timeout):
+        """Checkpoint and stop running jobs, waiting at most ``timeout`` seconds.
+
+        Stopped jobs are left 'interrupted' and can be resumed.
+        """
+        self._stopping.set()
+        deadline = time.monotonic() + timeout
+        for thread in list(self._threads.values()):
+            thread.join(max(0, deadline - time.monotonic()))
+
+    def _ensure_executor(self):
+        # Threads do not survive a fork, so the pool is created in the process
+        # that runs the job
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='eval')
+
+    def _run(self, job_id, lock):
+        status, error = 'failed', None
+        try:
+            with self.app.app_context():
+                job = db.session.get(EvalJob, job_id)
+                spec = (job.system_prompt, job.user_prompt, json.loads(job.models), json.loads(job.settings))
+                db.session.remove()
+            status = self._dispatch(job_id, *spec)
+        except Exception as e:
+            logger.exception("Eval job %s failed", job_id)
+            error = str(e)
+        finally:
+            try:
+                with self.app.app_context():
+                    values = {'error': error, 'updated_at': datetime.now(timezone.utc)}
+                    # A cancel that arrived after the last checkpoint still wins
+                    db.session.execute(update(EvalJob).where(
+                        EvalJob.id == job_id, EvalJob.status == 'running'
+                    ).values(status=status, **values))
+                    db.session.commit()
+            finally:
+                self._threads.pop(job_id, None)
+                lock.close()
+        logger.info("Eval job %s finished: %s", job_id, status)
+
+    def _load_results(self, job_id, models):
+        """Read the results written so far, dropping a line cut short by a crash."""
+        done = set()
+        stats = {model: _ModelStats() for model in models}
+        path = self.path(job_id, 'results.jsonl')
+        if not os.path.exists(path):
+            return done, stats
+        with open(path, 'rb+') as results:
+            end = 0
+            for line in results:
+                if not line.endswith(b'\n'):
+                    break
+                end += len(line)
+                result = json.loads(line)
+                done.add((result['row'], result['model']))
+                stats.setdefault(result['model'], _ModelStats()).add(result)
+            results.truncate(end)
+        return done, stats
+
+    def _rows(self, job_id):
+        with open(self.path(job_id, 'dataset.jsonl'), encoding='utf-8') as dataset:
+            for index, line in enumerate(dataset):
+                yield index, json.loads(line)
+
+    def _dispatch(self, job_id, system_prompt, user_prompt, models, settings):
+        """Run every pair not yet in the results file; returns the job's final status."""
+        done, stats = self._load_results(job_id, models)
+        client = f'eval-{job_id}'
+        # Enough queued calls to keep the pool busy without holding the
+        # whole dataset in futures
+        window = self.workers * 2
+        pending = set()
+        since_checkpoint, last_checkpoint = 0, time.monotonic()
+        state = 'running'
+
+        with open(self.path(job_id, 'results.jsonl'), 'a', encoding='utf-8') as out:
+            def collect(futures):
+                nonlocal since_checkpoint, last_checkpoint, state
+                for future in futures:
+                    result = future.result()
+                    if result is None:
+                        continue
+                    out.write(json.dumps(result, separators=(',', ':')) + '\n')
+                    stats[result['model']].add(result)
+                    since_checkpoint += 1
+                if since_checkpoint >= self.checkpoint_rows or time.monotonic() - last_checkpoint >= self.checkpoint_interval:
+                    state = self._checkpoint(job_id, out, stats)
+                    since_checkpoint, last_checkpoint = 0, time.monotonic()
+
+            def stopped():
+                return state != 'running' or self._stopping.is_set()
+
+            for row, variables in self._rows(job_id):
+                if stopped():
+                    break
+                args = (render(system_prompt, variables), render(user_prompt, variables))
+                for model in models:
+                    if (row, model) in done:
+                        continue
+                    while len(pending) >= window:
+                        finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        collect(finished)
+                    pending.add(self._executor.submit(self._call, client, row, model, *args, settings))
+            collect(wait(pending)[0])
+            state = self._checkpoint(job_id, out, stats)
+
+        if self._stopping.is_set():
+            return 'interrupted'
+        return 'completed' if state == 'running' else state
+
+    def _checkpoint(self, job_id, out, stats):
+        """Make the results durable and publish progress; returns the job's current status."""
+        out.flush()
+        os.fsync(out.fileno())
+        with self.app.app_context():
+            db.session.execute(update(EvalJob).where(EvalJob.id == job_id).values(
+                completed=sum(s.count for s in stats.values()),
+                failed=sum(s.errors for s in stats.values()),
+                stats=json.dumps({model: s.summary() for model, s in stats.items()}),
+                updated_at=datetime.now(timezone.utc),
+            ))
+            db.session.commit()
+            # Cancelling is done by the API, possibly in another worker
+            return db.session.get(EvalJob, job_id).status
+
+    def _call(self, client, row, model, system_prompt, user_prompt, settings):
+        """Generate one result; None if the job stopped before the call got capacity."""
+        args = (model, system_prompt, user_prompt, [], settings)
+        result = {'row': row, 'model': model}
+        while True:
+            start = time.perf_counter()
+            try:
+                output, served_by = scheduler.generate(_generate, args, client, 'low')
+            except Throttled:
+                # Evals are not in a hurry; wait for capacity rather than fail
+                if self._stopping.is_set():
+                    return None
+                continue
+            except Exception as e:
+                metrics.observe_upstream(model, time.perf_counter() - start, error=True)
+                result['error'] = str(e)
+                break
+            latency = time.perf_counter() - start
+            metrics.observe_upstream(served_by, latency, len(system_prompt) + len(user_prompt), output)
+            result['output'] = output
+            if served_by != model:
+                result['servedBy'] = served_by
+            result['latency'] = round(latency, 4)
+            result['promptTokens'] = estimate_tokens(system_prompt) + estimate_tokens(user_prompt)
+            result['completionTokens'] = estimate_tokens(output)
+            break
+        return result
+
+eval_runner = EvalRunner()
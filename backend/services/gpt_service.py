@@ -1,17 +1,34 @@
+import functools
 import os
-from openai import OpenAI
-from typing import List, Dict, Any
+from openai import AsyncOpenAI, OpenAI
+from typing import AsyncIterator, List, Dict, Any, Iterator
 
-client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+from backend.services import async_providers
+
+# OPENAI_BASE_URL points the client at a proxy or a local mock server.
+# Retries are left to backend.services.scheduler. Clients are built on first
+# use; see backend/services/providers.py.
+def _client_options():
+    return {"api_key": os.environ.get("OPENAI_API_KEY"), "base_url": os.environ.get("OPENAI_BASE_URL") or None, "max_retries": 0}
+
+@functools.cache
+def _client() -> OpenAI:
+    return OpenAI(**_client_options())
+
+def _async_client() -> AsyncOpenAI:
+    return async_providers.client('openai', lambda http_client: AsyncOpenAI(http_client=http_client, **_client_options()))
+
+def _build_params(model: str, system_prompt: str, user_prompt: str, conversation: List[Dict[str, str]], settings: Dict[str, Any]) -> Dict[str, Any]:
+    if not model.startswith("gpt-"):
+        raise ValueError(f"Unsupported model: {model}")
 
-def generate(model: str, system_prompt: str, user_prompt: str, conversation: List[Dict[str, str]], settings: Dict[str, Any]) -> str:
     messages = [
         {"role": "system", "content": system_prompt},
         *conversation,
         {"role": "user", "content": user_prompt}
     ]
 
-    params = {
+    return {
         "model": model,
         "messages": messages,
         "max_tokens": int(settings['maxTokens']),
@@ -21,8 +38,33 @@ def generate(model: str, system_prompt: str, user_prompt: str, conversation: Lis
         "presence_penalty": float(settings['presencePenalty'])
     }
 
-    if model.startswith("gpt-"):
-        response = client.chat.completions.create(**params)
-        return response.choices[0].message.content
-    else:
-        raise ValueError(f"Unsupported model: {model}")
+def generate(model: str, system_prompt: str, user_prompt: str, conversation: List[Dict[str, str]], settings: Dict[str, Any]) -> str:
+    params = _build_params(model, system_prompt, user_prompt, conversation, settings)
+    response = _client().chat.completions.create(**params)
+    return response.choices[0].message.content
+
+def stream(model: str, system_prompt: str, user_prompt: str, conversation: List[Dict[str, str]], settings: Dict[str, Any]) -> Iterator[str]:
+    """Yield the completion text chunk by chunk as it arrives from OpenAI."""
+    params = _build_params(model, system_prompt, user_prompt, conversation, settings)
+    response = _client().chat.completions.create(stream=True, **params)
+    try:
+        for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        response.close()
+
+async def agenerate(model: str, system_prompt: str, user_prompt: str, conversation: List[Dict[str, str]], settings: Dict[str, Any]) -> str:
+    params = _build_params(model, system_prompt, user_prompt, conversation, settings)
+    response = await _async_client().chat.completions.create(**params)
+    return response.choices[0].message.content
+
+async def astream(model: str, system_prompt: str, user_prompt: str, conversation: List[Dict[str, str]], settings: Dict[str, Any]) -> AsyncIterator[str]:
+    params = _build_params(model, system_prompt, user_prompt, conversation, settings)
+    response = await _async_client().chat.completions.create(stream=True, **params)
+    try:
+        async for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        await response.close()
@@ -0,0 +1,249 @@
+"""Message chains for copy-on-write conversation forks.
+
+A fork stores only a pointer to its parent (``parent_id``) and the id of the
+last parent-chain message it inherits (``fork_message_id``); it owns just the
+messages added after the fork. Message ids increase monotonically, so a
+conversation's chain is every message of its own plus, for each ancestor,
+that ancestor's messages with an id up to the tightest fork point seen on
+the way up. The chain is read back ordered by id.
+
+Chains are cached per process. Messages are only ever appended to a
+conversation, and other worker processes append without touching this
+process's cache, so a cached chain is checked against the conversation's
+newest message (one index lookup) before it is used.
+"""
+import logging
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import and_, func, or_, select, update
+from sqlalchemy.orm import aliased
+
+from backend.models import db, Conversation, Message
+from backend.services.blobs import blob_store
+
+logger = logging.getLogger(__name__)
+
+# Bounded by the total number of messages held, not by conversations, since a
+# single deep fork can carry a very long chain.
+MATERIALIZED_MAX_MESSAGES = 100000
+
+class _MaterializationCache:
+    def __init__(self, max_messages):
+        self.max_messages = max_messages
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, conversation_id):
+        with self._lock:
+            messages = self._entries.get(conversation_id)
+            if messages is not None:
+                self._entries.move_to_end(conversation_id)
+            return messages
+
+    def set(self, conversation_id, messages):
+        with self._lock:
+            self._set(conversation_id, messages)
+
+    def current(self, conversation_id, latest_id):
+        """The cached chain if it ends at ``latest_id``, the conversation's newest own message.
+
+        ``latest_id`` None means the conversation has none yet, so only its
+        inherited messages, which never change, can be cached.
+        """
+        with self._lock:
+            messages = self._entries.get(conversation_id)
+            if messages is None:
+                return None
+            if latest_id is not None and (not messages or messages[-1]['id'] != latest_id):
+                self._discard(conversation_id)
+                return None
+            self._entries.move_to_end(conversation_id)
+            return messages
+
+    def extend(self, conversation_id, messages, previous_id):
+        """Append newly saved messages to a cached chain.
+
+        ``previous_id`` is the conversation's newest own message before them.
+        A cached chain that does not end there, because another thread or
+        process appended in between, is dropped instead, so chains never
+        have gaps and stay in id order.
+        """
+        with self._lock:
+            cached = self._entries.get(conversation_id)
+            if cached is None:
+                return
+            if (cached and cached[-1]['id'] >= messages[0]['id']) or \
+                    (previous_id is not None and (not cached or cached[-1]['id'] != previous_id)):
+                self._discard(conversation_id)
+                return
+            # Readers may still hold the old list, so it is not mutated
+            self._set(conversation_id, cached + messages)
+
+    def invalidate(self, conversation_id=None):
+        with self._lock:
+            if conversation_id is None:
+                self._entries.clear()
+                self._size = 0
+            else:
+                self._discard(conversation_id)
+
+    def _set(self, conversation_id, messages):
+        self._discard(conversation_id)
+        if len(messages) > self.max_messages:
+            return
+        self._entries[conversation_id] = messages
+        self._size += len(messages)
+        while self._size > self.max_messages:
+            self._discard(next(iter(self._entries)))
+
+    def _discard(self, conversation_id):
+        messages = self._entries.pop(conversation_id, None)
+        if messages is not None:
+            self._size -= len(messages)
+
+materialized = _MaterializationCache(MATERIALIZED_MAX_MESSAGES)
+
+def latest_id_query(conversation_id, before=None):
+    """Select the id of the conversation's newest own message (below ``before``)."""
+    query = select(func.max(Message.id)).where(Message.conversation_id == conversation_id)
+    if before is not None:
+        query = query.where(Message.id < before)
+    return query
+
+def _latest_id(conversation_id, before=None):
+    return db.session.scalar(latest_id_query(conversation_id, before))
+
+def cached_chain(conversation_id):
+    """The cached chain of the conversation if it is still current, else None."""
+    if materialized.get(conversation_id) is None:
+        return None
+    return materialized.current(conversation_id, _latest_id(conversation_id))
+
+def append(conversation_id, messages):
+    """Add messages that were just saved to the conversation to its cached chain."""
+    if materialized.get(conversation_id) is not None:
+        materialized.extend(conversation_id, messages, _latest_id(conversation_id, before=messages[0]['id']))
+
+def segments(conversation):
+    """Return ``[(conversation_id, max_message_id or None), ...]`` for the chain."""
+    result = [(conversation.id, None)]
+    cutoff = None
+    current = conversation
+    while current.parent_id is not None:
+        cutoff = current.fork_message_id if cutoff is None else min(cutoff, current.fork_message_id)
+        result.append((current.parent_id, cutoff))
+        current = db.session.get(Conversation, current.parent_id)
+        if current is None:
+            break
+    return result
+
+def chain_filter(conversation):
+    """SQL condition selecting every message in ``conversation``'s chain."""
+    if conversation.parent_id is None:
+        return Message.conversation_id == conversation.id
+    return or_(*[
+        Message.conversation_id == conversation_id if cutoff is None
+        else and_(Message.conversation_id == conversation_id, Message.id <= cutoff)
+        for conversation_id, cutoff in segments(conversation)
+    ])
+
+def chain_query(conversation):
+    return Message.query.filter(chain_filter(conversation)).order_by(Message.id)
+
+def summaries_query(user_id, preview_chars):
+    """The user's conversations with their message count and last message, newest first.
+
+    Rows have ``id``, ``title``, ``timestamp``, ``message_count``, and the
+    last message's ``role``, ``preview`` (its first ``preview_chars``
+    characters) and ``content_hash``.
+    """
+    own_message_count = select(func.count(Message.id)).where(
+        Message.conversation_id == Conversation.id
+    ).correlate(Conversation).scalar_subquery()
+    # A fork with no messages of its own ends on its fork point
+    last_message_id = func.coalesce(select(func.max(Message.id)).where(
+        Message.conversation_id == Conversation.id
+    ).correlate(Conversation).scalar_subquery(), Conversation.fork_message_id)
+    last_message = aliased(Message)
+
+    return db.session.query(
+        Conversation.id,
+        Conversation.title,
+        Conversation.timestamp,
+        (Conversation.inherited_count + own_message_count).label('message_count'),
+        last_message.role,
+        func.substr(last_message.content, 1, preview_chars).label('preview'),
+        last_message.content_hash,
+    ).outerjoin(
+        last_message, last_message.id == last_message_id
+    ).filter(Conversation.user_id == user_id).order_by(Conversation.id.desc())
+
+def get_chain(conversation):
+    """Every message in the chain as dicts, served from the cache when warm."""
+    messages = cached_chain(conversation.id)
+    if messages is None:
+        rows = chain_query(conversation).all()
+        contents = blob_store.load((m.content, m.content_hash) for m in rows)
+        messages = [{
+            'id': m.id,
+            'role': m.role,
+            'content': content,
+            'model': m.model
+        } for m, content in zip(rows, contents)]
+        materialized.set(conversation.id, messages)
+    return messages
+
+def chain_length(conversation):
+    """Number of messages in the conversation's chain, inherited ones included."""
+    cached = cached_chain(conversation.id)
+    if cached is not None:
+        return len(cached)
+    return conversation.inherited_count + conversation.messages.count()
+
+def fork_point(conversation, fork_index):
+    """Return ``(message_id, inherited_count)`` for forking after ``fork_index``.
+
+    ``fork_index`` must be within the chain; see ``chain_length``.
+    """
+    cached = cached_chain(conversation.id)
+    if cached is not None:
+        return cached[fork_index]['id'], fork_index + 1
+    message = chain_query(conversation).offset(fork_index).limit(1).first()
+    return message.id, fork_index + 1
+
+def detach_forks(conversation):
+    """Keep forks of ``conversation`` readable once it is deleted.
+
+    The fork with the latest fork point adopts the messages that any fork
+    still inherits, and takes over as parent of its siblings. Forks with an
+    earlier fork point never see the adopter's own messages, because those
+    all have ids above its fork point.
+    """
+    children = Conversation.query.filter_by(parent_id=conversation.id).all()
+    if not children:
+        materialized.invalidate(conversation.id)
+        return
+
+    heir = max(children, key=lambda c: c.fork_message_id)
+    moved = db.session.execute(
+        update(Message)
+        .where(Message.conversation_id == conversation.id, Message.id <= heir.fork_message_id)
+        .values(conversation_id=heir.id)
+    ).rowcount
+    heir.inherited_count -= moved
+    if conversation.parent_id is None:
+        heir.parent_id = None
+        heir.fork_message_id = None
+    else:
+        heir.parent_id = conversation.parent_id
+        heir.fork_message_id = min(heir.fork_message_id, conversation.fork_message_id)
+
+    for child in children:
+        if child is not heir:
+            child.parent_id = heir.id
+
+    # Segments of every descendant may have changed
+    materialized.invalidate()
+    logger.info("Conversation %s adopted %s messages from deleted conversation %s", heir.id, moved, conversation.id)
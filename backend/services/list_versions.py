@@ -0,0 +1,34 @@
+"""Per-user version counters for the conversation and prompt lists.
+
+Every write that changes what ``GET /api/conversations`` or ``GET
+/api/prompts`` returns for a user bumps that user's counter in the same
+transaction. The list endpoints build their ETag from it, so an unchanged
+list is answered with a 304 after a single primary-key lookup. The counters
+live in the database rather than in process memory, so every worker sees a
+bump straight away.
+"""
+from sqlalchemy import select, update
+
+from backend.models import db, User
+
+_COLUMNS = {
+    'conversations': User.conversations_version,
+    'prompts': User.prompts_version,
+}
+
+def bump(user_id, kind):
+    """Mark ``user_id``'s ``kind`` list as changed; commits with the caller's transaction."""
+    column = _COLUMNS[kind]
+    db.session.execute(update(User).where(User.id == user_id).values({column: column + 1}))
+
+def current(user_id, kind):
+    return db.session.execute(select(_COLUMNS[kind]).where(User.id == user_id)).scalar() or 0
+
+def etag(user_id, kind, *page):
+    """ETag for ``user_id``'s current ``kind`` list.
+
+    Paginated lists pass the arguments that select the page, e.g. its limit
+    and cursor, so each page gets its own tag.
+    """
+    parts = [kind, user_id, current(user_id, kind), *('' if arg is None else arg for arg in page)]
+    return '-'.join(str(part) for part in parts)
@@ -1,6 +1,97 @@
-# Placeholder for Llama service
-# Implementation depends on the specific Llama API or library being used
+import asyncio
+import os
+import threading
+from collections import OrderedDict
 
-def generate(system_prompt, user_prompt, conversation, settings):
-    # Implement Llama generation logic here
-    return "Llama response placeholder"
+from backend.config import Config
+
+# Local models run in-process with llama.cpp (the optional llama-cpp-python
+# package). Model "llama-foo" is loaded from LLAMA_MODEL_DIR/llama-foo.gguf on
+# first use. At most LLAMA_MAX_MODELS stay loaded, least recently used first
+# out. A model runs one completion at a time, so calls to the same model
+# queue behind each other.
+_models = OrderedDict()  # model name -> (Llama, lock)
+_models_lock = threading.Lock()
+
+def _model_path(model):
+    if os.path.basename(model) != model or model.startswith('.'):
+        raise ValueError(f"Unsupported model: {model}")
+    path = os.path.join(Config.LLAMA_MODEL_DIR, f"{model}.gguf")
+    if not os.path.exists(path):
+        raise ValueError(f"Unsupported model: {model} (no {path})")
+    return path
+
+def _get_model(model):
+    with _models_lock:
+        if model in _models:
+            _models.move_to_end(model)
+            return _models[model]
+        try:
+            from llama_cpp import Llama
+        except ImportError:
+            raise RuntimeError("Local llama models need the llama-cpp-python package") from None
+        llm = Llama(
+            model_path=_model_path(model),
+            n_ctx=Config.LLAMA_CONTEXT,
+            n_threads=Config.LLAMA_THREADS or None,
+            n_gpu_layers=Config.LLAMA_GPU_LAYERS,
+            verbose=False,
+        )
+        _models[model] = (llm, threading.Lock())
+        while len(_models) > max(1, Config.LLAMA_MAX_MODELS):
+            _models.popitem(last=False)
+        return _models[model]
+
+def _build_params(system_prompt, user_prompt, conversation, settings):
+    messages = [
+        *([{"role": "system", "content": system_prompt}] if system_prompt else []),
+        *[{"role": m['role'], "content": m['content']} for m in conversation],
+        {"role": "user", "content": user_prompt}
+    ]
+    return {
+        "messages": messages,
+        "max_tokens": int(settings['maxTokens']),
+        "temperature": float(settings['temperature']),
+        "top_p": float(settings['topP']),
+        "frequency_penalty": float(settings.get('frequencyPenalty', 0)),
+        "presence_penalty": float(settings.get('presencePenalty', 0)),
+    }
+
+def generate(model, system_prompt, user_prompt, conversation, settings):
+    llm, lock = _get_model(model)
+    params = _build_params(system_prompt, user_prompt, conversation, settings)
+    with lock:
+        response = llm.create_chat_completion(**params)
+    return response['choices'][0]['message']['content']
+
+def stream(model, system_prompt, user_prompt, conversation, settings):
+    """Yield the completion text chunk by chunk as the local model produces it."""
+    llm, lock = _get_model(model)
+    params = _build_params(system_prompt, user_prompt, conversation, settings)
+    with lock:
+        for chunk in llm.create_chat_completion(stream=True, **params):
+            text = chunk['choices'][0]['delta'].get('content')
+            if text:
+                yield text
+
+# Inference is CPU/GPU bound, so the async entry points run it on threads to
+# keep the event loop free
+async def agenerate(model, system_prompt, user_prompt, conversation, settings):
+    return await asyncio.to_thread(generate, model, system_prompt, user_prompt, conversation, settings)
+
+async def astream(model, system_prompt, user_prompt, conversation, settings):
+    chunks = stream(model, system_prompt, user_prompt, conversation, settings)
+    try:
+        while True:
+            text = await asyncio.to_thread(next, chunks, None)
+            if text is None:
+                return
+            yield text
+    finally:
+        # Releases the model if the caller stopped early. If it was cancelled
+        # mid-chunk, the generator is still running; it is closed when that
+        # thread drops it.
+        try:
+            await asyncio.to_thread(chunks.close)
+        except ValueError:
+            pass
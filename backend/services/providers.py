@@ -0,0 +1,83 @@
+"""Which provider serves a model, with providers loaded on first use.
+
+A provider is a service module exposing the same four functions::
+
+    generate(model, system_prompt, user_prompt, conversation, settings) -> str
+    stream(model, system_prompt, user_prompt, conversation, settings) -> iterator of text chunks
+    agenerate(...)  # coroutine, used by the ASGI entry point
+    astream(...)    # async iterator
+
+Models are routed by name prefix, the longest matching prefix winning. A
+provider's module, and with it its SDK, is imported the first time one of its
+models is used, and modules build their clients on first call. A worker
+therefore only pays for the SDKs it actually calls. Set ``PRELOAD_PROVIDERS``
+to import some at startup instead, e.g. before the server forks workers.
+
+More providers can be added with ``register`` or the ``MODEL_PROVIDERS``
+setting, e.g. ``"mistral=myapp.mistral_service:mistral-,open-mistral-"``.
+"""
+import importlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+_modules = {}       # provider name -> module path
+_routes = {}        # model prefix -> provider name
+_loaded = {}        # provider name -> imported module
+_lock = threading.Lock()
+
+def register(name, module, prefixes):
+    """Route models starting with any of ``prefixes`` to the service module at ``module``."""
+    with _lock:
+        _modules[name] = module
+        _loaded.pop(name, None)
+        for prefix in prefixes:
+            _routes[prefix] = name
+
+register('openai', 'backend.services.gpt_service', ['gpt-'])
+register('anthropic', 'backend.services.claude_service', ['claude-'])
+register('llama', 'backend.services.llama_service', ['llama-'])
+register('stub', 'backend.services.stub_service', ['stub-'])
+
+def parse_providers(spec):
+    """Parse ``MODEL_PROVIDERS`` into ``[(name, module, [prefix, ...]), ...]``."""
+    providers = []
+    for entry in filter(None, (part.strip() for part in spec.split(';'))):
+        name, _, target = entry.partition('=')
+        module, _, prefixes = target.partition(':')
+        prefixes = [p.strip() for p in prefixes.split(',') if p.strip()]
+        if not name.strip() or not module.strip() or not prefixes:
+            raise ValueError(f"Invalid MODEL_PROVIDERS entry: {entry!r}")
+        providers.append((name.strip(), module.strip(), prefixes))
+    return providers
+
+def init_app(app):
+    for name, module, prefixes in parse_providers(app.config.get('MODEL_PROVIDERS', '')):
+        register(name, module, prefixes)
+    for name in filter(None, (n.strip() for n in app.config.get('PRELOAD_PROVIDERS', '').split(','))):
+        load(name)
+
+def provider_for(model):
+    """The name of the provider serving ``model``, or None if no provider does."""
+    matches = [prefix for prefix in _routes if model.startswith(prefix)]
+    return _routes[max(matches, key=len)] if matches else None
+
+def load(name):
+    """Import provider ``name``'s module if it is not loaded yet, and return it."""
+    module = _loaded.get(name)
+    if module is None:
+        with _lock:
+            module = _loaded.get(name)
+            if module is None:
+                module = _loaded[name] = importlib.import_module(_modules[name])
+                logger.info("Loaded provider %s from %s", name, _modules[name])
+    return module
+
+def get(model):
+    """The service module serving ``model``, or None if no provider does."""
+    name = provider_for(model)
+    return load(name) if name is not None else None
+
+def loaded():
+    return sorted(_loaded)
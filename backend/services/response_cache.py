@@ -0,0 +1,231 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from backend.metrics import register_collector
+
+logger = logging.getLogger(__name__)
+
+def cache_key(model, system_prompt, user_prompt, conversation, settings):
+    """Content address of a generate request.
+
+    Settings are normalised to the types the services send upstream, so
+    ``0`` and ``0.0`` or ``"2048"`` and ``2048`` hash the same.
+    """
+    canonical = {
+        'model': model,
+        'system': system_prompt,
+        'user': user_prompt,
+        'conversation': [[m['role'], m['content']] for m in conversation],
+        'settings': {
+            'temperature': float(settings['temperature']),
+            'maxTokens': int(settings['maxTokens']),
+            'topP': float(settings['topP']),
+            'frequencyPenalty': float(settings['frequencyPenalty']),
+            'presencePenalty': float(settings['presencePenalty']),
+        },
+    }
+    encoded = json.dumps(canonical, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+def is_deterministic(settings):
+    """Only temperature 0 completions are worth replaying from cache."""
+    try:
+        return float(settings['temperature']) == 0.0
+    except (KeyError, TypeError, ValueError):
+        return False
+
+class _DiskTier:
+    """SQLite-backed second tier that survives restarts.
+
+    Expired rows are pruned, and the oldest rows beyond ``max_rows``
+    evicted, on open and then at most every ``PRUNE_INTERVAL`` seconds of
+    writes. Processes sharing the file each prune it.
+    """
+
+    PRUNE_INTERVAL = 60
+
+    def __init__(self, path, ttl=0, max_rows=0):
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS completions ('
+            'key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS ix_completions_created_at ON completions (created_at)')
+        self._pruned_at = 0
+        self.prune()
+
+    def get(self, key):
+        """Return ``(value, created_at)``, or None if missing or expired."""
+        with self._lock:
+            row = self._conn.execute('SELECT value, created_at FROM completions WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            if self.ttl and time.time() - row[1] > self.ttl:
+                self._conn.execute('DELETE FROM completions WHERE key = ?', (key,))
+                return None
+            return row
+
+    def set(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO completions (key, value, created_at) VALUES (?, ?, ?)',
+                (key, value, now)
+            )
+        if now - self._pruned_at > self.PRUNE_INTERVAL:
+            self.prune()
+
+    def prune(self):
+        """Delete expired rows and the oldest rows beyond ``max_rows``; returns how many went."""
+        with self._lock:
+            self._pruned_at = time.time()
+            deleted = 0
+            if self.ttl:
+                deleted += self._conn.execute(
+                    'DELETE FROM completions WHERE created_at < ?', (self._pruned_at - self.ttl,)
+                ).rowcount
+            if self.max_rows:
+                excess = self._conn.execute('SELECT COUNT(*) FROM completions').fetchone()[0] - self.max_rows
+                if excess > 0:
+                    deleted += self._conn.execute(
+                        'DELETE FROM completions WHERE key IN '
+                        '(SELECT key FROM completions ORDER BY created_at LIMIT ?)', (excess,)
+                    ).rowcount
+        if deleted:
+            logger.debug("Pruned %d response cache rows", deleted)
+        return deleted
+
+class ResponseCache:
+    """Two-tier completion cache: an in-memory LRU in front of an optional
+    SQLite file. Entries expire after ``RESPONSE_CACHE_TTL`` seconds, the
+    memory tier is bounded both by entry count and by total characters, and
+    the file by ``RESPONSE_CACHE_DISK_MAX_ROWS``.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.max_entries = 0
+        self.max_chars = 0
+        self.ttl = 0
+        self.max_disk_rows = 0
+        self._path = None
+        self._disk = None
+        self._pid = None
+        self._entries = OrderedDict()
+        self._chars = 0
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'memoryHits': 0, 'diskHits': 0, 'misses': 0, 'bypassed': 0, 'stores': 0, 'evictions': 0}
+
+    def init_app(self, app):
+        self.enabled = app.config.get('RESPONSE_CACHE_ENABLED', True)
+        self.max_entries = app.config.get('RESPONSE_CACHE_SIZE', 1024)
+        self.max_chars = app.config.get('RESPONSE_CACHE_MAX_CHARS', 32 * 1024 * 1024)
+        self.ttl = app.config.get('RESPONSE_CACHE_TTL', 3600)
+        self.max_disk_rows = app.config.get('RESPONSE_CACHE_DISK_MAX_ROWS', 100000)
+        self._path = app.config.get('RESPONSE_CACHE_PATH')
+
+    def _get_disk(self):
+        # SQLite connections must not cross a fork, so open one per process.
+        if self._path and self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._disk = _DiskTier(self._path, self.ttl, self.max_disk_rows)
+                    self._pid = os.getpid()
+        return self._disk
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def bypass(self):
+        self._count('bypassed')
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, created_at = entry
+                if not self.ttl or now - created_at <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self.stats['hits'] += 1
+                    self.stats['memoryHits'] += 1
+                    return value
+                self._remove(key)
+
+        disk = self._get_disk()
+        row = disk.get(key) if disk else None
+        if row is None:
+            self._count('misses')
+            return None
+
+        value, created_at = row
+        with self._lock:
+            self.stats['hits'] += 1
+            self.stats['diskHits'] += 1
+            # Keeps the entry's age, so promotion does not extend its TTL
+            self._insert(key, value, created_at)
+        return value
+
+    def set(self, key, value):
+        if value is None:
+            return
+        with self._lock:
+            self.stats['stores'] += 1
+            self._insert(key, value, time.time())
+        disk = self._get_disk()
+        if disk:
+            try:
+                disk.set(key, value)
+            except sqlite3.Error as e:
+                logger.error("Failed to write response cache entry: %s", e)
+
+    def _insert(self, key, value, created_at):
+        if key in self._entries:
+            self._remove(key)
+        if len(value) > self.max_chars:
+            return
+        self._entries[key] = (value, created_at)
+        self._chars += len(value)
+        while len(self._entries) > self.max_entries or self._chars > self.max_chars:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.stats['evictions'] += 1
+
+    def _remove(self, key):
+        value, _ = self._entries.pop(key)
+        self._chars -= len(value)
+
+    def snapshot(self):
+        with self._lock:
+            lookups = self.stats['hits'] + self.stats['misses']
+            return {
+                **self.stats,
+                'hitRate': (self.stats['hits'] / lookups) if lookups else None,
+                'entries': len(self._entries),
+                'chars': self._chars,
+                'diskTier': bool(self._path),
+            }
+
+    def prometheus_samples(self):
+        stats = self.snapshot()
+        return [
+            ('llm_response_cache_hits_total', 'counter', 'Generate calls served from the response cache.', stats['hits']),
+            ('llm_response_cache_misses_total', 'counter', 'Cacheable generate calls that went upstream.', stats['misses']),
+            ('llm_response_cache_bypassed_total', 'counter', 'Generate calls with non-deterministic settings.', stats['bypassed']),
+            ('llm_response_cache_entries', 'gauge', 'Entries held in the in-memory cache tier.', stats['entries']),
+        ]
+
+response_cache = ResponseCache()
+register_collector(response_cache.prometheus_samples)
@@ -0,0 +1,486 @@
+"""Scheduling of upstream LLM calls.
+
+Every generate call goes through ``scheduler``, which:
+
+- waits for capacity in per-provider token buckets (requests and tokens per
+  minute). Waiters are served by priority, then round-robin across clients,
+  so one client's burst cannot starve everyone else;
+- retries 429s, 5xx and connection errors with jittered exponential
+  backoff, honouring ``Retry-After``. A 429 also pauses the provider's
+  bucket, so other requests back off too;
+- optionally hedges a non-streamed call: if it is still running after the
+  model's recent latency percentile, a duplicate is sent and the first
+  answer wins;
+- moves on to the next model in the configured fallback chain once a model's
+  retries are used up.
+
+Streams are retried and fall back only until their first chunk; after that
+an error is passed to the client. Buckets are per worker process, so set the
+limits to the provider's limit divided by the number of workers.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from backend import metrics
+from backend.services.providers import provider_for
+from backend.services.tokens import chars_to_tokens
+
+logger = logging.getLogger(__name__)
+
+PRIORITIES = {'high': 0, 'normal': 1, 'low': 2}
+# Set by the server for each kind of work, never taken from a request, so
+# callers cannot jump the queue. Titles and evals also run at 'low'.
+INTERACTIVE_PRIORITY = 'normal'
+BATCH_PRIORITY = 'low'
+# How often a queued request that is not at the head rechecks the queue
+POLL_INTERVAL = 0.01
+# Successful call latencies kept per model for the hedging threshold
+HEDGE_WINDOW = 200
+
+class Throttled(Exception):
+    """A call waited longer than the queue timeout for rate-limit capacity."""
+
+def error_status(exc):
+    """HTTP status to report for a failed generate call."""
+    if isinstance(exc, Throttled) or getattr(exc, 'status_code', None) == 429:
+        return 429
+    return 500
+
+def _transient_reason(exc):
+    """Why ``exc`` is worth retrying, or None if it is not."""
+    status = getattr(exc, 'status_code', None)
+    if status == 429:
+        return 'rate_limited'
+    if status == 408:
+        return 'timeout'
+    if status is not None and status >= 500:
+        return 'server_error'
+    # The SDKs' and httpx's connection errors, without importing the SDKs
+    names = {cls.__name__ for cls in type(exc).__mro__}
+    if names & {'APIConnectionError', 'APITimeoutError', 'TransportError'} or isinstance(exc, (ConnectionError, TimeoutError)):
+        return 'connection'
+    return None
+
+def _retry_after(exc):
+    headers = getattr(getattr(exc, 'response', None), 'headers', None)
+    if not headers:
+        return None
+    try:
+        if headers.get('retry-after-ms') is not None:
+            return float(headers['retry-after-ms']) / 1000
+        if headers.get('retry-after') is not None:
+            return float(headers['retry-after'])
+    except ValueError:
+        pass
+    return None
+
+def parse_fallbacks(spec):
+    """Parse ``"gpt-4o=gpt-4o-mini,claude-3-haiku;..."`` into ``{model: [fallback, ...]}``."""
+    chains = {}
+    for entry in filter(None, (part.strip() for part in (spec or '').split(';'))):
+        model, _, fallbacks = entry.partition('=')
+        chains[model.strip()] = [m.strip() for m in fallbacks.split(',') if m.strip()]
+    return chains
+
+class _Bucket:
+    """Token bucket refilled continuously at ``per_minute / 60`` per second."""
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def delay(self, amount, now):
+        """Seconds until ``amount`` is available; amounts above capacity wait for a full bucket."""
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount):
+        self.level -= min(amount, self.capacity)
+
+class _Limiter:
+    """Request and token buckets for one provider, with a priority queue of waiters."""
+
+    def __init__(self, rpm, tpm):
+        self.requests = _Bucket(rpm) if rpm > 0 else None
+        self.tokens = _Bucket(tpm) if tpm > 0 else None
+        self.paused_until = 0.0
+        self._queue = []
+        self._queued = Counter()
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    @property
+    def unlimited(self):
+        return self.requests is None and self.tokens is None
+
+    def _delay(self, cost, now):
+        delay = max(0.0, self.paused_until - now)
+        if self.requests is not None:
+            delay = max(delay, self.requests.delay(1, now))
+        if self.tokens is not None:
+            delay = max(delay, self.tokens.delay(cost, now))
+        return delay
+
+    def _take(self, cost):
+        if self.requests is not None:
+            self.requests.take(1)
+        if self.tokens is not None:
+            self.tokens.take(cost)
+
+    def enqueue(self, client, priority):
+        with self._lock:
+            # A client's Nth queued request ranks behind every other
+            # client's first, which serves clients round-robin
+            entry = (priority, self._queued[client], next(self._seq), client)
+            self._queued[client] += 1
+            heapq.heappush(self._queue, entry)
+            return entry
+
+    def poll(self, entry, cost):
+        """Grant ``entry`` if it is at the head and capacity allows; else return seconds to wait."""
+        with self._lock:
+            if self._queue[0] is not entry:
+                return POLL_INTERVAL
+            delay = self._delay(cost, time.monotonic())
+            if delay > 0:
+                # Recheck regularly in case a higher priority request arrives
+                return min(delay, 0.25)
+            self._take(cost)
+            heapq.heappop(self._queue)
+            self._release(entry)
+            return 0.0
+
+    def leave(self, entry):
+        with self._lock:
+            if entry in self._queue:
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+                self._release(entry)
+
+    def _release(self, entry):
+        client = entry[3]
+        self._queued[client] -= 1
+        if not self._queued[client]:
+            del self._queued[client]
+
+    def try_take(self, cost):
+        """Take capacity only if nobody is queued and it is available now."""
+        if self.unlimited:
+            return True
+        with self._lock:
+            if self._queue or self._delay(cost, time.monotonic()) > 0:
+                return False
+            self._take(cost)
+            return True
+
+    def pause(self, seconds):
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+class Scheduler:
+    def __init__(self):
+        self.queue_timeout = 30.0
+        self.retries = 3
+        self.backoff_base = 0.5
+        self.backoff_max = 20.0
+        self.hedge_percentile = 0.0
+        self.hedge_min_samples = 50
+        self.fallbacks = {}
+        self._limits = {}
+        self._limiters = {}
+        self._lock = threading.Lock()
+        self._latencies = defaultdict(lambda: deque(maxlen=HEDGE_WINDOW))
+        self._pools = {}
+        self._hedge_threads = 32
+        self._hedge_slots = threading.BoundedSemaphore(self._hedge_threads)
+        self._primary_slots = threading.BoundedSemaphore(self._hedge_threads)
+
+    def init_app(self, app):
+        self.queue_timeout = app.config.get('SCHEDULER_QUEUE_TIMEOUT', self.queue_timeout)
+        self.retries = app.config.get('UPSTREAM_RETRIES', self.retries)
+        self.backoff_base = app.config.get('UPSTREAM_BACKOFF_BASE', self.backoff_base)
+        self.backoff_max = app.config.get('UPSTREAM_BACKOFF_MAX', self.backoff_max)
+        self.hedge_percentile = app.config.get('HEDGE_PERCENTILE', self.hedge_percentile)
+        self.hedge_min_samples = app.config.get('HEDGE_MIN_SAMPLES', self.hedge_min_samples)
+        self._hedge_threads = app.config.get('HEDGE_THREADS', self._hedge_threads)
+        self._hedge_slots = threading.BoundedSemaphore(self._hedge_threads)
+        self._primary_slots = threading.BoundedSemaphore(self._hedge_threads)
+        self.fallbacks = parse_fallbacks(app.config.get('MODEL_FALLBACKS'))
+        self._limits = app.config.get('RATE_LIMITS', {})
+        self._limiters = {}
+
+    def _limiter(self, provider):
+        limiter = self._limiters.get(provider)
+        if limiter is None:
+            with self._lock:
+                limiter = self._limiters.get(provider)
+                if limiter is None:
+                    limiter = self._limiters[provider] = _Limiter(*self._limits.get(provider, (0, 0)))
+        return limiter
+
+    def _chain(self, model):
+        return [model] + [m for m in self.fallbacks.get(model, []) if m != model]
+
+    @staticmethod
+    def _cost(args):
+        # Providers count max_tokens against the token limit up front
+        model, system_prompt, user_prompt, conversation, settings = args
+        return chars_to_tokens(metrics.prompt_chars(system_prompt, user_prompt, conversation)) + int(settings['maxTokens'])
+
+    def _retry_delay(self, exc, attempt):
+        """Return ``(delay, reason)``; delay is None when ``exc`` should not be retried."""
+        reason = _transient_reason(exc)
+        if reason is None or attempt >= self.retries:
+            return None, reason
+        delay = _retry_after(exc)
+        if delay is None:
+            delay = random.uniform(0.5, 1.0) * self.backoff_base * 2 ** attempt
+        return min(delay, self.backoff_max), reason
+
+    def _fall_back(self, exc, model, chain, position):
+        if position + 1 >= len(chain):
+            return False
+        if not isinstance(exc, Throttled) and _transient_reason(exc) is None:
+            return False
+        logger.warning("Falling back from %s to %s: %s", model, chain[position + 1], exc)
+        metrics.observe_fallback(model, chain[position + 1])
+        return True
+
+    def _record_latency(self, model, seconds):
+        self._latencies[model].append(seconds)
+
+    def _hedge_after(self, model):
+        """Seconds after which to hedge a call to ``model``, or None."""
+        if not self.hedge_percentile:
+            return None
+        samples = sorted(self._latencies[model])
+        if len(samples) < self.hedge_min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(self.hedge_percentile * len(samples)))]
+
+    # Threads
+
+    def _acquire(self, provider, cost, client, priority):
+        limiter = self._limiter(provider)
+        if limiter.unlimited:
+            return limiter
+        start = time.monotonic()
+        deadline = start + self.queue_timeout
+        entry = limiter.enqueue(client, priority)
+        try:
+            while True:
+                delay = limiter.poll(entry, cost)
+                if not delay:
+                    metrics.observe_scheduler_wait(provider, time.monotonic() - start)
+                    return limiter
+                if time.monotonic() + delay > deadline:
+                    raise Throttled(f"Rate limit for {provider} exceeded; try again later")
+                time.sleep(delay)
+        finally:
+            limiter.leave(entry)
+
+    def _run(self, attempt, args, client, priority):
+        chain = self._chain(args[0])
+        priority = PRIORITIES.get(priority, PRIORITIES['normal'])
+        for position, model in enumerate(chain):
+            model_args = (model, *args[1:])
+            provider, cost = provider_for(model), self._cost(model_args)
+            for tries in itertools.count():
+                try:
+                    limiter = self._acquire(provider, cost, client or 'anonymous', priority)
+                    return attempt(model_args, limiter, cost), model
+                except Exception as e:
+                    delay, reason = self._retry_delay(e, tries)
+                    if delay is None:
+                        if self._fall_back(e, model, chain, position):
+                            break
+                        raise
+                    logger.info("Retrying %s in %.2fs after %s: %s", model, delay, reason, e)
+                    metrics.observe_retry(model, reason)
+                    if reason == 'rate_limited':
+                        self._limiter(provider).pause(delay)
+                    time.sleep(delay)
+
+    def _pool(self, name):
+        executor = self._pools.get(name)
+        if executor is None:
+            with self._lock:
+                executor = self._pools.get(name)
+                if executor is None:
+                    executor = self._pools[name] = ThreadPoolExecutor(max_workers=self._hedge_threads, thread_name_prefix=name)
+        return executor
+
+    def _take_hedge_slot(self, limiter, cost):
+        if not self._hedge_slots.acquire(blocking=False):
+            return False
+        if not limiter.try_take(cost):
+            self._hedge_slots.release()
+            return False
+        return True
+
+    def _hedged(self, call, args, limiter, cost):
+        model = args[0]
+        start = time.perf_counter()
+        threshold = self._hedge_after(model)
+        # Primaries run on a bounded pool so this thread is free to return
+        # whichever answer comes first. When every primary thread is busy the
+        # call runs here unhedged rather than queueing for one.
+        if threshold is None or not self._primary_slots.acquire(blocking=False):
+            result = call(*args)
+            self._record_latency(model, time.perf_counter() - start)
+            return result
+
+        primary = self._pool('hedge-primary').submit(call, *args)
+        primary.add_done_callback(lambda _: self._primary_slots.release())
+        done, _ = wait([primary], timeout=threshold)
+        # No hedge when the provider is already at its limit or every hedge
+        # thread is busy, so hedges never queue either
+        if done or not self._take_hedge_slot(limiter, cost):
+            result = primary.result()
+            self._record_latency(model, time.perf_counter() - start)
+            return result
+
+        hedge = self._pool('hedge').submit(call, *args)
+        hedge.add_done_callback(lambda _: self._hedge_slots.release())
+        pending, error = {primary, hedge}, None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    # The loser keeps running in the background; its result is dropped
+                    metrics.observe_hedge(model, 'hedge' if future is hedge else 'primary')
+                    self._record_latency(model, time.perf_counter() - start)
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def generate(self, call, args, client=None, priority=None):
+        """Run ``call(*args)`` under the scheduler; return ``(result, model that served it)``.
+
+        ``args`` are the usual ``(model, system_prompt, user_prompt,
+        conversation, settings)``; fallback models are passed in place of
+        ``model``.
+        """
+        return self._run(lambda model_args, limiter, cost: self._hedged(call, model_args, limiter, cost),
+                         args, client, priority)
+
+    def stream(self, call, args, client=None, priority=None):
+        """Yield the chunks of ``call(*args)``, retrying or falling back until the first chunk."""
+        def open_stream(model_args, limiter, cost):
+            chunks = iter(call(*model_args))
+            return next(chunks, None), chunks
+
+        (first, chunks), _ = self._run(open_stream, args, client, priority)
+        if first is None:
+            return
+        yield first
+        yield from chunks
+
+    # Event loop
+
+    async def _aacquire(self, provider, cost, client, priority):
+        limiter = self._limiter(provider)
+        if limiter.unlimited:
+            return limiter
+        start = time.monotonic()
+        deadline = start + self.queue_timeout
+        entry = limiter.enqueue(client, priority)
+        try:
+            while True:
+                delay = limiter.poll(entry, cost)
+                if not delay:
+                    metrics.observe_scheduler_wait(provider, time.monotonic() - start)
+                    return limiter
+                if time.monotonic() + delay > deadline:
+                    raise Throttled(f"Rate limit for {provider} exceeded; try again later")
+                await asyncio.sleep(delay)
+        finally:
+            limiter.leave(entry)
+
+    async def _arun(self, attempt, args, client, priority):
+        chain = self._chain(args[0])
+        priority = PRIORITIES.get(priority, PRIORITIES['normal'])
+        for position, model in enumerate(chain):
+            model_args = (model, *args[1:])
+            provider, cost = provider_for(model), self._cost(model_args)
+            for tries in itertools.count():
+                try:
+                    limiter = await self._aacquire(provider, cost, client or 'anonymous', priority)
+                    return await attempt(model_args, limiter, cost), model
+                except Exception as e:
+                    delay, reason = self._retry_delay(e, tries)
+                    if delay is None:
+                        if self._fall_back(e, model, chain, position):
+                            break
+                        raise
+                    logger.info("Retrying %s in %.2fs after %s: %s", model, delay, reason, e)
+                    metrics.observe_retry(model, reason)
+                    if reason == 'rate_limited':
+                        self._limiter(provider).pause(delay)
+                    await asyncio.sleep(delay)
+
+    async def _ahedged(self, call, args, limiter, cost):
+        model = args[0]
+        start = time.perf_counter()
+        threshold = self._hedge_after(model)
+        if threshold is None:
+            result = await call(*args)
+            self._record_latency(model, time.perf_counter() - start)
+            return result
+
+        tasks = [asyncio.ensure_future(call(*args))]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=threshold)
+            if not done and limiter.try_take(cost):
+                tasks.append(asyncio.ensure_future(call(*args)))
+            pending, error = set(tasks), None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if len(tasks) > 1:
+                            metrics.observe_hedge(model, 'hedge' if task is tasks[1] else 'primary')
+                        self._record_latency(model, time.perf_counter() - start)
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def agenerate(self, call, args, client=None, priority=None):
+        """Async ``generate``; ``call`` is a coroutine function."""
+        return await self._arun(lambda model_args, limiter, cost: self._ahedged(call, model_args, limiter, cost),
+                                args, client, priority)
+
+    async def astream(self, call, args, client=None, priority=None):
+        """Async ``stream``; ``call`` returns an async iterator."""
+        async def open_stream(model_args, limiter, cost):
+            chunks = call(*model_args)
+            try:
+                return await chunks.__anext__(), chunks
+            except StopAsyncIteration:
+                return None, chunks
+
+        (first, chunks), _ = await self._arun(open_stream, args, client, priority)
+        try:
+            if first is None:
+                return
+            yield first
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            await chunks.aclose()
+
+scheduler = Scheduler()
@@ -0,0 +1,316 @@
+"""Full-text search over messages, conversation titles and saved prompts.
+
+On SQLite the index is a set of FTS5 tables using the source tables as
+external content, kept current by triggers, so every write path (ORM,
+executemany inserts, bulk deletes) updates it without application code.
+Messages are indexed with their owner, and only the newest matches of very
+common terms are ranked (``SEARCH_RANK_WINDOW``), so query time stays flat
+as a user's history grows. Long text kept in the blob store is indexed from
+the blob's ``search_text`` (see ``backend.services.blobs``), so the triggers
+are plain SQL. On PostgreSQL the same queries run against ``to_tsvector``
+GIN expression indexes. Other backends fall back to unranked substring
+matching.
+
+Results from all three sources are ranked together and paged by offset.
+"""
+import logging
+import re
+
+from sqlalchemy import DDL, and_, event, func, literal, null, or_, select, text, union_all
+from sqlalchemy.orm import aliased
+
+from backend.config import Config
+from backend.models import db, ContentBlob, Conversation, Message, Prompt
+
+logger = logging.getLogger(__name__)
+
+KINDS = ('message', 'conversation', 'prompt')
+SNIPPET_OPEN = '**'
+SNIPPET_CLOSE = '**'
+SNIPPET_TOKENS = 16
+FALLBACK_SNIPPET_CHARS = 200
+TS_CONFIG = 'english'
+
+_TOKENIZER = "porter unicode61 remove_diacritics 2"
+
+# kind: (FTS table, source table, indexed columns)
+_FTS_TABLES = {
+    'message': ('message_fts', 'message', ('content',)),
+    'conversation': ('conversation_fts', 'conversation', ('title',)),
+    'prompt': ('prompt_fts', 'prompt', ('name', 'system_prompt', 'user_prompt')),
+}
+
+_MESSAGE_OWNER = "(SELECT user_id FROM conversation WHERE id = {row}.conversation_id)"
+
+# Columns whose long values are kept in content_blob, next to a <column>_hash
+# column (see backend/services/blobs.py)
+_BLOB_COLUMNS = {'content', 'system_prompt', 'user_prompt'}
+
+def _text(row, column):
+    """SQL for ``row``'s text in ``column``, read from its blob when it has one."""
+    if column not in _BLOB_COLUMNS:
+        return f'{row}.{column}'
+    return (f"CASE WHEN {row}.{column}_hash IS NULL THEN {row}.{column} ELSE "
+            f"(SELECT search_text FROM content_blob WHERE hash = {row}.{column}_hash) END")
+
+def _sqlite_ddl(kind):
+    fts, source, columns = _FTS_TABLES[kind]
+    cols = ', '.join(columns)
+    new = ', '.join(_text('new', c) for c in columns)
+    old = ', '.join(_text('old', c) for c in columns)
+    watched = [c for column in columns for c in ((column, f'{column}_hash') if column in _BLOB_COLUMNS else (column,))]
+    statements = []
+    content = source
+    if kind == 'message':
+        # Messages are indexed with their owner so the user filter is part of
+        # the full-text match instead of a join over every hit
+        content = 'message_search'
+        statements.append(
+            "CREATE VIEW IF NOT EXISTS message_search AS "
+            f"SELECT message.id AS id, {_text('message', 'content')} AS content, conversation.user_id AS owner "
+            "FROM message JOIN conversation ON conversation.id = message.conversation_id"
+        )
+        cols += ', owner'
+        new += ', ' + _MESSAGE_OWNER.format(row='new')
+        old += ', ' + _MESSAGE_OWNER.format(row='old')
+        # A fork adopts messages by rewriting conversation_id, which can
+        # change their owner
+        watched.append('conversation_id')
+    elif kind == 'prompt':
+        # Snippets and rebuilds read the text back through the view
+        content = 'prompt_search'
+        statements.append(
+            "CREATE VIEW IF NOT EXISTS prompt_search AS "
+            f"SELECT prompt.id AS id, prompt.name AS name, {_text('prompt', 'system_prompt')} AS system_prompt, "
+            f"{_text('prompt', 'user_prompt')} AS user_prompt FROM prompt"
+        )
+    statements += [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+        f"{cols}, content='{content}', content_rowid='id', tokenize='{_TOKENIZER}')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {source} BEGIN "
+        f"INSERT INTO {fts} (rowid, {cols}) VALUES (new.id, {new}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {source} BEGIN "
+        f"INSERT INTO {fts} ({fts}, rowid, {cols}) VALUES ('delete', old.id, {old}); END",
+        # Only re-index when indexed values change
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {', '.join(watched)} ON {source} BEGIN "
+        f"INSERT INTO {fts} ({fts}, rowid, {cols}) VALUES ('delete', old.id, {old}); "
+        f"INSERT INTO {fts} (rowid, {cols}) VALUES (new.id, {new}); END",
+    ]
+    return statements
+
+def _postgres_ddl(kind):
+    _, source, columns = _FTS_TABLES[kind]
+    if kind == 'prompt':
+        # Prompt text is resolved from blobs through joins, which an
+        # expression index cannot cover; prompts are found by user_id
+        return []
+    document = " || ' ' || ".join(f"coalesce({c}, '')" for c in columns)
+    statements = [
+        f"CREATE INDEX IF NOT EXISTS ix_{source}_search ON {source} "
+        f"USING gin (to_tsvector('{TS_CONFIG}', {document}))",
+    ]
+    if kind == 'message':
+        # Long messages are matched through their blob's text
+        statements.append(
+            "CREATE INDEX IF NOT EXISTS ix_content_blob_search ON content_blob "
+            f"USING gin (to_tsvector('{TS_CONFIG}', coalesce(search_text, '')))"
+        )
+    return statements
+
+# Fresh databases get the index from db.create_all(); existing ones through
+# the 0003_search_index migration.
+for _kind, _model in (('message', Message), ('conversation', Conversation), ('prompt', Prompt)):
+    for _statement in _sqlite_ddl(_kind):
+        event.listen(_model.__table__, 'after_create', DDL(_statement).execute_if(dialect='sqlite'))
+    for _statement in _postgres_ddl(_kind):
+        event.listen(_model.__table__, 'after_create', DDL(_statement).execute_if(dialect='postgresql'))
+
+def create_index(rebuild=True):
+    """Create the search index for the current backend and fill it from existing rows."""
+    dialect = db.engine.dialect.name
+    for kind in KINDS:
+        if dialect == 'sqlite':
+            for statement in _sqlite_ddl(kind):
+                db.session.execute(text(statement))
+            if rebuild:
+                fts = _FTS_TABLES[kind][0]
+                # Reads every row back from the content table or view
+                db.session.execute(text(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')"))
+        elif dialect == 'postgresql':
+            for statement in _postgres_ddl(kind):
+                db.session.execute(text(statement))
+
+def recreate_index(kind, drop_table=False, rebuild=False):
+    """Replace ``kind``'s SQLite triggers and views with their current definitions.
+
+    With ``drop_table`` the FTS table is recreated as well, for when its
+    content source changed. With either flag the index is refilled from the
+    source rows.
+    """
+    if db.engine.dialect.name != 'sqlite':
+        return
+    fts = _FTS_TABLES[kind][0]
+    for suffix in ('ai', 'ad', 'au'):
+        db.session.execute(text(f"DROP TRIGGER IF EXISTS {fts}_{suffix}"))
+    db.session.execute(text(f"DROP VIEW IF EXISTS {kind}_search"))
+    if drop_table:
+        db.session.execute(text(f"DROP TABLE IF EXISTS {fts}"))
+    for statement in _sqlite_ddl(kind):
+        db.session.execute(text(statement))
+    if drop_table or rebuild:
+        db.session.execute(text(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')"))
+
+def terms(query):
+    """Split a user query into plain word terms, dropping search syntax."""
+    return re.findall(r'\w+', query.lower())
+
+def search(user_id, query, kinds=KINDS, limit=20, offset=0):
+    """Return up to ``limit`` ranked hits, each a dict with type, ids and a snippet.
+
+    All terms must match; the last one also matches as a prefix, so results
+    update sensibly while the user is still typing.
+    """
+    words = terms(query)
+    if not words:
+        return []
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        rows = _search_sqlite(user_id, words, kinds, limit, offset)
+    else:
+        rows = _search_generic(user_id, words, kinds, limit, offset, dialect)
+    return [{
+        'type': row.type,
+        'id': row.id,
+        'conversationId': row.conversation_id,
+        'title': row.title,
+        'snippet': row.snippet,
+    } for row in rows]
+
+def _match(words):
+    return ' '.join(f'"{word}"' for word in words) + '*'
+
+def _owner_match(user_id, words):
+    # Terms are restricted to the content column, or a query for the
+    # user's own id would match every message through the owner column
+    return f'owner : "{int(user_id)}" AND content : ({_match(words)})'
+
+def truncated(user_id, query):
+    """Whether more messages match ``query`` than the rank window scores.
+
+    Very common terms can match most of a user's messages; only the newest
+    ``SEARCH_RANK_WINDOW`` matches are ranked, which bounds a query's cost
+    at any history size, and older matches are left out of the results.
+    """
+    words = terms(query)
+    window = Config.SEARCH_RANK_WINDOW
+    if not words or window <= 0 or db.engine.dialect.name != 'sqlite':
+        return False
+    return db.session.execute(text(
+        "SELECT 1 FROM message_fts WHERE message_fts MATCH :owner_match "
+        "ORDER BY rowid DESC LIMIT 1 OFFSET :window"
+    ), {'owner_match': _owner_match(user_id, words), 'window': window}).first() is not None
+
+def _search_sqlite(user_id, words, kinds, limit, offset):
+    sql, params = _sqlite_statement(user_id, words, kinds, limit, offset)
+    return db.session.execute(text(sql), params).all()
+
+def sqlite_statement(user_id, query, kinds=KINDS, limit=20, offset=0):
+    """The SQL and parameters ``search`` runs on SQLite, e.g. to inspect its plan."""
+    return _sqlite_statement(user_id, terms(query), kinds, limit, offset)
+
+def _sqlite_statement(user_id, words, kinds, limit, offset):
+    window = Config.SEARCH_RANK_WINDOW
+    # Ranks only the newest matches; see ``truncated``
+    in_window = f""" AND message_fts.rowid >= coalesce((
+                SELECT rowid FROM message_fts WHERE message_fts MATCH :owner_match
+                ORDER BY rowid DESC LIMIT 1 OFFSET {window - 1}), 0)""" if window > 0 else ''
+    snippet = f"'{SNIPPET_OPEN}', '{SNIPPET_CLOSE}', '...', {SNIPPET_TOKENS}"
+    selects = {
+        'message': f"""
+            SELECT 'message' AS type, m.id AS id, m.conversation_id AS conversation_id, c.title AS title,
+                   snippet(message_fts, 0, {snippet}) AS snippet, bm25(message_fts, 1.0, 0.0) AS rank
+            FROM message_fts
+            JOIN message m ON m.id = message_fts.rowid
+            JOIN conversation c ON c.id = m.conversation_id
+            WHERE message_fts MATCH :owner_match{in_window}""",
+        'conversation': f"""
+            SELECT 'conversation' AS type, c.id AS id, c.id AS conversation_id, c.title AS title,
+                   snippet(conversation_fts, 0, {snippet}) AS snippet, bm25(conversation_fts) AS rank
+            FROM conversation_fts
+            JOIN conversation c ON c.id = conversation_fts.rowid
+            WHERE conversation_fts MATCH :match AND c.user_id = :user_id""",
+        # A hit on the prompt name counts for more than one in its text
+        'prompt': f"""
+            SELECT 'prompt' AS type, p.id AS id, NULL AS conversation_id, p.name AS title,
+                   snippet(prompt_fts, -1, {snippet}) AS snippet, bm25(prompt_fts, 5.0, 1.0, 1.0) AS rank
+            FROM prompt_fts
+            JOIN prompt p ON p.id = prompt_fts.rowid
+            WHERE prompt_fts MATCH :match AND p.user_id = :user_id""",
+    }
+    sql = ' UNION ALL '.join(selects[kind] for kind in kinds) + " ORDER BY rank LIMIT :limit OFFSET :offset"
+    return sql, {
+        'match': _match(words),
+        'owner_match': _owner_match(user_id, words),
+        'user_id': user_id,
+        'limit': limit,
+        'offset': offset,
+    }
+
+def _search_generic(user_id, words, kinds, limit, offset, dialect):
+    def document(*columns):
+        parts = [func.coalesce(column, '') for column in columns]
+        result = parts[0]
+        for part in parts[1:]:
+            result = result + ' ' + part
+        return result
+
+    def match_and_rank(*docs):
+        # A row matches if any of ``docs`` does; a message has either inline
+        # or blob text, and each is matched against its own index
+        if dialect == 'postgresql':
+            tsquery = func.to_tsquery(TS_CONFIG, ' & '.join(words[:-1] + [words[-1] + ':*']))
+            vectors = [func.to_tsvector(TS_CONFIG, doc) for doc in docs]
+            rank = func.ts_rank(vectors[0], tsquery)
+            for vector in vectors[1:]:
+                rank = rank + func.ts_rank(vector, tsquery)
+            return or_(*[vector.op('@@')(tsquery) for vector in vectors]), -rank
+        return or_(*[
+            and_(*[func.lower(doc).contains(word, autoescape=True) for word in words]) for doc in docs
+        ]), literal(0)
+
+    def row(kind, id_, conversation_id, title, snippet, rank):
+        return select(
+            literal(kind).label('type'), id_.label('id'), conversation_id.label('conversation_id'),
+            title.label('title'), snippet.label('snippet'), rank.label('rank'),
+        )
+
+    selects = {}
+    if 'message' in kinds:
+        blob = aliased(ContentBlob)
+        condition, rank = match_and_rank(document(Message.content), document(blob.search_text))
+        selects['message'] = row(
+            'message', Message.id, Message.conversation_id, Conversation.title,
+            func.substr(func.coalesce(blob.search_text, Message.content), 1, FALLBACK_SNIPPET_CHARS), rank,
+        ).join(Conversation, Conversation.id == Message.conversation_id).outerjoin(
+            blob, blob.hash == Message.content_hash).where(condition, Conversation.user_id == user_id)
+    if 'conversation' in kinds:
+        condition, rank = match_and_rank(document(Conversation.title))
+        selects['conversation'] = row(
+            'conversation', Conversation.id, Conversation.id, Conversation.title, Conversation.title, rank,
+        ).where(condition, Conversation.user_id == user_id)
+    if 'prompt' in kinds:
+        system_blob, user_blob = aliased(ContentBlob), aliased(ContentBlob)
+        system_prompt = func.coalesce(system_blob.search_text, Prompt.system_prompt)
+        user_prompt = func.coalesce(user_blob.search_text, Prompt.user_prompt)
+        condition, rank = match_and_rank(document(Prompt.name, system_prompt, user_prompt))
+        selects['prompt'] = row(
+            'prompt', Prompt.id, null(), Prompt.name,
+            func.substr(user_prompt, 1, FALLBACK_SNIPPET_CHARS), rank,
+        ).outerjoin(system_blob, system_blob.hash == Prompt.system_prompt_hash).outerjoin(
+            user_blob, user_blob.hash == Prompt.user_prompt_hash).where(condition, Prompt.user_id == user_id)
+
+    selected = [selects[kind] for kind in kinds]
+    query = (union_all(*selected) if len(selected) > 1 else selected[0]).subquery()
+    return db.session.execute(
+        select(query).order_by(query.c.rank, query.c.id.desc()).limit(limit).offset(offset)
+    ).all()
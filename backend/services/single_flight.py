@@ -0,0 +1,241 @@
+"""Coalescing of identical in-flight generate calls.
+
+The first request for a key (the leader) starts the upstream call; identical
+requests arriving while it runs attach to it instead of calling upstream
+themselves. For streamed calls every chunk is recorded as it arrives, so a
+follower that joins late replays the chunks it missed and then receives the
+rest live. Once the call finishes the key is forgotten; later requests start
+a new call (or hit the response cache).
+
+Streams, and async calls, run on a task the flight owns rather than in the
+leader's request, so a leader whose client goes away does not take the call
+down with it: the call is only cancelled once the last waiting request has
+left. Threaded non-streamed calls run on the leader's thread, which cannot be
+interrupted.
+
+``flights`` serves the threaded Flask routes and ``async_flights`` the
+native ASGI handlers. Coalescing is opt-in per request, since followers of a
+sampled (temperature > 0) call all receive the same completion.
+"""
+import asyncio
+import threading
+
+from backend.metrics import register_collector
+
+class AbandonedError(Exception):
+    """The leading request went away before its upstream call finished."""
+
+class _Flight:
+    __slots__ = ('chunks', 'done', 'result', 'error', 'cond', 'waiters', 'task', 'abandoned')
+
+    def __init__(self, cond):
+        self.chunks = []
+        self.done = False
+        self.result = None
+        self.error = None
+        self.cond = cond
+        self.waiters = 0
+        self.task = None
+        self.abandoned = False
+
+def _failure(exc):
+    # Cancellation and generator exits belong to the leader's request only
+    return exc if isinstance(exc, Exception) else AbandonedError("Upstream call was abandoned by the leading request")
+
+class SingleFlight:
+    """Single-flight groups for code running on worker threads."""
+
+    def __init__(self):
+        self.enabled = True
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.enabled = app.config.get('SINGLE_FLIGHT_ENABLED', True)
+
+    def __len__(self):
+        return len(self._flights)
+
+    def _join(self, key):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight(threading.Condition())
+            flight.waiters += 1
+            return flight, leader
+
+    def _leave(self, key, flight):
+        """Drop a waiter, stopping the upstream call if it was the last one."""
+        with self._lock:
+            flight.waiters -= 1
+            if flight.waiters or flight.done:
+                return
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        with flight.cond:
+            flight.abandoned = True
+
+    def _finish(self, key, flight, result=None, error=None):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        with flight.cond:
+            flight.result, flight.error, flight.done = result, error, True
+            flight.cond.notify_all()
+
+    def do(self, key, call):
+        """Return ``(result, coalesced)``, running ``call()`` only if no identical call is in flight."""
+        flight, leader = self._join(('generate', key))
+        if not leader:
+            with flight.cond:
+                flight.cond.wait_for(lambda: flight.done)
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+        try:
+            result = call()
+        except BaseException as e:
+            self._finish(('generate', key), flight, error=_failure(e))
+            raise
+        self._finish(('generate', key), flight, result=result)
+        return result, False
+
+    def stream(self, key, call):
+        """Return ``(chunks, coalesced)``; ``call()`` returns the upstream chunk iterator.
+
+        The upstream stream is read on the flight's own thread, and every
+        request, the leader included, receives each chunk as it arrives.
+        """
+        flight, leader = self._join(('stream', key))
+        if leader:
+            self._start(('stream', key), flight, call)
+        return self._follow(('stream', key), flight), not leader
+
+    def _start(self, key, flight, call):
+        flight.task = threading.Thread(target=self._pump, args=(key, flight, call), name='single-flight', daemon=True)
+        flight.task.start()
+
+    def _pump(self, key, flight, call):
+        error = None
+        try:
+            chunks = iter(call())
+            try:
+                for chunk in chunks:
+                    with flight.cond:
+                        if flight.abandoned:
+                            return
+                        flight.chunks.append(chunk)
+                        flight.cond.notify_all()
+            finally:
+                close = getattr(chunks, 'close', None)
+                if close is not None:
+                    close()
+        except Exception as e:
+            error = e
+        self._finish(key, flight, error=error)
+
+    def _follow(self, key, flight):
+        sent = 0
+        try:
+            while True:
+                with flight.cond:
+                    flight.cond.wait_for(lambda: flight.done or len(flight.chunks) > sent)
+                    chunks, done = flight.chunks[sent:], flight.done
+                sent += len(chunks)
+                yield from chunks
+                if done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+        finally:
+            self._leave(key, flight)
+
+class AsyncSingleFlight(SingleFlight):
+    """Single-flight groups for coroutines on one event loop."""
+
+    def _join(self, key):
+        flight = self._flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = self._flights[key] = _Flight(asyncio.Condition())
+        flight.waiters += 1
+        return flight, leader
+
+    def _leave(self, key, flight):
+        flight.waiters -= 1
+        if flight.waiters or (flight.task is not None and flight.task.done()):
+            return
+        self._forget(key, flight)
+        if flight.task is not None:
+            flight.task.cancel()
+
+    def _forget(self, key, flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    async def _finish(self, key, flight, result=None, error=None):
+        self._forget(key, flight)
+        flight.result, flight.error, flight.done = result, error, True
+        async with flight.cond:
+            flight.cond.notify_all()
+
+    async def do(self, key, call):
+        """Async ``do``; ``call()`` returns an awaitable."""
+        key = ('generate', key)
+        flight, leader = self._join(key)
+        try:
+            if leader:
+                flight.task = asyncio.ensure_future(call())
+                flight.task.add_done_callback(lambda task: self._forget(key, flight))
+            # Shielded: a waiter being cancelled leaves the call running for
+            # the others
+            return await asyncio.shield(flight.task), not leader
+        finally:
+            self._leave(key, flight)
+
+    def _start(self, key, flight, call):
+        flight.task = asyncio.ensure_future(self._pump(key, flight, call))
+
+    async def _pump(self, key, flight, call):
+        error = None
+        try:
+            chunks = call()
+            try:
+                async for chunk in chunks:
+                    flight.chunks.append(chunk)
+                    async with flight.cond:
+                        flight.cond.notify_all()
+            finally:
+                await chunks.aclose()
+        except Exception as e:
+            error = e
+        await self._finish(key, flight, error=error)
+
+    async def _follow(self, key, flight):
+        sent = 0
+        try:
+            while True:
+                async with flight.cond:
+                    await flight.cond.wait_for(lambda: flight.done or len(flight.chunks) > sent)
+                chunks, done = flight.chunks[sent:], flight.done
+                sent += len(chunks)
+                for chunk in chunks:
+                    yield chunk
+                if done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+        finally:
+            self._leave(key, flight)
+
+flights = SingleFlight()
+async_flights = AsyncSingleFlight()
+
+def _prometheus_samples():
+    return [
+        ('llm_single_flight_inflight', 'gauge', 'Coalescable upstream calls currently in flight.',
+         len(flights) + len(async_flights)),
+    ]
+
+register_collector(_prometheus_samples)
@@ -0,0 +1,30 @@
+import asyncio
+import os
+import time
+
+# Local stand-in for a real provider. It never leaves the process, so it can
+# be used to exercise the routes and the async layer under simulated latency.
+LATENCY = float(os.environ.get('STUB_LATENCY_MS', 200)) / 1000
+TOKENS_PER_SECOND = float(os.environ.get('STUB_TOKENS_PER_SECOND', 50))
+
+def _tokens(model, user_prompt, settings):
+    words = f"[{model}] echo: {user_prompt}".split()
+    return [f"{w} " for w in words[:int(settings['maxTokens'])]]
+
+def generate(model, system_prompt, user_prompt, conversation, settings):
+    return "".join(stream(model, system_prompt, user_prompt, conversation, settings))
+
+def stream(model, system_prompt, user_prompt, conversation, settings):
+    time.sleep(LATENCY)
+    for token in _tokens(model, user_prompt, settings):
+        time.sleep(1 / TOKENS_PER_SECOND)
+        yield token
+
+async def agenerate(model, system_prompt, user_prompt, conversation, settings):
+    return "".join([t async for t in astream(model, system_prompt, user_prompt, conversation, settings)])
+
+async def astream(model, system_prompt, user_prompt, conversation, settings):
+    await asyncio.sleep(LATENCY)
+    for token in _tokens(model, user_prompt, settings):
+        await asyncio.sleep(1 / TOKENS_PER_SECOND)
+        yield token
@@ -0,0 +1,228 @@
+import json
+import logging
+import os
+import queue
+import re
+import socket
+import sqlite3
+import threading
+import time
+
+from backend.models import db, Conversation
+from backend.services import providers
+from backend.services.scheduler import scheduler
+from backend.services import list_versions
+
+logger = logging.getLogger(__name__)
+
+TITLE_MAX_LENGTH = 100
+
+# Only the start of a conversation is needed to name it, and keeping jobs
+# small keeps the durable queue small.
+_TITLE_MESSAGES = 6
+_TITLE_MESSAGE_CHARS = 500
+
+def generate_conversation_title(messages):
+    system_prompt = "You are a helpful assistant that generates short, concise titles for conversations. Please provide a title of 5 words or less based on the following conversation:"
+    conversation_text = "\n".join([f"{m['role']}: {m['content']}" for m in messages])
+    user_prompt = f"Generate a title for this conversation:\n{conversation_text}"
+
+    settings = {"temperature": 0.7, "maxTokens": 20, "topP": 1, "frequencyPenalty": 0, "presencePenalty": 0}
+    # Titles queue behind interactive requests when a provider is throttling us
+    title, _ = scheduler.generate(
+        providers.load('openai').generate, ("gpt-3.5-turbo", system_prompt, user_prompt, [], settings),
+        client='title-service', priority='low'
+    )
+
+    return title.strip().strip('"')[:TITLE_MAX_LENGTH]
+
+def heuristic_title(messages, max_words=6):
+    """Cheap local title: the first few words of the first user message."""
+    text = next((m.get('content', '') for m in messages if m.get('role') == 'user'), '')
+    if not text and messages:
+        text = messages[0].get('content', '')
+    words = re.sub(r'\s+', ' ', text).strip().split(' ')[:max_words]
+    title = ' '.join(words).strip(' .,:;!?-')
+    if not title:
+        return 'New conversation'
+    if len(words) == max_words:
+        title += '...'
+    return title[:TITLE_MAX_LENGTH]
+
+class MemoryJobStore:
+    """Bounded in-process job queue. Jobs are lost if the process exits."""
+
+    def __init__(self, maxsize):
+        self._queue = queue.Queue(maxsize=maxsize)
+
+    def put(self, payload):
+        try:
+            self._queue.put_nowait(payload)
+            return True
+        except queue.Full:
+            return False
+
+    def get(self, timeout):
+        try:
+            return None, self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def done(self, job_id):
+        pass
+
+class SQLiteJobStore:
+    """Bounded job queue persisted to a SQLite file, which processes can share.
+
+    A claimed job is leased to its worker for ``lease`` seconds. Jobs
+    survive restarts: once the lease of a job claimed by a process that died
+    runs out, it is handed out again.
+    """
+
+    def __init__(self, path, maxsize, lease=600):
+        self.path = path
+        self.maxsize = maxsize
+        self.lease = lease
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, payload TEXT NOT NULL, '
+            'created_at REAL NOT NULL, claimed_by TEXT, claimed_at REAL)'
+        )
+        # Files written before jobs were leased
+        columns = {row[1] for row in self._conn.execute('PRAGMA table_info(jobs)')}
+        for column in ('claimed_by TEXT', 'claimed_at REAL'):
+            if column.split()[0] not in columns:
+                self._conn.execute(f'ALTER TABLE jobs ADD COLUMN {column}')
+
+    def put(self, payload):
+        with self._lock:
+            pending = self._conn.execute('SELECT COUNT(*) FROM jobs').fetchone()[0]
+            if pending >= self.maxsize:
+                return False
+            self._conn.execute(
+                'INSERT INTO jobs (payload, created_at) VALUES (?, ?)',
+                (json.dumps(payload), time.time())
+            )
+            self._available.notify()
+            return True
+
+    def get(self, timeout):
+        # Jobs put by other processes are not signalled here; they are
+        # picked up when the wait times out
+        with self._lock:
+            row = self._claim()
+            if row is None and self._available.wait(timeout):
+                row = self._claim()
+            if row is None:
+                return None
+            return row[0], json.loads(row[1])
+
+    def _claim(self):
+        # One statement, so two processes cannot claim the same job
+        now = time.time()
+        return self._conn.execute(
+            'UPDATE jobs SET claimed_by = ?, claimed_at = ? WHERE id = ('
+            'SELECT id FROM jobs WHERE claimed_at IS NULL OR claimed_at < ? ORDER BY id LIMIT 1'
+            ') RETURNING id, payload',
+            (self.owner, now, now - self.lease)
+        ).fetchone()
+
+    def done(self, job_id):
+        with self._lock:
+            self._conn.execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+
+class TitleWorkerPool:
+    """Background workers that replace placeholder titles with generated ones."""
+
+    def __init__(self):
+        self.app = None
+        self.store = None
+        # Cleared by the server when the app is loaded before forking, so no
+        # threads are running in the master; workers call start() themselves
+        self.autostart = True
+        self._workers = []
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def init_app(self, app):
+        self.app = app
+        # Jobs left in a durable queue resume without waiting for a new one
+        if self.autostart and app.config.get('TITLE_QUEUE_PATH'):
+            self.start()
+
+    def start(self):
+        """Start the store and workers in this process, if not running yet."""
+        # Threads and SQLite connections do not survive a fork, so they are
+        # created again in each process
+        with self._lock:
+            if self.app is None or self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            path = self.app.config.get('TITLE_QUEUE_PATH')
+            size = self.app.config.get('TITLE_QUEUE_SIZE', 100)
+            self.store = (SQLiteJobStore(path, size, self.app.config.get('TITLE_JOB_LEASE', 600))
+                          if path else MemoryJobStore(size))
+            self._workers = [
+                threading.Thread(target=self._run, name=f'title-worker-{i}', daemon=True)
+                for i in range(self.app.config.get('TITLE_WORKERS', 2))
+            ]
+            for worker in self._workers:
+                worker.start()
+
+    def enqueue(self, conversation_id, messages):
+        """Queue a title job; returns False if the queue is backed up or the pool is shutting down."""
+        if self.app is None or self._stopping.is_set():
+            return False
+        self.start()
+        payload = {
+            'conversation_id': conversation_id,
+            'messages': [
+                {'role': m['role'], 'content': m['content'][:_TITLE_MESSAGE_CHARS]}
+                for m in messages[:_TITLE_MESSAGES]
+            ],
+        }
+        return self.store.put(payload)
+
+    def shutdown(self, timeout):
+        """Let the workers finish queued jobs, waiting at most ``timeout`` seconds."""
+        self._stopping.set()
+        deadline = time.monotonic() + timeout
+        for worker in self._workers:
+            worker.join(max(0, deadline - time.monotonic()))
+
+    def _run(self):
+        while True:
+            stopping = self._stopping.is_set()
+            job = self.store.get(timeout=0.1 if stopping else 5)
+            if job is None:
+                if stopping:
+                    return
+                continue
+            job_id, payload = job
+            try:
+                self._process(payload)
+            except Exception as e:
+                logger.error("Title generation failed for conversation %s: %s", payload['conversation_id'], e)
+            finally:
+                self.store.done(job_id)
+
+    def _process(self, payload):
+        title = generate_conversation_title(payload['messages'])
+        if not title:
+            return
+        with self.app.app_context():
+            conversation = db.session.get(Conversation, payload['conversation_id'])
+            if conversation is None:
+                return
+            conversation.title = title
+            list_versions.bump(conversation.user_id, 'conversations')
+            db.session.commit()
+            logger.info("Generated title '%s' for conversation %s", title, conversation.id)
+
+title_workers = TitleWorkerPool()
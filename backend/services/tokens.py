@@ -0,0 +1,9 @@
+def estimate_tokens(text):
+    """Fast token estimate: about four characters per token for English text.
+
+    Good enough for budgeting and metrics without loading a tokenizer.
+    """
+    return chars_to_tokens(len(text)) if text else 0
+
+def chars_to_tokens(chars):
+    return (chars + 3) // 4
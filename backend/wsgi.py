@@ -0,0 +1,6 @@
+"""WSGI entry point, used by the threaded worker class of ``backend.serve``."""
+import os
+
+from backend.app import create_app
+
+app = create_app(os.environ.get('FLASK_CONFIG', 'default'))
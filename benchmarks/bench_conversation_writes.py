@@ -0,0 +1,90 @@
+"""Save and fork latency for conversations of different lengths.
+
+Compares the write path used by the routes with the previous
+one-ORM-object-per-message approach. Runs against a throwaway SQLite file:
+
+    python -m benchmarks.bench_conversation_writes [--sizes 10,1000,10000]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+_db_dir = tempfile.mkdtemp()
+os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(_db_dir, 'bench.db')}")
+
+from flask_jwt_extended import create_access_token
+
+from backend.app import create_app
+from backend.models import db, User, Conversation, Message
+
+def _messages(n):
+    return [
+        {'role': 'user' if i % 2 == 0 else 'assistant', 'content': f"message {i} " * 20, 'model': 'gpt-4'}
+        for i in range(n)
+    ]
+
+def _orm_save(user_id, messages):
+    conversation = Conversation(user_id=user_id, title='orm')
+    db.session.add(conversation)
+    db.session.flush()
+    for message in messages:
+        db.session.add(Message(role=message['role'], content=message['content'],
+                               model=message.get('model'), conversation_id=conversation.id))
+    db.session.commit()
+    return conversation.id
+
+def _orm_fork(user_id, conversation_id, fork_index):
+    messages = Message.query.filter_by(conversation_id=conversation_id).order_by(Message.id).limit(fork_index + 1).all()
+    conversation = Conversation(user_id=user_id, title='orm fork')
+    db.session.add(conversation)
+    db.session.flush()
+    for message in messages:
+        db.session.add(Message(role=message.role, content=message.content,
+                               model=message.model, conversation_id=conversation.id))
+    db.session.commit()
+
+def _timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return (time.perf_counter() - start) * 1000, result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='10,1000,10000')
+    args = parser.parse_args()
+
+    app = create_app()
+    # Titles are generated in the background; keep that out of the timings
+    app.config['TITLE_WORKERS'] = 0
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        user = User(username='bench')
+        user.set_password('bench')
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+        token = create_access_token(identity=str(user_id))
+
+    client = app.test_client()
+    headers = {'Authorization': f'Bearer {token}'}
+
+    print(f"{'messages':>9} {'orm save':>10} {'route save':>10} {'orm fork':>10} {'route fork':>10}  (ms)")
+    for n in (int(size) for size in args.sizes.split(',')):
+        messages = _messages(n)
+        with app.app_context():
+            orm_save, orm_id = _timed(_orm_save, user_id, messages)
+            orm_fork, _ = _timed(_orm_fork, user_id, orm_id, n - 1)
+
+        bulk_save, response = _timed(
+            client.post, '/api/conversations', json={'title': 'bench', 'messages': messages}, headers=headers
+        )
+        bulk_id = response.get_json()['id']
+        bulk_fork, _ = _timed(
+            client.post, f'/api/conversations/{bulk_id}/fork', json={'forkIndex': n - 1}, headers=headers
+        )
+        print(f"{n:>9} {orm_save:>10.1f} {bulk_save:>10.1f} {orm_fork:>10.1f} {bulk_fork:>10.1f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""Per-request logging overhead: synchronous handlers vs the queue pipeline.
+
+Drives /api/generate against the zero-latency stub provider with DEBUG
+logging on, once with the file and console handlers attached directly to
+the root logger (the previous setup) and once through
+``configure_logging``. Also times eagerly formatting a long conversation
+in a filtered-out DEBUG call against the lazy form.
+
+    python -m benchmarks.bench_logging [--requests 2000]
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+import timeit
+
+os.environ.setdefault('STUB_LATENCY_MS', '0')
+os.environ.setdefault('STUB_TOKENS_PER_SECOND', '1000000')
+
+from backend.app import create_app
+from backend.logging_config import configure_logging, shutdown_logging
+
+def _sync_logging(config):
+    """The handlers app.py and Config.init_app used to attach."""
+    shutdown_logging()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    formatter = logging.Formatter(config['LOG_FORMAT'])
+    for handler in (logging.FileHandler(config['LOG_FILE']), logging.StreamHandler(sys.stderr)):
+        handler.setFormatter(formatter)
+        root.addHandler(handler)
+    root.setLevel(logging.DEBUG)
+
+def _per_request_us(client, requests, body):
+    start = time.perf_counter()
+    for _ in range(requests):
+        client.post('/api/generate', json=body)
+    return (time.perf_counter() - start) / requests * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+
+    app = create_app()
+    app.config['LOG_FILE'] = os.path.join(tempfile.mkdtemp(), 'bench.log')
+    app.config['LOG_LEVEL'] = logging.DEBUG
+    client = app.test_client()
+    conversation = [{'role': 'user', 'content': 'x' * 400}] * 200
+    body = {'model': 'stub-bench', 'userPrompt': 'hi', 'conversation': conversation, 'cache': False}
+
+    # Console output would dominate both runs; measure the handlers themselves
+    sys.stderr = open(os.devnull, 'w')
+    try:
+        _sync_logging(app.config)
+        client.post('/api/generate', json=body)
+        sync_us = _per_request_us(client, args.requests, body)
+
+        configure_logging(app.config)
+        client.post('/api/generate', json=body)
+        queued_us = _per_request_us(client, args.requests, body)
+        shutdown_logging()
+    finally:
+        sys.stderr = sys.__stderr__
+
+    logger = logging.getLogger('bench')
+    logger.setLevel(logging.INFO)
+    eager_us = timeit.timeit(lambda: logger.debug(f"Processed conversation: {conversation}"), number=1000) * 1000
+    lazy_us = timeit.timeit(lambda: logger.debug("Processed conversation: %s", conversation), number=1000) * 1000
+
+    print(f"{'scenario':<40} {'us/op':>10}")
+    print(f"{'request, synchronous handlers':<40} {sync_us:>10.1f}")
+    print(f"{'request, queue pipeline':<40} {queued_us:>10.1f}")
+    print(f"{'filtered DEBUG, f-string':<40} {eager_us:>10.1f}")
+    print(f"{'filtered DEBUG, lazy %-format':<40} {lazy_us:>10.1f}")
+
+if __name__ == '__main__':
+    main()
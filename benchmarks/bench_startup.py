@@ -0,0 +1,67 @@
+"""Worker startup cost: importing the app, building it and the first calls.
+
+Each run is a fresh interpreter, so imports are cold as in a new worker.
+Providers load on first use (see backend/services/providers.py); the
+"preload all" row sets PRELOAD_PROVIDERS to every SDK-backed provider, which
+is what every worker paid before.
+
+    python -m benchmarks.bench_startup [--runs 5]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+_CHILD = r"""
+import json, sys, time
+start = time.perf_counter()
+import backend.app
+imported = time.perf_counter()
+app = backend.app.create_app()
+created = time.perf_counter()
+from backend.services import providers
+startup_sdks = sorted(name for name in ('openai', 'anthropic', 'llama_cpp') if name in sys.modules)
+startup_modules = len(sys.modules)
+providers.load('openai')._client()
+first_openai = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - start) * 1000,
+    'create_app_ms': (created - imported) * 1000,
+    'first_openai_ms': (first_openai - created) * 1000,
+    'modules': startup_modules,
+    'sdks': startup_sdks,
+}))
+"""
+
+def _run(env):
+    output = subprocess.run(
+        [sys.executable, '-c', _CHILD], env=env, check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    base = dict(os.environ, TITLE_WORKERS='0', LOG_LEVEL='WARNING',
+                OPENAI_API_KEY=os.environ.get('OPENAI_API_KEY', 'bench'),
+                ANTHROPIC_API_KEY=os.environ.get('ANTHROPIC_API_KEY', 'bench'))
+    scenarios = {
+        'lazy (default)': dict(base, PRELOAD_PROVIDERS=''),
+        'preload all': dict(base, PRELOAD_PROVIDERS='openai,anthropic'),
+    }
+    print(f"{'scenario':<16} {'import ms':>10} {'create ms':>10} {'startup ms':>11} {'1st openai ms':>14} {'modules':>8}  SDKs at startup")
+    for name, env in scenarios.items():
+        _run(env)  # warm the OS page cache and bytecode
+        runs = [_run(env) for _ in range(args.runs)]
+        median = {key: statistics.median(run[key] for run in runs)
+                  for key in ('import_ms', 'create_app_ms', 'first_openai_ms', 'modules')}
+        print(f"{name:<16} {median['import_ms']:>10.0f} {median['create_app_ms']:>10.0f} "
+              f"{median['import_ms'] + median['create_app_ms']:>11.0f} {median['first_openai_ms']:>14.0f} "
+              f"{median['modules']:>8.0f}  {', '.join(runs[-1]['sdks']) or 'none'}")
+
+if __name__ == '__main__':
+    main()
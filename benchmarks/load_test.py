@@ -0,0 +1,260 @@
+"""Throughput and latency of the main API endpoints under concurrent load.
+
+Starts the mock LLM server and the backend (``uvicorn backend.asgi:app``) on
+a throwaway SQLite database, runs each scenario at a fixed concurrency and
+reports requests/sec and p50/p95/p99 latency:
+
+    python -m benchmarks.load_test [--requests 200] [--concurrency 20]
+    python -m benchmarks.load_test --save-baseline benchmarks/baseline.json
+    python -m benchmarks.load_test --baseline benchmarks/baseline.json
+
+With ``--baseline`` the run exits non-zero if any scenario's p95 latency or
+throughput is worse than the baseline by more than ``--tolerance``. Baselines
+are only comparable between runs on the same machine with the same flags.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = ('generate_openai', 'generate_anthropic', 'generate_stream', 'save', 'list', 'fork', 'delete')
+CONVERSATION_MESSAGES = 20
+FORK_INDEX = 10
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def _wait_until_up(url, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{' '.join(process.args)} exited with {process.returncode}")
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.TransportError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Timed out waiting for {url}")
+
+def _start_servers(args, workdir):
+    """Start the mock LLM server and the backend; return (backend url, processes)."""
+    mock_port, backend_port = _free_port(), _free_port()
+    mock = subprocess.Popen([
+        sys.executable, '-m', 'benchmarks.mock_llm_server', '--port', str(mock_port),
+        '--latency-ms', str(args.latency_ms), '--tokens-per-second', str(args.tokens_per_second),
+        '--completion-tokens', str(args.completion_tokens),
+    ], cwd=REPO_ROOT)
+    _wait_until_up(f'http://127.0.0.1:{mock_port}/health', mock)
+
+    env = dict(
+        os.environ,
+        PYTHONPATH=REPO_ROOT,
+        DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'load_test.db')}",
+        OPENAI_API_KEY='mock', OPENAI_BASE_URL=f'http://127.0.0.1:{mock_port}/v1',
+        ANTHROPIC_API_KEY='mock', ANTHROPIC_BASE_URL=f'http://127.0.0.1:{mock_port}',
+        # Measure the upstream path on every request, not the response cache
+        RESPONSE_CACHE_ENABLED='false',
+        # Do not wait out queued title jobs on shutdown
+        SERVER_GRACEFUL_TIMEOUT='5',
+        LOG_LEVEL='WARNING',
+    )
+    # Logs land in the working directory, not the repo's logs/
+    subprocess.run([sys.executable, '-m', 'flask', '--app', 'backend.app', 'upgrade-db'],
+                   cwd=workdir, env=env, check=True, stdout=subprocess.DEVNULL)
+    backend = subprocess.Popen([
+        sys.executable, '-m', 'uvicorn', 'backend.asgi:app', '--port', str(backend_port),
+        '--workers', str(args.workers), '--log-level', 'warning',
+    ], cwd=workdir, env=env)
+    url = f'http://127.0.0.1:{backend_port}'
+    _wait_until_up(url + '/', backend)
+    return url, [backend, mock]
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(0, math.ceil(fraction * len(sorted_values)) - 1)]
+
+async def _run(client, count, concurrency, make_request):
+    """Issue ``count`` requests, ``concurrency`` at a time; return the stats."""
+    latencies, errors = [], 0
+    next_index = iter(range(count))
+
+    async def worker():
+        nonlocal errors
+        for index in next_index:
+            start = time.perf_counter()
+            try:
+                response = await make_request(client, index)
+                ok = response.is_success
+            except httpx.HTTPError:
+                ok = False
+            latencies.append(time.perf_counter() - start)
+            errors += not ok
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        'requests': count,
+        'errors': errors,
+        'rps': round(count / elapsed, 2),
+        'p50_ms': round(_percentile(latencies, 0.50) * 1000, 2),
+        'p95_ms': round(_percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(_percentile(latencies, 0.99) * 1000, 2),
+    }
+
+def _generate_body(model):
+    # A non-zero temperature keeps the response cache out of the way
+    return {
+        'model': model,
+        'systemPrompt': 'You are a helpful assistant.',
+        'userPrompt': 'Summarise the plot of Hamlet.',
+        'conversation': [],
+        'settings': {'temperature': 0.7, 'maxTokens': 256, 'topP': 1},
+    }
+
+async def _scenarios(url, args):
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=120) as client:
+        await client.post('/auth/register', json={'username': 'loadtest', 'password': 'loadtest'})
+        response = await client.post('/auth/login', json={'username': 'loadtest', 'password': 'loadtest'})
+        response.raise_for_status()
+        client.headers['Authorization'] = f"Bearer {response.json()['token']}"
+
+        saved, forks = [], []
+        messages = [
+            {'role': 'user' if i % 2 == 0 else 'assistant', 'content': f"Message {i}. " * 40}
+            for i in range(CONVERSATION_MESSAGES)
+        ]
+
+        async def save(client, index):
+            response = await client.post('/api/conversations', json={'messages': messages})
+            if response.is_success:
+                saved.append(response.json()['id'])
+            return response
+
+        async def fork(client, index):
+            response = await client.post(f'/api/conversations/{saved[index % len(saved)]}/fork',
+                                         json={'forkIndex': FORK_INDEX})
+            if response.is_success:
+                forks.append(response.json()['id'])
+            return response
+
+        async def stream(client, index):
+            async with client.stream('POST', '/api/generate/stream', json=_generate_body(args.openai_model)) as response:
+                async for _ in response.aiter_bytes():
+                    pass
+            return response
+
+        requests = {
+            'generate_openai': lambda client, index: client.post('/api/generate', json=_generate_body(args.openai_model)),
+            'generate_anthropic': lambda client, index: client.post('/api/generate', json=_generate_body(args.anthropic_model)),
+            'generate_stream': stream,
+            'save': save,
+            'list': lambda client, index: client.get('/api/conversations'),
+            'fork': fork,
+            # Deleting a parent hands its shared messages over to a fork
+            'delete': lambda client, index: client.delete(f'/api/conversations/{saved[index % len(saved)]}'),
+        }
+
+        results = {}
+        for name in args.scenarios:
+            count = min(args.requests, len(saved)) if name == 'delete' else args.requests
+            if name in ('fork', 'delete') and not saved:
+                print(f"Skipping {name}: needs the save scenario first", file=sys.stderr)
+                continue
+            results[name] = await _run(client, count, args.concurrency, requests[name])
+        return results
+
+def _print_table(results, baseline=None):
+    header = f"{'scenario':<20}{'requests':>9}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+    print(header)
+    print('-' * len(header))
+    for name, stats in results.items():
+        line = (f"{name:<20}{stats['requests']:>9}{stats['errors']:>8}{stats['rps']:>10}"
+                f"{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}")
+        if baseline and name in baseline:
+            line += f"   (baseline p95 {baseline[name]['p95_ms']} ms, {baseline[name]['rps']} req/s)"
+        print(line)
+
+def _regressions(results, baseline, tolerance):
+    problems = []
+    for name, stats in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if stats['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+            problems.append(f"{name}: p95 {stats['p95_ms']} ms vs baseline {base['p95_ms']} ms")
+        if stats['rps'] < base['rps'] * (1 - tolerance):
+            problems.append(f"{name}: {stats['rps']} req/s vs baseline {base['rps']} req/s")
+        if stats['errors'] > base['errors']:
+            problems.append(f"{name}: {stats['errors']} errors vs baseline {base['errors']}")
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=200, help='requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--workers', type=int, default=1, help='backend worker processes')
+    parser.add_argument('--latency-ms', type=float, default=200, help='mock time to first token')
+    parser.add_argument('--tokens-per-second', type=float, default=100)
+    parser.add_argument('--completion-tokens', type=int, default=50)
+    parser.add_argument('--openai-model', default='gpt-4o-mini')
+    parser.add_argument('--anthropic-model', default='claude-3-haiku-20240307')
+    parser.add_argument('--baseline', help='compare against this baseline file')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed fractional regression')
+    parser.add_argument('--save-baseline', help='write the results to this file')
+    args = parser.parse_args()
+    args.scenarios = [name for name in args.scenarios.split(',') if name]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        url, processes = _start_servers(args, workdir)
+        try:
+            results = asyncio.run(_scenarios(url, args))
+        finally:
+            # Backend first, so its shutdown drain can still reach the mock
+            for process in processes:
+                process.terminate()
+                process.wait(timeout=30)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['scenarios']
+    _print_table(results, baseline)
+
+    if args.save_baseline:
+        settings = {key: getattr(args, key) for key in (
+            'requests', 'concurrency', 'workers', 'latency_ms', 'tokens_per_second', 'completion_tokens')}
+        with open(args.save_baseline, 'w') as f:
+            json.dump({'settings': settings, 'scenarios': results}, f, indent=2)
+            f.write('\n')
+        print(f"Baseline written to {args.save_baseline}")
+
+    if baseline is not None:
+        problems = _regressions(results, baseline, args.tolerance)
+        for problem in problems:
+            print(f"REGRESSION {problem}", file=sys.stderr)
+        if problems:
+            raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+"""Local stand-in for the OpenAI and Anthropic APIs.
+
+Serves ``POST /v1/chat/completions`` (OpenAI) and ``POST /v1/messages``
+(Anthropic), streaming or not, with a fixed time to first token and a fixed
+token rate, so backend benchmarks measure the backend rather than the
+network or a provider's load. Point the services at it with:
+
+    OPENAI_BASE_URL=http://127.0.0.1:9100/v1 ANTHROPIC_BASE_URL=http://127.0.0.1:9100
+
+Run with:
+
+    python -m benchmarks.mock_llm_server [--port 9100] [--latency-ms 200]
+        [--tokens-per-second 100] [--completion-tokens 50] [--error-rate 0]
+
+``--error-rate`` answers that fraction of requests with a 429, to exercise
+the backend's retries and fallbacks.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+
+# Read at request time so the CLI flags (which set these) apply
+def _settings():
+    return (
+        float(os.environ.get('MOCK_LATENCY_MS', 200)) / 1000,
+        float(os.environ.get('MOCK_TOKENS_PER_SECOND', 100)),
+        int(os.environ.get('MOCK_COMPLETION_TOKENS', 50)),
+        float(os.environ.get('MOCK_ERROR_RATE', 0)),
+    )
+
+def _tokens(count):
+    return [f"token{i} " for i in range(count)]
+
+def _prompt_tokens(messages):
+    return sum(len(str(m.get('content', ''))) for m in messages) // 4
+
+async def _emit(tokens, latency, tokens_per_second):
+    """Yield tokens after ``latency``, then at ``tokens_per_second``."""
+    await asyncio.sleep(latency)
+    interval = 1 / tokens_per_second if tokens_per_second > 0 else 0
+    for index, token in enumerate(tokens):
+        if index and interval:
+            await asyncio.sleep(interval)
+        yield token
+
+async def _openai(body, send):
+    latency, rate, count, _ = _settings()
+    tokens = _tokens(min(count, int(body.get('max_tokens') or count)))
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+    created = int(time.time())
+    model = body.get('model', 'gpt-mock')
+
+    if not body.get('stream'):
+        text = ''.join([token async for token in _emit(tokens, latency, rate)])
+        prompt = _prompt_tokens(body.get('messages', []))
+        return await _send_json(send, {
+            'id': completion_id, 'object': 'chat.completion', 'created': created, 'model': model,
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': text}, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': prompt, 'completion_tokens': len(tokens), 'total_tokens': prompt + len(tokens)},
+        })
+
+    def chunk(delta, finish_reason=None):
+        return {
+            'id': completion_id, 'object': 'chat.completion.chunk', 'created': created, 'model': model,
+            'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}],
+        }
+
+    await _start_sse(send)
+    await _send_event(send, chunk({'role': 'assistant', 'content': ''}))
+    async for token in _emit(tokens, latency, rate):
+        await _send_event(send, chunk({'content': token}))
+    await _send_event(send, chunk({}, 'stop'))
+    await send({'type': 'http.response.body', 'body': b'data: [DONE]\n\n', 'more_body': False})
+
+async def _anthropic(body, send):
+    latency, rate, count, _ = _settings()
+    tokens = _tokens(min(count, int(body.get('max_tokens') or count)))
+    message = {
+        'id': f"msg_{uuid.uuid4().hex[:12]}", 'type': 'message', 'role': 'assistant',
+        'model': body.get('model', 'claude-mock'), 'stop_reason': None, 'stop_sequence': None,
+        'usage': {'input_tokens': _prompt_tokens(body.get('messages', [])), 'output_tokens': 0},
+    }
+
+    if not body.get('stream'):
+        text = ''.join([token async for token in _emit(tokens, latency, rate)])
+        message.update(content=[{'type': 'text', 'text': text}], stop_reason='end_turn')
+        message['usage']['output_tokens'] = len(tokens)
+        return await _send_json(send, message)
+
+    await _start_sse(send)
+    await _send_event(send, {'type': 'message_start', 'message': {**message, 'content': []}}, 'message_start')
+    await _send_event(send, {'type': 'content_block_start', 'index': 0,
+                             'content_block': {'type': 'text', 'text': ''}}, 'content_block_start')
+    async for token in _emit(tokens, latency, rate):
+        await _send_event(send, {'type': 'content_block_delta', 'index': 0,
+                                 'delta': {'type': 'text_delta', 'text': token}}, 'content_block_delta')
+    await _send_event(send, {'type': 'content_block_stop', 'index': 0}, 'content_block_stop')
+    await _send_event(send, {'type': 'message_delta', 'delta': {'stop_reason': 'end_turn', 'stop_sequence': None},
+                             'usage': {'output_tokens': len(tokens)}}, 'message_delta')
+    await _send_event(send, {'type': 'message_stop'}, 'message_stop')
+    await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+async def _read_json(receive):
+    body = b''
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get('body', b'')
+        more_body = message.get('more_body', False)
+    return json.loads(body or b'{}')
+
+async def _send_json(send, payload, status=200, headers=()):
+    body = json.dumps(payload).encode()
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode()), *headers]})
+    await send({'type': 'http.response.body', 'body': body})
+
+async def _start_sse(send):
+    await send({'type': 'http.response.start', 'status': 200,
+                'headers': [(b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache')]})
+
+async def _send_event(send, data, event=None):
+    payload = f"event: {event}\n" if event else ''
+    payload += f"data: {json.dumps(data)}\n\n"
+    await send({'type': 'http.response.body', 'body': payload.encode(), 'more_body': True})
+
+_ROUTES = {
+    '/v1/chat/completions': _openai,
+    '/chat/completions': _openai,
+    '/v1/messages': _anthropic,
+}
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    if scope['type'] != 'http':
+        return
+
+    handler = _ROUTES.get(scope['path'])
+    if scope['method'] == 'GET' and scope['path'] == '/health':
+        return await _send_json(send, {'status': 'ok'})
+    if handler is None or scope['method'] != 'POST':
+        return await _send_json(send, {'error': {'message': 'Not found'}}, 404)
+    body = await _read_json(receive)
+    if random.random() < _settings()[3]:
+        return await _send_json(send, {'type': 'error', 'error': {'type': 'rate_limit_error', 'message': 'Rate limited'}},
+                                429, [(b'retry-after-ms', b'100')])
+    await handler(body, send)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9100)
+    parser.add_argument('--latency-ms', type=float, default=200, help='time to first token')
+    parser.add_argument('--tokens-per-second', type=float, default=100)
+    parser.add_argument('--completion-tokens', type=int, default=50)
+    parser.add_argument('--error-rate', type=float, default=0, help='fraction of requests answered with a 429')
+    args = parser.parse_args()
+
+    os.environ['MOCK_LATENCY_MS'] = str(args.latency_ms)
+    os.environ['MOCK_TOKENS_PER_SECOND'] = str(args.tokens_per_second)
+    os.environ['MOCK_COMPLETION_TOKENS'] = str(args.completion_tokens)
+    os.environ['MOCK_ERROR_RATE'] = str(args.error_rate)
+
+    import uvicorn
+    uvicorn.run(app, host=args.host, port=args.port, log_level='warning')
+
+if __name__ == '__main__':
+    main()
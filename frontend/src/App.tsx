@@ -76,6 +76,9 @@ export default function LLMPayground() {
   const [conversations, setConversations] = useState<{ id: number; messages: Message[] }[]>([])
   const [currentConversationId, setCurrentConversationId] = useState<number | null>(null)
   const [savedConversations, setSavedConversations] = useState<{ id: number; messages: Message[] }[]>([])
+  // Cursor for the next page of saved conversations; null once all are loaded
+  const [conversationsCursor, setConversationsCursor] = useState<number | null>(null)
+  const [isLoadingConversations, setIsLoadingConversations] = useState(false)
   const [openPanels, setOpenPanels] = useState<Set<string>>(new Set())
   const [conversationTitle, setConversationTitle] = useState('')
 
@@ -354,12 +357,39 @@ export default function LLMPayground() {
     }
   };
 
-  const handleLoadConversation = (conversationId: number) => {
+  const fetchConversationMessages = async (conversationId: number) => {
+    // The list endpoint only returns summaries; page through the messages
+    const messages: Message[] = [];
+    let cursor: number | null = null;
+    do {
+      const query = cursor === null ? '' : `?cursor=${cursor}`;
+      const response = await fetch(`${getApiUrl()}/api/conversations/${conversationId}/messages${query}`, {
+        headers: {
+          'Authorization': `Bearer ${localStorage.getItem('token')}`
+        }
+      });
+      if (!response.ok) {
+        throw new Error('Failed to fetch conversation messages');
+      }
+      const data = await response.json();
+      messages.push(...data.messages);
+      cursor = data.nextCursor;
+    } while (cursor !== null);
+    return messages;
+  };
+
+  const handleLoadConversation = async (conversationId: number) => {
     const selectedConversation = savedConversations.find(c => c.id === conversationId);
     if (selectedConversation) {
-      setConversation(selectedConversation.messages);
-      setConversationTitle(selectedConversation.title);
-      setCurrentConversationId(conversationId);
+      try {
+        const messages = selectedConversation.messages || await fetchConversationMessages(conversationId);
+        setConversation(messages);
+        setConversationTitle(selectedConversation.title);
+        setCurrentConversationId(conversationId);
+      } catch (error) {
+        console.error('Error loading conversation:', error);
+        alert('Failed to load conversation. Please try again.');
+      }
     }
   };
 
@@ -443,21 +473,29 @@ export default function LLMPayground() {
     }
   };
 
-  const fetchSavedConversations = async () => {
+  // Loads the newest page of saved conversations, or with a cursor the
+  // page after it, appended to the ones already listed
+  const fetchSavedConversations = async (cursor: number | null = null) => {
+    setIsLoadingConversations(true);
     try {
-      const response = await fetch(`${getApiUrl()}/api/conversations`, {
+      const query = cursor === null ? '' : `?cursor=${cursor}`;
+      const response = await fetch(`${getApiUrl()}/api/conversations${query}`, {
         headers: {
           'Authorization': `Bearer ${localStorage.getItem('token')}`
         }
       });
       if (response.ok) {
         const data = await response.json();
-        setSavedConversations(data.conversations || []);
+        const page = data.conversations || [];
+        setSavedConversations(prev => cursor === null ? page : [...prev, ...page]);
+        setConversationsCursor(data.nextCursor ?? null);
       } else {
         console.error('Failed to fetch conversations');
       }
     } catch (error) {
       console.error('Error fetching conversations:', error);
+    } finally {
+      setIsLoadingConversations(false);
     }
   };
 
@@ -593,6 +631,9 @@ export default function LLMPayground() {
         conversations={savedConversations}
         onLoadConversation={handleLoadConversation}
         onDeleteConversation={handleDeleteConversation}
+        hasMore={conversationsCursor !== null}
+        isLoadingMore={isLoadingConversations}
+        onLoadMore={() => fetchSavedConversations(conversationsCursor)}
         isOpen={openPanels.has('savedConversations')}
         setIsOpen={(isOpen) => togglePanel('savedConversations')}
       />
@@ -6,6 +6,9 @@ interface SavedConversationsProps {
   conversations: { id: number; title: string; messages: { role: string; content: string }[] }[]
   onLoadConversation: (conversationId: number) => void
   onDeleteConversation: (conversationId: number) => void
+  hasMore: boolean
+  isLoadingMore: boolean
+  onLoadMore: () => void
   isOpen: boolean
   setIsOpen: (isOpen: boolean) => void
 }
@@ -14,6 +17,9 @@ const SavedConversations: React.FC<SavedConversationsProps> = ({
   conversations,
   onLoadConversation,
   onDeleteConversation,
+  hasMore,
+  isLoadingMore,
+  onLoadMore,
   isOpen,
   setIsOpen
 }) => {
@@ -52,6 +58,16 @@ const SavedConversations: React.FC<SavedConversationsProps> = ({
               </div>
             ))}
           </div>
+          {hasMore && (
+            <Button
+              variant="ghost"
+              onClick={onLoadMore}
+              disabled={isLoadingMore}
+              className="w-full mt-4 text-gray-300 hover:text-blue-400 hover:bg-gray-700"
+            >
+              {isLoadingMore ? 'Loading...' : 'Load older conversations'}
+            </Button>
+          )}
         </div>
       )}
     </div>
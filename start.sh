@@ -6,16 +6,21 @@ export PATH=$PATH:$(npm bin -g)
 if [ -n "$REPL_ID" ]; then
     echo "Running on Replit"
     BACKEND_PORT=8080
+    BACKEND_CMD="python -m backend.serve"
     FRONTEND_CMD="npm run build && npm run preview"
 else
     echo "Running locally"
     BACKEND_PORT=5000
+    BACKEND_CMD="python -m backend.app"
     FRONTEND_CMD="npm run dev"
 fi
 
+# Create or upgrade the database before any worker starts
+ADMIN_PASSWORD=${ADMIN_PASSWORD:-pw} python -m flask --app backend.app init-db || exit 1
+
 # Start the backend server
 echo "Starting backend server on port $BACKEND_PORT..."
-PORT=$BACKEND_PORT python -m backend.app &
+PORT=$BACKEND_PORT $BACKEND_CMD &
 
 # Capture the PID of the backend process
 BACKEND_PID=$!
@@ -0,0 +1,50 @@
+import os
+import tempfile
+
+# Read by backend.config at import, so set before any backend module loads
+_instance = tempfile.mkdtemp(prefix='llm-playground-tests-')
+os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(_instance, 'test.db')}")
+os.environ.setdefault('OPENAI_API_KEY', 'test')
+os.environ.setdefault('ANTHROPIC_API_KEY', 'test')
+os.environ.setdefault('TITLE_WORKERS', '0')
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+os.environ.setdefault('STUB_LATENCY_MS', '0')
+os.environ.setdefault('STUB_TOKENS_PER_SECOND', '100000')
+
+import pytest
+
+from backend.config import Config
+from backend.services import async_providers
+
+@pytest.fixture
+def limits(monkeypatch):
+    """Set the provider and model concurrency limits for one test."""
+    def apply(provider, model):
+        monkeypatch.setattr(Config, 'PROVIDER_CONCURRENCY', provider)
+        monkeypatch.setattr(Config, 'MODEL_CONCURRENCY', model)
+    # Semaphores are created on first use and bound to that test's loop
+    monkeypatch.setattr(async_providers, '_provider_semaphores', {})
+    monkeypatch.setattr(async_providers, '_model_semaphores', {})
+    return apply
+
+@pytest.fixture(scope='session')
+def app():
+    from backend.app import create_app
+    from backend.migrations import upgrade
+    app = create_app('production')
+    with app.app_context():
+        upgrade()
+    return app
+
+@pytest.fixture
+def login(app, monkeypatch):
+    """Register a user and return their auth headers."""
+    # Password hashing strength is not what these tests are about
+    monkeypatch.setattr(Config, 'PASSWORD_HASH_METHOD', 'pbkdf2:sha256:1000')
+    client = app.test_client()
+
+    def register(username):
+        client.post('/auth/register', json={'username': username, 'password': 'secret'})
+        token = client.post('/auth/login', json={'username': username, 'password': 'secret'}).json['token']
+        return {'Authorization': f'Bearer {token}'}
+    return register
@@ -0,0 +1,92 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from backend import metrics
+from backend.asgi import app
+from backend.services.response_cache import response_cache
+
+def _post(path, body):
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+            return await client.post(path, json=body)
+    return asyncio.run(run())
+
+def _events(response):
+    """``[(event, data), ...]`` from a Server-Sent Events body."""
+    events = []
+    for block in response.text.strip().split('\n\n'):
+        lines = dict(line.split(': ', 1) for line in block.splitlines())
+        events.append((lines.get('event', 'message'), json.loads(lines['data'])))
+    return events
+
+@pytest.fixture(autouse=True)
+def _limits(limits):
+    limits(provider=8, model=8)
+
+def test_generate():
+    response = _post('/api/generate', {'model': 'stub-a', 'userPrompt': 'hello there'})
+    assert response.status_code == 200
+    assert response.json()['response'] == '[stub-a] echo: hello there '
+
+def test_generate_invalid_model():
+    response = _post('/api/generate', {'model': 'no-such-model', 'userPrompt': 'hello'})
+    assert response.status_code == 400
+
+def test_generate_stream():
+    response = _post('/api/generate/stream', {'model': 'stub-a', 'userPrompt': 'hello there'})
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('text/event-stream')
+    events = _events(response)
+    assert ''.join(data['delta'] for event, data in events if event == 'message') == '[stub-a] echo: hello there '
+    event, stats = events[-1]
+    assert event == 'done'
+    assert stats['model'] == 'stub-a'
+    assert stats['completionTokens'] == 4
+
+def test_generate_stream_invalid_model():
+    response = _post('/api/generate/stream', {'model': 'no-such-model', 'userPrompt': 'hello'})
+    assert response.status_code == 400
+
+def test_generate_repeats_are_served_from_the_response_cache():
+    body = {'model': 'stub-a', 'userPrompt': 'cache me through asgi', 'temperature': 0}
+    stats = response_cache.snapshot()
+    first = _post('/api/generate', body)
+    assert 'cached' not in first.json()
+    second = _post('/api/generate', body)
+    assert second.json() == {'response': first.json()['response'], 'cached': True}
+    assert response_cache.snapshot()['hits'] == stats['hits'] + 1
+
+    streamed = _events(_post('/api/generate/stream', body))
+    assert streamed[0] == ('message', {'delta': first.json()['response']})
+    assert streamed[-1][1]['cached'] is True
+
+def test_non_deterministic_generates_bypass_the_response_cache():
+    bypassed = response_cache.snapshot()['bypassed']
+    _post('/api/generate', {'model': 'stub-a', 'userPrompt': 'hello', 'temperature': 0.7})
+    _post('/api/generate/stream', {'model': 'stub-a', 'userPrompt': 'hello', 'temperature': 0.7})
+    assert response_cache.snapshot()['bypassed'] == bypassed + 2
+
+def _sample(name, **labels):
+    selector = ','.join(f'{key}="{value}"' for key, value in labels.items())
+    prefix = f'{name}{{{selector}'
+    for line in metrics.render().splitlines():
+        if line.startswith(prefix):
+            return float(line.rsplit(' ', 1)[1])
+    return 0.0
+
+def test_native_generate_records_metrics():
+    requests = _sample('http_request_duration_seconds_count', endpoint='llm.generate', method='POST', status='200')
+    upstream = _sample('llm_upstream_latency_seconds_count', model='stub-metrics', outcome='ok')
+    _post('/api/generate', {'model': 'stub-metrics', 'userPrompt': 'count me'})
+    assert _sample('http_request_duration_seconds_count', endpoint='llm.generate', method='POST', status='200') == requests + 1
+    assert _sample('llm_upstream_latency_seconds_count', model='stub-metrics', outcome='ok') == upstream + 1
+
+    streams = _sample('llm_time_to_first_token_seconds_count', model='stub-metrics')
+    _post('/api/generate/stream', {'model': 'stub-metrics', 'userPrompt': 'count me'})
+    assert _sample('llm_time_to_first_token_seconds_count', model='stub-metrics') == streams + 1
+    assert _sample('http_request_duration_seconds_count', endpoint='llm.generate_stream', method='POST', status='200') >= 1
+    assert _sample('llm_tokens_total', model='stub-metrics', kind='completion') > 0
@@ -0,0 +1,94 @@
+import asyncio
+from collections import Counter
+
+import pytest
+
+from backend.services import async_providers, stub_service
+
+SETTINGS = {'temperature': 0, 'maxTokens': 16, 'topP': 1, 'frequencyPenalty': 0, 'presencePenalty': 0}
+
+class Tracker:
+    """Stands in for the stub provider's agenerate, recording concurrent calls per model."""
+
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.active = Counter()
+        self.peak = Counter()
+        self.started = asyncio.Event()
+
+    def total(self):
+        return sum(self.active.values())
+
+    async def __call__(self, model, system_prompt, user_prompt, conversation, settings):
+        self.active[model] += 1
+        self.peak[model] = max(self.peak[model], self.active[model])
+        self.peak['*'] = max(self.peak['*'], self.total())
+        self.started.set()
+        try:
+            await asyncio.sleep(self.delay)
+            return f"{model}: {user_prompt}"
+        finally:
+            self.active[model] -= 1
+
+def _generate(model, prompt='hi'):
+    return async_providers.generate(model, '', prompt, [], SETTINGS)
+
+def test_model_limit(limits, monkeypatch):
+    limits(provider=10, model=2)
+
+    async def run():
+        tracker = Tracker()
+        monkeypatch.setattr(stub_service, 'agenerate', tracker)
+        results = await asyncio.gather(*[_generate('stub-a', str(i)) for i in range(6)], _generate('stub-b'))
+        return tracker, results
+
+    tracker, results = asyncio.run(run())
+    assert results[0] == 'stub-a: 0'
+    assert tracker.peak['stub-a'] == 2
+    # Another model of the same provider is not held up by stub-a's limit
+    assert tracker.peak['*'] == 3
+
+def test_provider_limit(limits, monkeypatch):
+    limits(provider=3, model=10)
+
+    async def run():
+        tracker = Tracker()
+        monkeypatch.setattr(stub_service, 'agenerate', tracker)
+        await asyncio.gather(*[_generate(model) for model in ('stub-a', 'stub-b', 'stub-c') for _ in range(3)])
+        return tracker
+
+    tracker = asyncio.run(run())
+    assert tracker.peak['*'] == 3
+
+def test_unsupported_model(limits):
+    limits(provider=1, model=1)
+    with pytest.raises(ValueError):
+        asyncio.run(_generate('no-such-model'))
+
+def test_cancelled_generate_releases_slot(limits, monkeypatch):
+    limits(provider=1, model=1)
+
+    async def run():
+        tracker = Tracker(delay=10)
+        monkeypatch.setattr(stub_service, 'agenerate', tracker)
+        call = asyncio.create_task(_generate('stub-a'))
+        await tracker.started.wait()
+        call.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await call
+        tracker.delay = 0
+        # Would wait forever if the cancelled call still held the slot
+        return await asyncio.wait_for(_generate('stub-a', 'next'), 1)
+
+    assert asyncio.run(run()) == 'stub-a: next'
+
+def test_closed_stream_releases_slot(limits):
+    limits(provider=1, model=1)
+
+    async def run():
+        deltas = async_providers.stream('stub-a', '', 'one two three', [], SETTINGS)
+        assert await deltas.__anext__()
+        await deltas.aclose()
+        return await asyncio.wait_for(_generate('stub-a', 'next'), 1)
+
+    assert asyncio.run(run()) == '[stub-a] echo: next '
@@ -0,0 +1,37 @@
+from backend.models import db, Conversation, Message
+from backend.services.auth_cache import conversation_owners, token_claims
+
+def test_verified_tokens_are_reused(app, login):
+    client = app.test_client()
+    headers = login('cache-user')
+    first = client.get('/auth/protected', headers=headers)
+    assert first.status_code == 200
+    assert token_claims.lookup(headers['Authorization'].split(' ', 1)[1]) is not None
+
+    assert client.get('/auth/protected', headers=headers).json == first.json
+    assert client.get('/auth/protected', headers={'Authorization': headers['Authorization'] + 'x'}).status_code == 422
+
+def _delete_elsewhere(app, conversation_id):
+    # Another worker deletes the conversation; this process's owner cache still has it
+    with app.app_context():
+        Message.query.filter_by(conversation_id=conversation_id).delete()
+        Conversation.query.filter_by(id=conversation_id).delete()
+        db.session.commit()
+    assert conversation_owners.get(conversation_id) is not None
+
+def test_writes_recheck_a_cached_owner(app, login):
+    client = app.test_client()
+    headers = login('owner-user')
+    for write in ('message', 'generate'):
+        conversation_id = client.post('/api/conversations', headers=headers, json={
+            'title': write, 'messages': [{'role': 'user', 'content': 'hello'}]}).json['id']
+        _delete_elsewhere(app, conversation_id)
+
+        if write == 'message':
+            response = client.post(f'/api/conversations/{conversation_id}/messages', headers=headers,
+                                   json={'role': 'user', 'content': 'too late'})
+        else:
+            response = client.post('/api/generate', headers=headers, json={
+                'model': 'stub-a', 'userPrompt': 'too late', 'conversationId': conversation_id})
+        assert response.status_code == 404
+        assert conversation_owners.get(conversation_id) is None
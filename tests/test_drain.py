@@ -0,0 +1,21 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from backend.app import drain_background_work
+from backend.routes import llm
+from backend.services.evals import eval_runner
+from backend.services.title_service import title_workers
+
+def test_drain_stops_at_the_deadline(app, monkeypatch):
+    monkeypatch.setattr(llm, '_batch_executor', ThreadPoolExecutor(max_workers=1))
+    # Shutting down stops the runners for good; give them fresh flags to set
+    monkeypatch.setattr(eval_runner, '_stopping', threading.Event())
+    monkeypatch.setattr(title_workers, '_stopping', threading.Event())
+    release = threading.Event()
+    llm._batch_executor.submit(release.wait, 5)
+
+    start = time.monotonic()
+    drain_background_work(0.2)
+    assert time.monotonic() - start < 1
+    release.set()
@@ -0,0 +1,39 @@
+import pytest
+
+from backend.models import db, Conversation
+from backend.services import lineage
+
+def _set_cache(app, conversation_id, cached):
+    with app.app_context():
+        if cached:
+            lineage.get_chain(db.session.get(Conversation, conversation_id))
+        else:
+            lineage.materialized.invalidate(conversation_id)
+        assert (lineage.cached_chain(conversation_id) is not None) == cached
+
+@pytest.fixture
+def conversation(app, login):
+    client = app.test_client()
+    headers = login('fork-user')
+    conversation_id = client.post('/api/conversations', headers=headers, json={'title': 'Forks', 'messages': [
+        {'role': 'user', 'content': 'one'},
+        {'role': 'assistant', 'content': 'two'},
+        {'role': 'user', 'content': 'three'},
+    ]}).json['id']
+    return client, headers, conversation_id
+
+@pytest.mark.parametrize('fork_index', [-1, 3, 100, 'one', 1.5, True])
+@pytest.mark.parametrize('cached', [False, True])
+def test_out_of_range_fork_indexes_are_rejected(conversation, fork_index, cached):
+    client, headers, conversation_id = conversation
+    _set_cache(client.application, conversation_id, cached)
+    response = client.post(f'/api/conversations/{conversation_id}/fork', headers=headers, json={'forkIndex': fork_index})
+    assert response.status_code == 400
+
+@pytest.mark.parametrize('cached', [False, True])
+def test_fork_inherits_up_to_the_index(conversation, cached):
+    client, headers, conversation_id = conversation
+    _set_cache(client.application, conversation_id, cached)
+    fork = client.post(f'/api/conversations/{conversation_id}/fork', headers=headers, json={'forkIndex': 1}).json['id']
+    messages = client.get(f'/api/conversations/{fork}/messages', headers=headers).json['messages']
+    assert [m['content'] for m in messages] == ['one', 'two']
@@ -0,0 +1,49 @@
+import threading
+import time
+
+import pytest
+
+from backend.services.scheduler import Scheduler
+
+ARGS = ('stub-a', '', 'hello', [], {'maxTokens': 16})
+
+@pytest.fixture
+def hedging():
+    scheduler = Scheduler()
+    scheduler.hedge_percentile = 0.5
+    scheduler.hedge_min_samples = 1
+    scheduler._record_latency('stub-a', 0.05)
+    return scheduler
+
+def _slow_then_fast():
+    calls = []
+
+    def call(*args):
+        calls.append(threading.current_thread().name)
+        if len(calls) == 1:
+            time.sleep(1)
+            return 'primary'
+        return 'hedge'
+    return call, calls
+
+def test_a_slow_primary_is_hedged(hedging):
+    call, calls = _slow_then_fast()
+    start = time.monotonic()
+    assert hedging.generate(call, ARGS) == ('hedge', 'stub-a')
+    assert time.monotonic() - start < 0.5
+    assert calls[0].startswith('hedge-primary_')
+    assert calls[1].startswith('hedge_')
+
+def test_hedges_do_not_queue_for_busy_threads(hedging):
+    hedging._hedge_slots = threading.BoundedSemaphore(1)
+    hedging._hedge_slots.acquire()
+    call, calls = _slow_then_fast()
+    assert hedging.generate(call, ARGS) == ('primary', 'stub-a')
+    assert len(calls) == 1
+
+def test_primaries_run_unhedged_on_the_caller_when_their_pool_is_busy(hedging):
+    hedging._primary_slots = threading.BoundedSemaphore(1)
+    hedging._primary_slots.acquire()
+    call, calls = _slow_then_fast()
+    assert hedging.generate(call, ARGS) == ('primary', 'stub-a')
+    assert calls == [threading.current_thread().name]
@@ -0,0 +1,38 @@
+def test_each_conversation_page_has_its_own_etag(app, login):
+    client = app.test_client()
+    headers = login('etag-user')
+    for title in ('first', 'second', 'third'):
+        client.post('/api/conversations', headers=headers, json={
+            'title': title, 'messages': [{'role': 'user', 'content': title}]})
+
+    first = client.get('/api/conversations?limit=2', headers=headers)
+    cursor = first.json['nextCursor']
+    second = client.get(f'/api/conversations?limit=2&cursor={cursor}', headers=headers)
+    assert first.headers['ETag'] != second.headers['ETag']
+    assert client.get('/api/conversations', headers=headers).headers['ETag'] != first.headers['ETag']
+
+    revalidate = dict(headers, **{'If-None-Match': first.headers['ETag']})
+    assert client.get(f'/api/conversations?limit=2&cursor={cursor}', headers=revalidate).status_code == 200
+    assert client.get('/api/conversations?limit=2', headers=revalidate).status_code == 304
+
+def test_etags_name_a_coding_only_when_the_body_is_compressed(app, login, monkeypatch):
+    client = app.test_client()
+    headers = dict(login('coding-user'), **{'Accept-Encoding': 'gzip'})
+    client.post('/api/conversations', headers=headers, json={
+        'title': 'small', 'messages': [{'role': 'user', 'content': 'small'}]})
+
+    monkeypatch.setitem(app.config, 'COMPRESS_MIN_SIZE', 1 << 20)
+    small = client.get('/api/conversations', headers=headers)
+    assert 'Content-Encoding' not in small.headers
+    assert not small.headers['ETag'].endswith('-gzip"')
+    revalidate = dict(headers, **{'If-None-Match': small.headers['ETag']})
+    assert client.get('/api/conversations', headers=revalidate).status_code == 304
+
+    monkeypatch.setitem(app.config, 'COMPRESS_MIN_SIZE', 0)
+    compressed = client.get('/api/conversations', headers=headers)
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert compressed.headers['ETag'] == small.headers['ETag'][:-1] + '-gzip"'
+    revalidate = dict(headers, **{'If-None-Match': compressed.headers['ETag']})
+    cached = client.get('/api/conversations', headers=revalidate)
+    assert cached.status_code == 304
+    assert cached.headers['ETag'] == compressed.headers['ETag']
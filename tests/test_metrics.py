@@ -0,0 +1,24 @@
+import threading
+
+from backend.metrics import Counter, Histogram, registry
+
+def _record_on_new_threads(record, count):
+    for _ in range(count):
+        thread = threading.Thread(target=record)
+        thread.start()
+        thread.join()
+
+def test_exited_threads_fold_their_shards_into_the_totals():
+    counter = Counter('test_thread_counter_total', 'Test counter.', ('kind',))
+    histogram = Histogram('test_thread_seconds', 'Test histogram.', ('kind',))
+    try:
+        _record_on_new_threads(lambda: (counter.inc(2, 'a'), histogram.observe(0.02, 'a')), 50)
+        counter.inc(1, 'a')
+
+        assert counter._shards == [counter._local.shard]
+        assert histogram._shards == []
+        assert 'test_thread_counter_total{kind="a"} 101' in counter.render()
+        assert 'test_thread_seconds_count{kind="a"} 50' in histogram.render()
+    finally:
+        registry.remove(counter)
+        registry.remove(histogram)
@@ -0,0 +1,66 @@
+"""Every query the conversation, message, search and prompt routes send must
+use an index. The routes are driven end to end and the SQL they emit is
+captured and explained, so the check follows the routes as they change."""
+from sqlalchemy import event
+
+from backend.migrations import check_query_plans, query_plan, scans_table
+from backend.models import db
+
+LONG = 'A pasted document that is long enough to go to the blob store. ' * 40
+
+def test_hot_queries_use_indexes(app):
+    with app.app_context():
+        assert check_query_plans() == {}
+
+def _drive_routes(client, headers):
+    conversation = client.post('/api/conversations', headers=headers, json={'title': 'Plans', 'messages': [
+        {'role': 'user', 'content': 'common words about query plans'},
+        {'role': 'assistant', 'content': LONG},
+        {'role': 'user', 'content': 'more common words'},
+    ]}).json['id']
+    fork = client.post(f'/api/conversations/{conversation}/fork', headers=headers, json={'forkIndex': 1}).json['id']
+    for conversation_id in (conversation, fork):
+        for prompt in ('first turn', 'second turn'):
+            assert client.post('/api/generate', headers=headers, json={
+                'model': 'stub-a', 'userPrompt': prompt, 'conversationId': conversation_id}).status_code == 200
+        client.post(f'/api/conversations/{conversation_id}/messages', headers=headers,
+                    json={'role': 'user', 'content': 'added by hand'})
+    client.get('/api/conversations?limit=1', headers=headers)
+    client.get(f'/api/conversations?cursor={fork}', headers=headers)
+    client.get(f'/api/conversations/{fork}/messages?limit=2', headers=headers)
+    client.get(f'/api/conversations/{fork}/messages?cursor=1', headers=headers)
+    client.get('/api/search?q=common+wor', headers=headers)
+    client.post('/api/prompts', headers=headers, json={'name': 'p', 'systemPrompt': LONG, 'userPrompt': 'u'})
+    client.get('/api/prompts', headers=headers)
+    client.get('/api/evals', headers=headers)
+    client.get(f'/api/conversations/{fork}/export', headers=headers).get_data()
+    client.get('/api/conversations/export', headers=headers).get_data()
+    assert client.delete(f'/api/conversations/{conversation}', headers=headers).status_code == 200
+    client.get(f'/api/conversations/{fork}/messages', headers=headers)
+
+def test_route_queries_use_indexes(app, login):
+    headers = login('plans')
+    client = app.test_client()
+    statements = {}
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+            statements.setdefault(statement, parameters)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', capture)
+    try:
+        _drive_routes(client, headers)
+    finally:
+        event.remove(engine, 'before_cursor_execute', capture)
+
+    assert any('message_fts' in statement for statement in statements)
+    with app.app_context():
+        problems = {}
+        for statement, parameters in statements.items():
+            plan = [row[-1] for row in db.session.connection().exec_driver_sql(
+                f"EXPLAIN QUERY PLAN {statement}", parameters)]
+            if scans_table(plan):
+                problems[statement] = plan
+    assert problems == {}
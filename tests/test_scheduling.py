@@ -0,0 +1,28 @@
+from flask_jwt_extended import create_access_token
+
+from backend.services import scheduler as scheduler_module
+from backend.services.auth_cache import client_key
+
+def test_clients_are_keyed_by_user_not_token(app, login):
+    headers = login('queue-user')
+    with app.app_context():
+        user_key = client_key(headers['Authorization'], '10.0.0.1')
+        other_token = create_access_token(identity=user_key.split(':', 1)[1])
+        assert user_key.startswith('user:')
+        assert client_key(f'Bearer {other_token}', '10.0.0.2') == user_key
+        assert client_key(None, '10.0.0.1') == '10.0.0.1'
+        assert client_key('Bearer not-a-token', '10.0.0.1') == '10.0.0.1'
+
+def test_requests_cannot_choose_their_priority(app, monkeypatch):
+    seen = []
+    real_generate = scheduler_module.scheduler.generate
+
+    def generate(call, args, client=None, priority=None):
+        seen.append(priority)
+        return real_generate(call, args, client, priority)
+    monkeypatch.setattr(scheduler_module.scheduler, 'generate', generate)
+
+    response = app.test_client().post('/api/generate', json={
+        'model': 'stub-a', 'userPrompt': 'let me in first', 'priority': 'high', 'cache': False})
+    assert response.status_code == 200
+    assert seen == [scheduler_module.INTERACTIVE_PRIORITY]
@@ -0,0 +1,50 @@
+import sqlite3
+
+from backend.models import db, Conversation, Message
+from backend.services import search
+from backend.services.blobs import blob_store
+
+def _long(word):
+    return f'A pasted document about {word} that is long enough to go to the blob store. ' * 40
+
+def _hits(client, headers, query):
+    response = client.get(f'/api/search?q={query}&types=message,prompt', headers=headers)
+    assert response.status_code == 200
+    return [(hit['type'], hit['id']) for hit in response.json['results']]
+
+def test_long_message_and_prompt_text_is_searchable(app, login):
+    headers = login('searcher')
+    client = app.test_client()
+    conversation_id = client.post('/api/conversations', headers=headers, json={
+        'title': 'Blobs', 'messages': [{'role': 'user', 'content': _long('zanzibar')}]}).json['id']
+    prompt_id = client.post('/api/prompts', headers=headers, json={
+        'name': 'p', 'systemPrompt': _long('quixotic'), 'userPrompt': 'u'}).json['prompt']['id']
+    with app.app_context():
+        message = Message.query.filter_by(conversation_id=conversation_id).one()
+        assert len(_long('zanzibar')) >= blob_store.min_size
+        assert message.content == '' and message.content_hash is not None
+        user_id = db.session.get(Conversation, conversation_id).user_id
+
+        assert _hits(client, headers, 'zanzibar') == [('message', message.id)]
+        assert _hits(client, headers, 'quixotic') == [('prompt', prompt_id)]
+        # The query other backends run
+        generic = search._search_generic(user_id, ['zanzibar'], ('message', 'prompt'), 20, 0, 'other')
+        assert [(row.type, row.id) for row in generic] == [('message', message.id)]
+        assert generic[0].snippet.startswith('A pasted document about zanzibar')
+
+def test_plain_sqlite_connections_can_write_messages(app, login):
+    headers = login('shell-user')
+    client = app.test_client()
+    conversation_id = client.post('/api/conversations', headers=headers, json={
+        'title': 'Shell', 'messages': [{'role': 'user', 'content': _long('marmalade')}]}).json['id']
+    with app.app_context():
+        path = db.engine.url.database
+    # A connection the app did not open, e.g. the sqlite3 shell
+    connection = sqlite3.connect(path)
+    with connection:
+        connection.execute("INSERT INTO message (content, role, conversation_id) VALUES (?, 'user', ?)",
+                           ('written from the shell', conversation_id))
+        connection.execute("UPDATE message SET role = 'assistant' WHERE conversation_id = ?", (conversation_id,))
+        connection.execute("DELETE FROM message WHERE content = ?", ('written from the shell',))
+    connection.close()
+    assert [kind for kind, _ in _hits(client, headers, 'marmalade')] == ['message']
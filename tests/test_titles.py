@@ -0,0 +1,14 @@
+from backend.services.title_service import title_workers
+
+def _fail(*args):
+    raise OSError("queue unavailable")
+
+def test_saving_survives_a_title_queue_failure(app, login, monkeypatch):
+    client = app.test_client()
+    headers = login('title-user')
+    monkeypatch.setattr(title_workers, 'enqueue', _fail)
+    response = client.post('/api/conversations', headers=headers, json={
+        'messages': [{'role': 'user', 'content': 'What is a good name for a cat?'}]})
+    assert response.status_code == 201
+    assert response.json['titlePending'] is False
+    assert client.get(f"/api/conversations/{response.json['id']}/messages", headers=headers).status_code == 200